@@ -0,0 +1,276 @@
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import time
+from typing import Callable, Dict, List, Tuple
+
+from triggers import DEFAULT_TRIGGERS, get_matcher
+
+WORDS = [
+    'the', 'code', 'works', 'now', 'typescript', 'python', 'error', 'stack', 'trace', 'deploy', 'why', 'does',
+    'this', 'fail', 'import', 'thankful', 'style', 'party', 'helpfully', 'tyre', 'thx4', 'please', 'review',
+    'my', 'pr', 'lol', 'docs', 'link', 'https://example.com/typing', 'anyone', 'know', 'how', 'to', 'fix',
+]
+EXTENDED_TRIGGERS = DEFAULT_TRIGGERS + (
+    'cheers', 'kudos', 'props', 'grateful', 'much obliged', 'legend', 'lifesaver', 'goat', 'big help',
+    'nice one', 'good call', 'well explained', 'ta', 'merci', 'danke', 'gracias', 'arigato', 'thankyou',
+    'thnx', 'tyvm', 'ily', 'saved me', 'great answer', 'solved it',
+)
+PHRASES = ['thanks', 'ty', 'tysm', 'thank you', 'appreciated', 'thx', 'helpful', 'Thanks!', 'TY', '(thx)']
+
+
+def legacy_contains_trigger_word(content: str, triggers=DEFAULT_TRIGGERS) -> bool:
+    content_lower = content.lower()
+    for trigger in triggers:
+        start_pos = 0
+        while True:
+            pos = content_lower.find(trigger, start_pos)
+            if pos == -1:
+                break
+            before_pos = pos - 1
+            after_pos = pos + len(trigger)
+            before_ok = before_pos < 0 or content_lower[before_pos].isspace() or not content_lower[before_pos].isalnum()
+            after_ok = after_pos >= len(content_lower) or content_lower[after_pos].isspace() or not content_lower[after_pos].isalnum()
+            if before_ok and after_ok:
+                return True
+            start_pos = pos + 1
+    return False
+
+
+def message_corpus(size: int, seed: int = 1234, trigger_ratio: float = 0.15) -> List[str]:
+    rng = random.Random(seed)
+    corpus = []
+    for _ in range(size):
+        words = [rng.choice(WORDS) for _ in range(rng.randint(3, 60))]
+        if rng.random() < trigger_ratio:
+            words.insert(rng.randrange(len(words) + 1), rng.choice(PHRASES))
+        corpus.append(' '.join(words))
+    return corpus
+
+
+def time_per_call(func: Callable[[str], object], corpus: List[str], repeat: int) -> float:
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for content in corpus:
+            func(content)
+        best = min(best, time.perf_counter() - start)
+    return best / len(corpus)
+
+
+def bench_triggers(args) -> Dict[str, float]:
+    corpus = message_corpus(args.messages)
+    results = {}
+    for label, triggers in (('default', DEFAULT_TRIGGERS), ('extended', EXTENDED_TRIGGERS)):
+        matcher = get_matcher(triggers)
+        legacy_scan = lambda content: legacy_contains_trigger_word(content, triggers)
+        mismatches = [content for content in corpus if matcher.matches(content) != legacy_scan(content)]
+        if mismatches:
+            raise SystemExit(f"Matcher disagrees with legacy scan on {len(mismatches)} message(s), e.g. {mismatches[0]!r}")
+        legacy = time_per_call(legacy_scan, corpus, args.repeat)
+        compiled = time_per_call(matcher.matches, corpus, args.repeat)
+        print(f"trigger match, {len(triggers)} triggers, {len(corpus)} messages (best of {args.repeat})")
+        print(f"  legacy find() scan : {legacy * 1e6:8.2f} us/msg")
+        print(f"  compiled matcher   : {compiled * 1e6:8.2f} us/msg")
+        print(f"  speedup            : {legacy / compiled:8.2f}x")
+        results[f'{label}_legacy_us'] = legacy * 1e6
+        results[f'{label}_compiled_us'] = compiled * 1e6
+    return results
+
+
+TRAFFIC_MIX = (
+    ('rep', 60),
+    ('leaderboard', 15),
+    ('leaderboard_page', 5),
+    ('profile', 10),
+    ('warn', 5),
+    ('warnings', 5),
+)
+
+
+def synthetic_traffic(size: int, guilds: int = 5, users: int = 2000, channels: int = 20, seed: int = 4321) -> List[Tuple[str, tuple]]:
+    rng = random.Random(seed)
+    kinds = [kind for kind, _ in TRAFFIC_MIX]
+    weights = [weight for _, weight in TRAFFIC_MIX]
+    traffic = []
+    for _ in range(size):
+        kind = rng.choices(kinds, weights)[0]
+        guild_id = str(rng.randrange(guilds))
+        # Skewed user choice so a few helpers collect most of the reps.
+        user_id = str(int(rng.paretovariate(1.2)) % users)
+        channel_id = str(rng.randrange(channels))
+        if kind == 'rep':
+            args = (guild_id, user_id, channel_id, f"channel-{channel_id}", str(rng.randrange(users)))
+        elif kind == 'leaderboard':
+            args = (guild_id, channel_id if rng.random() < 0.3 else None, 10)
+        elif kind == 'leaderboard_page':
+            args = (guild_id, None, {'user_id': user_id, 'count': rng.randint(1, 5)}, 10)
+        elif kind == 'warn':
+            args = (guild_id, user_id, "synthetic warning", "0")
+        else:
+            args = (guild_id, user_id)
+        traffic.append((kind, args))
+    return traffic
+
+
+def percentile(samples: List[float], pct: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+async def replay(backend, traffic: List[Tuple[str, tuple]], concurrency: int) -> Tuple[Dict[str, List[float]], float]:
+    calls = {
+        'rep': backend.record_rep,
+        'leaderboard': backend.top_users,
+        'leaderboard_page': backend.users_after,
+        'profile': backend.get_profile,
+        'warn': backend.add_warning,
+        'warnings': backend.get_warnings,
+    }
+    latencies: Dict[str, List[float]] = {kind: [] for kind, _ in TRAFFIC_MIX}
+    queue = iter(traffic)
+
+    async def worker():
+        for kind, args in queue:
+            start = time.perf_counter()
+            await calls[kind](*args)
+            latencies[kind].append(time.perf_counter() - start)
+
+    await backend.start()
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    await backend.close()
+    return latencies, time.perf_counter() - start
+
+
+def open_backend(name: str, workdir: str):
+    if name == 'sqlite':
+        from sqlite_backend import SQLiteBackend
+        return SQLiteBackend(os.path.join(workdir, 'bench.sqlite3'))
+    from storage import create_backend
+    return create_backend(name)
+
+
+def bench_storage(args) -> Dict[str, float]:
+    traffic = synthetic_traffic(args.ops)
+    results = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        for name in args.backends.split(','):
+            latencies, elapsed = asyncio.run(replay(open_backend(name, workdir), traffic, args.concurrency))
+            print(f"storage replay, {name} backend, {len(traffic)} ops, concurrency {args.concurrency}: "
+                  f"{len(traffic) / elapsed:,.0f} ops/sec overall")
+            print(f"  {'op':<18}{'count':>8}{'mean ms':>10}{'p50 ms':>10}{'p99 ms':>10}")
+            for kind, samples in latencies.items():
+                if not samples:
+                    continue
+                print(f"  {kind:<18}{len(samples):>8}{sum(samples) / len(samples) * 1e3:>10.3f}"
+                      f"{percentile(samples, 50) * 1e3:>10.3f}{percentile(samples, 99) * 1e3:>10.3f}")
+            results[f'{name}_ops_per_sec'] = len(traffic) / elapsed
+    return results
+
+
+class FakeUser:
+    def __init__(self, user_id: int, bot: bool = False):
+        self.id = user_id
+        self.bot = bot
+        self.mention = f"<@{user_id}>"
+        self.display_name = f"user-{user_id}"
+
+
+class FakeGuild:
+    def __init__(self, guild_id: int):
+        self.id = guild_id
+
+
+class FakeChannel:
+    def __init__(self, channel_id: int):
+        self.id = channel_id
+        self.name = f"channel-{channel_id}"
+        self.sent = 0
+
+    async def send(self, content: str, **kwargs):
+        self.sent += 1
+
+
+class FakeMessage:
+    def __init__(self, content: str, author: FakeUser, guild: FakeGuild, channel: FakeChannel, mentions: List[FakeUser]):
+        self.content = content
+        self.author = author
+        self.guild = guild
+        self.channel = channel
+        self.mentions = mentions
+
+
+def message_stream(size: int, guilds: int = 5, users: int = 2000, mention_ratio: float = 0.2,
+                   bot_ratio: float = 0.05, seed: int = 99) -> List[FakeMessage]:
+    # Plain chatter with a minority of messages mentioning someone; the
+    # trigger phrases come from message_corpus at its usual ratio.
+    rng = random.Random(seed)
+    members = [FakeUser(user_id) for user_id in range(users)]
+    bots = [FakeUser(users + i, bot=True) for i in range(5)]
+    guild_objects = [FakeGuild(guild_id) for guild_id in range(guilds)]
+    channels = [FakeChannel(channel_id) for channel_id in range(20)]
+    stream = []
+    for content in message_corpus(size, seed):
+        author = rng.choice(bots) if rng.random() < bot_ratio else rng.choice(members)
+        mentions = rng.sample(members, rng.randint(1, 2)) if rng.random() < mention_ratio else []
+        stream.append(FakeMessage(content, author, rng.choice(guild_objects), rng.choice(channels), mentions))
+    return stream
+
+
+def bench_handler(args) -> Dict[str, float]:
+    os.environ.setdefault('STORAGE_BACKEND', 'memory')
+    import bot
+    from cooldowns import LocalCooldownStore
+    from guild_config import DEFAULT_COOLDOWN_SECONDS
+
+    stream = message_stream(args.messages)
+    counts = {'chatter': sum(1 for message in stream if not message.mentions)}
+    counts['mentions'] = len(stream) - counts['chatter']
+
+    async def run() -> Dict[str, float]:
+        bot.cooldown_store = LocalCooldownStore(DEFAULT_COOLDOWN_SECONDS)
+        bot.afk_cache.finish_load((str(guild_id), str(user_id), "away") for guild_id in range(5) for user_id in range(0, 2000, 40))
+        elapsed = {'chatter': 0.0, 'mentions': 0.0}
+        for message in stream:
+            start = time.perf_counter()
+            await bot.handle_message(message)
+            elapsed['mentions' if message.mentions else 'chatter'] += time.perf_counter() - start
+        return elapsed
+
+    runs = [asyncio.run(run()) for _ in range(args.repeat)]
+    best = min(runs, key=lambda elapsed: sum(elapsed.values()))
+    total = sum(best.values())
+    print(f"on_message handler, {len(stream)} synthetic messages (best of {args.repeat}, channel sends stubbed)")
+    print(f"  {'messages':<10}{'count':>8}{'msgs/sec':>14}{'us/msg':>10}")
+    for kind in ('chatter', 'mentions'):
+        print(f"  {kind:<10}{counts[kind]:>8}{counts[kind] / best[kind]:>14,.0f}{best[kind] / counts[kind] * 1e6:>10.2f}")
+    print(f"  {'overall':<10}{len(stream):>8}{len(stream) / total:>14,.0f}{total / len(stream) * 1e6:>10.2f}")
+    return {'handler_msgs_per_sec': len(stream) / total, 'chatter_msgs_per_sec': counts['chatter'] / best['chatter']}
+
+
+BENCHMARKS = {
+    'triggers': bench_triggers,
+    'storage': bench_storage,
+    'handler': bench_handler,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Resource bot micro-benchmarks")
+    parser.add_argument('benchmarks', nargs='*', choices=[[]] + list(BENCHMARKS), help="Benchmarks to run (default: all)")
+    parser.add_argument('--messages', type=int, default=20000, help="Synthetic messages per run")
+    parser.add_argument('--repeat', type=int, default=5, help="Runs per benchmark; the best is reported")
+    parser.add_argument('--ops', type=int, default=20000, help="Synthetic storage operations to replay")
+    parser.add_argument('--concurrency', type=int, default=8, help="Concurrent storage replay workers")
+    parser.add_argument('--backends', default='memory,sqlite',
+                        help="Comma-separated storage backends to replay against (memory, sqlite, firestore)")
+    args = parser.parse_args()
+    for name in args.benchmarks or BENCHMARKS:
+        BENCHMARKS[name](args)
+
+
+if __name__ == "__main__":
+    main()
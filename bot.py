@@ -2,215 +2,378 @@ import os
 import logging
 import asyncio
 import datetime
-from typing import Dict, List, Optional
+import math
+import re
+import time
+from collections import Counter
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+STARTED_AT = time.perf_counter()
+
 import discord
 from discord import app_commands
 from discord.ext import commands
 from discord.ui import Button, View
 from dotenv import load_dotenv
-import firebase_admin
-from firebase_admin import credentials, firestore
 
+# The local modules read their settings from the environment at import time.
 load_dotenv()
+
+from cache import AfkCache, LeaderboardCache, NameCache, RenderCache
+from cooldowns import COOLDOWN_BACKEND, LocalCooldownStore
+from guild_config import DEFAULT_COOLDOWN_SECONDS, GuildConfig, GuildConfigCache
+from metrics import metrics
+from outbox import Outbox
+from sharding import SHARD_STATS_INTERVAL, shard_plan
+from storage import ProgressCallback, create_backend, rep_day
+from triggers import DEFAULT_TRIGGERS, normalize_triggers
+
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger('resource_bot')
 
-ADMIN_USERS = [123456789012345678]
-COOLDOWN_SECONDS = 60 * 60
-rep_cooldowns = {}
-afk_users = {}
+COMMAND_PREFIX = '!'
+REP_FANOUT_LIMIT = int(os.getenv('REP_FANOUT_LIMIT', '5'))
+PROGRESS_UPDATE_SECONDS = 2
+MEMBER_QUERY_LIMIT = 100
+# Bulk moderation keeps a few requests in flight; discord.py waits out each
+# route's rate limit, so more would only queue behind it.
+BULK_MOD_CONCURRENCY = int(os.getenv('BULK_MOD_CONCURRENCY', '4'))
+BULK_MOD_MAX_TARGETS = int(os.getenv('BULK_MOD_MAX_TARGETS', '500'))
+BULK_JOIN_WINDOW_MINUTES = 24 * 60
+MAX_TIMEOUT_MINUTES = 28 * 24 * 60
+PURGE_MAX_MESSAGES = int(os.getenv('PURGE_MAX_MESSAGES', '1000'))
+PURGE_CHUNK_SIZE = 100
+MAX_CONFIG_COOLDOWN_MINUTES = 7 * 24 * 60
+MAX_TRIGGERS = 50
+MAX_TRIGGER_LENGTH = 50
+PROFILE_TOP_N = 5
+LEADERBOARD_PERIODS = {'week': (7, "This Week"), 'month': (30, "This Month")}
+# Daily buckets are kept a little longer than the longest window.
+REP_DAY_RETENTION_DAYS = int(os.getenv('REP_DAY_RETENTION_DAYS', '35'))
+REP_DAY_COMPACT_INTERVAL = 24 * 60 * 60
+first_command_logged = False
+afk_cache = AfkCache()
+leaderboard_cache = LeaderboardCache()
+name_cache = NameCache()
+render_cache = RenderCache()
+outbox = Outbox()
+guild_configs = GuildConfigCache()
 
 try:
-    cred = credentials.Certificate({
-        "type": "service_account",
-        "project_id": os.getenv('FIREBASE_PROJECT_ID'),
-        "private_key_id": os.getenv('FIREBASE_PRIVATE_KEY_ID'),
-        "private_key": os.getenv('FIREBASE_PRIVATE_KEY').replace("\\n", "\n"),
-        "client_email": os.getenv('FIREBASE_CLIENT_EMAIL'),
-        "client_id": os.getenv('FIREBASE_CLIENT_ID'),
-        "auth_uri": "https://accounts.google.com/o/oauth2/auth",
-        "token_uri": "https://oauth2.googleapis.com/token",
-        "auth_provider_x509_cert_url": "https://www.googleapis.com/oauth2/v1/certs",
-        "client_x509_cert_url": os.getenv('FIREBASE_CLIENT_CERT_URL')
-    })
-    firebase_admin.initialize_app(cred)
-    db = firestore.client()
-    resources_collection = db.collection('resources')
-    channels_collection = db.collection('channels')
-    warnings_collection = db.collection('warnings')
-    afk_collection = db.collection('afk')
-    logger.info("Firebase initialized successfully")
+    storage = create_backend()
 except Exception as e:
-    logger.error(f"Failed to initialize Firebase: {e}")
+    logger.error(f"Failed to initialize storage: {e}")
     raise
+cooldown_store = storage.shared_cooldown_store(DEFAULT_COOLDOWN_SECONDS) if COOLDOWN_BACKEND == 'firestore' else None
+if cooldown_store is None:
+    cooldown_store = LocalCooldownStore(DEFAULT_COOLDOWN_SECONDS)
+
+metrics.register_gauges('leaderboard_cache', leaderboard_cache.stats)
+metrics.register_gauges('render_cache', render_cache.stats)
+metrics.register_gauges('name_cache', name_cache.stats)
+metrics.register_gauges('storage_executor', lambda: storage.executor.stats())
+metrics.register_gauges('outbox', outbox.stats)
+metrics.register_gauges('guild_config', guild_configs.stats)
+metrics.register_gauges('state', lambda: {'afk_users': len(afk_cache), 'cooldowns': len(cooldown_store)})
+metrics.register_gauges('shards', lambda: {
+    f"{shard_id}_{key}": value
+    for shard_id, stats in collect_shard_stats().items()
+    for key, value in stats.items() if key in ('guilds', 'latency_ms', 'messages')
+})
 
 intents = discord.Intents.default()
 intents.message_content = True
 intents.members = True
-bot = commands.Bot(command_prefix='!', intents=intents)
 
-resource_triggers = ['thanks', 'ty', 'tysm', 'thank you', 'appreciated', 'thx', 'helpful']
+class ResourceBot(commands.AutoShardedBot):
+    shard_stats_task: Optional[asyncio.Task] = None
+    compaction_task: Optional[asyncio.Task] = None
+    config_task: Optional[asyncio.Task] = None
+    warm_up_task: Optional[asyncio.Task] = None
 
-def contains_trigger_word(content: str) -> bool:
-    content_lower = content.lower()
-    for trigger in resource_triggers:
-        start_pos = 0
+    async def setup_hook(self):
+        await storage.start()
+        await metrics.start()
+        # setup_hook runs before the gateway connects, so nothing here waits
+        # on storage; guilds use the default config until theirs loads.
+        self.config_task = asyncio.create_task(guild_configs.start(storage, shard_plan.owns))
+        self.warm_up_task = asyncio.create_task(self.warm_up_storage())
+        self.shard_stats_task = asyncio.create_task(self.publish_shard_stats()) if shard_plan.multi_process else None
+        self.compaction_task = asyncio.create_task(self.compact_rep_days()) if shard_plan.owns_shard(0) else None
+
+    async def warm_up_storage(self):
+        try:
+            await storage.warm_up()
+            logger.info(f"Storage warmed up {time.perf_counter() - STARTED_AT:.2f}s after start")
+        except Exception as e:
+            logger.error(f"Storage warm-up failed: {e}")
+
+    async def publish_shard_stats(self):
+        # With shards spread over processes each one only sees its own;
+        # publishing through storage lets /botstats report the whole fleet.
         while True:
-            pos = content_lower.find(trigger, start_pos)
-            if pos == -1:
-                break
-            before_pos = pos - 1
-            after_pos = pos + len(trigger)
-            before_ok = before_pos < 0 or content_lower[before_pos].isspace() or not content_lower[before_pos].isalnum()
-            after_ok = after_pos >= len(content_lower) or content_lower[after_pos].isspace() or not content_lower[after_pos].isalnum()
-            if before_ok and after_ok:
-                return True
-            start_pos = pos + 1
-    return False
+            await asyncio.sleep(SHARD_STATS_INTERVAL)
+            for shard_id, stats in collect_shard_stats().items():
+                try:
+                    await storage.publish_shard_stats(shard_id, stats)
+                except Exception as e:
+                    logger.error(f"Error publishing stats for shard {shard_id}: {e}")
+
+    async def compact_rep_days(self):
+        while True:
+            try:
+                removed = await storage.compact_rep_days(rep_day(days_ago=REP_DAY_RETENTION_DAYS))
+                logger.info(f"Compacted {removed} expired daily rep bucket(s)")
+            except Exception as e:
+                logger.error(f"Error compacting daily rep buckets: {e}")
+            await asyncio.sleep(REP_DAY_COMPACT_INTERVAL)
+
+    async def close(self):
+        # Background tasks are stopped before storage closes under them.
+        tasks = [task for task in (self.shard_stats_task, self.compaction_task, self.config_task, self.warm_up_task)
+                 if task is not None]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await outbox.close()
+        await guild_configs.close()
+        await storage.close()
+        await metrics.close()
+        await super().close()
 
-async def add_resource(guild_id: str, user_id: str, channel_id: str, channel_name: str, given_by: str) -> bool:
+bot = ResourceBot(command_prefix=COMMAND_PREFIX, intents=intents, shard_ids=shard_plan.shard_ids, shard_count=shard_plan.shard_count)
+
+def collect_shard_stats() -> Dict[int, Dict]:
+    guilds = Counter(guild.shard_id for guild in bot.guilds)
+    return {
+        shard_id: {
+            'shard_id': shard_id,
+            'shard_count': bot.shard_count,
+            'guilds': guilds.get(shard_id, 0),
+            'latency_ms': round(shard.latency * 1000) if math.isfinite(shard.latency) else None,
+            'messages': metrics.counters.get(f"shard.{shard_id}.messages", 0),
+            'online': not shard.is_closed(),
+            'updated_at': time.time(),
+        }
+        for shard_id, shard in bot.shards.items()
+    }
+
+async def add_resource(guild_id: str, user_id: str, channel_id: str, channel_name: str, given_by: str,
+                       display_name: Optional[str] = None) -> bool:
     try:
-        user_doc_id = f"{guild_id}_{user_id}"
-        user_ref = resources_collection.document(user_doc_id)
-        channel_doc_id = f"{guild_id}_{channel_id}"
-        channel_ref = channels_collection.document(channel_doc_id)
-        
-        user_doc = user_ref.get()
-        if not user_doc.exists:
-            user_ref.set({
-                'guild_id': guild_id,
-                'user_id': user_id,
-                'count': 1,
-                'channels': {channel_id: {'name': channel_name, 'count': 1}},
-                'given_by': {given_by: 1}
-            })
-        else:
-            user_data = user_doc.to_dict()
-            new_count = user_data.get('count', 0) + 1
-            channels = user_data.get('channels', {})
-            if channel_id in channels:
-                channels[channel_id]['count'] = channels[channel_id].get('count', 0) + 1
-                channels[channel_id]['name'] = channel_name
-            else:
-                channels[channel_id] = {'name': channel_name, 'count': 1}
-            given_by_dict = user_data.get('given_by', {})
-            given_by_dict[given_by] = given_by_dict.get(given_by, 0) + 1
-            user_ref.update({
-                'count': new_count,
-                'channels': channels,
-                'given_by': given_by_dict
-            })
-        
-        channel_doc = channel_ref.get()
-        if not channel_doc.exists:
-            channel_ref.set({
-                'guild_id': guild_id,
-                'channel_id': channel_id,
-                'channel_name': channel_name,
-                'users': {user_id: 1},
-                'total_resources': 1
-            })
-        else:
-            channel_data = channel_doc.to_dict()
-            new_total = channel_data.get('total_resources', 0) + 1
-            users = channel_data.get('users', {})
-            users[user_id] = users.get(user_id, 0) + 1
-            channel_ref.update({
-                'channel_name': channel_name,
-                'total_resources': new_total,
-                'users': users
-            })
-        
+        await storage.record_rep(guild_id, user_id, channel_id, channel_name, given_by, display_name)
+        leaderboard_cache.record(guild_id, channel_id, user_id, display_name=display_name)
         return True
     except Exception as e:
         logger.error(f"Error adding resource: {e}")
         return False
 
-async def get_profile(guild_id: str, user_id: str) -> Dict:
+async def get_profile(guild_id: str, user_id: str, top_n: int = PROFILE_TOP_N) -> Dict:
     try:
-        doc_id = f"{guild_id}_{user_id}"
-        doc = resources_collection.document(doc_id).get()
-        if not doc.exists:
-            return {'user_id': user_id, 'guild_id': guild_id, 'count': 0, 'channels': {}, 'given_by': {}}
-        return doc.to_dict()
+        profile = await storage.get_profile(guild_id, user_id, top_n)
+        if profile is None:
+            return {'user_id': user_id, 'guild_id': guild_id, 'count': 0, 'top_channels': [], 'top_givers': []}
+        return profile
     except Exception as e:
         logger.error(f"Error getting profile: {e}")
-        return {'user_id': user_id, 'guild_id': guild_id, 'count': 0, 'channels': {}, 'given_by': {}}
+        return {'user_id': user_id, 'guild_id': guild_id, 'count': 0, 'top_channels': [], 'top_givers': []}
 
-async def get_leaderboard(guild_id: str, limit: int = 10, channel_id: Optional[str] = None) -> List[Dict]:
+async def get_window_leaderboard(guild_id: str, period: str) -> List[Dict]:
+    # A window is at most a month of daily buckets, so it is summed whole
+    # and memoized until the next rep or the next UTC day.
+    days, _ = LEADERBOARD_PERIODS[period]
+    since_day = rep_day(days_ago=days - 1)
+    key = ('window', guild_id, period, since_day)
+    version = leaderboard_cache.version(guild_id)
+    cached = render_cache.get(key, version)
+    if cached is not None:
+        return cached
     try:
-        if channel_id:
-            channel_doc_id = f"{guild_id}_{channel_id}"
-            channel_doc = channels_collection.document(channel_doc_id).get()
-            if not channel_doc.exists:
-                return []
-            channel_data = channel_doc.to_dict()
-            users = channel_data.get('users', {})
-            user_list = [{'user_id': user_id, 'count': count} for user_id, count in users.items()]
-            user_list.sort(key=lambda x: x['count'], reverse=True)
-            return user_list[:limit]
-        else:
-            query = (resources_collection
-                    .where('guild_id', '==', guild_id)
-                    .order_by('count', direction=firestore.Query.DESCENDING)
-                    .limit(limit))
-            docs = query.stream()
-            return [doc.to_dict() for doc in docs]
+        rows = await storage.window_totals(guild_id, since_day)
+    except Exception as e:
+        logger.error(f"Error getting {period} leaderboard: {e}")
+        return []
+    render_cache.set(key, version, rows)
+    return rows
+
+async def get_leaderboard_page(guild_id: str, limit: int = 10, channel_id: Optional[str] = None, offset: int = 0,
+                               after: Optional[Dict] = None, period: str = 'all') -> List[Dict]:
+    if period in LEADERBOARD_PERIODS:
+        return (await get_window_leaderboard(guild_id, period))[offset:offset + limit]
+    cached = leaderboard_cache.page(guild_id, channel_id, offset, limit)
+    if cached is not None:
+        return cached
+    try:
+        if offset + limit <= leaderboard_cache.top_k:
+            top = await storage.top_users(guild_id, channel_id, leaderboard_cache.top_k)
+            leaderboard_cache.seed(guild_id, channel_id, top, complete=len(top) < leaderboard_cache.top_k)
+            return top[offset:offset + limit]
+        if after is None:
+            return []
+        return await storage.users_after(guild_id, channel_id, after, limit)
     except Exception as e:
         logger.error(f"Error getting leaderboard: {e}")
         return []
 
+async def resolve_member_names(guild: discord.Guild, entries: List[Dict]) -> Dict[str, str]:
+    # Member cache first, then names resolved earlier, then one gateway
+    # query for everyone still missing. Members who have left fall back to
+    # the name stored with their last rep. Fallbacks are only cached
+    # briefly, and not at all when the query failed.
+    guild_id = str(guild.id)
+    names = {}
+    missing = []
+    queried = False
+    for entry in entries:
+        user_id = entry['user_id']
+        member = guild.get_member(int(user_id))
+        name = member.display_name if member else name_cache.get(guild_id, user_id)
+        if name is None:
+            missing.append(int(user_id))
+        else:
+            names[user_id] = name
+    if missing:
+        try:
+            for member in await guild.query_members(user_ids=missing[:MEMBER_QUERY_LIMIT], cache=True):
+                names[str(member.id)] = member.display_name
+                name_cache.set(guild_id, str(member.id), member.display_name)
+            queried = True
+        except Exception as e:
+            logger.error(f"Error querying members: {e}")
+    queried_ids = set(missing[:MEMBER_QUERY_LIMIT]) if queried else set()
+    for entry in entries:
+        user_id = entry['user_id']
+        if user_id not in names:
+            names[user_id] = entry.get('display_name') or f"User {user_id}"
+            if int(user_id) in queried_ids:
+                name_cache.set(guild_id, user_id, names[user_id], fallback=True)
+    return names
+
+async def get_rank(guild_id: str, count: int) -> Optional[int]:
+    if not count:
+        return None
+    rank = leaderboard_cache.rank(guild_id, count)
+    if rank is not None:
+        return rank
+    try:
+        return await storage.rank_of(guild_id, count)
+    except Exception as e:
+        logger.error(f"Error getting rank: {e}")
+        return None
+
+async def build_leaderboard_embed(guild: discord.Guild, entries: List[Dict], page: int, per_page: int, period: str = 'all') -> discord.Embed:
+    title = "📚 Resource Repository Leaderboard"
+    if period in LEADERBOARD_PERIODS:
+        title += f" — {LEADERBOARD_PERIODS[period][1]}"
+    embed = discord.Embed(title=title, color=discord.Color.gold())
+    
+    if not entries:
+        embed.add_field(name="No entries found", value="Be the first to contribute!", inline=False)
+    else:
+        names = await resolve_member_names(guild, entries)
+        for i, entry in enumerate(entries, (page - 1) * per_page + 1):
+            count = entry.get('count', 0)
+            medal = "🥇" if i == 1 else "🥈" if i == 2 else "🥉" if i == 3 else f"{i}."
+            embed.add_field(name=f"{medal} {names[entry['user_id']]}", value=f"**{count}** contribution{'s' if count != 1 else ''}", inline=False)
+    return embed
+
+async def render_leaderboard_page(guild: discord.Guild, page: int, per_page: int = 10, channel_id: Optional[str] = None,
+                                  after: Optional[Dict] = None, period: str = 'all') -> Tuple[discord.Embed, List[Dict]]:
+    # Rendered pages are reused until a rep lands in the guild. The version
+    # is read before any await, so a rep recorded mid-render makes this
+    # render stale rather than getting cached under the new version.
+    # Windowed pages are also keyed by day, so one rendered before UTC
+    # midnight isn't served after it, and the footer's time is added to a
+    # copy on the way out rather than cached.
+    guild_id = str(guild.id)
+    key = ('leaderboard', guild_id, channel_id, period, rep_day() if period in LEADERBOARD_PERIODS else None, page)
+    version = leaderboard_cache.version(guild_id)
+    cached = render_cache.get(key, version)
+    if cached is not None:
+        embed, entries = cached
+    else:
+        entries = await get_leaderboard_page(guild_id, per_page, channel_id, (page - 1) * per_page, after, period)
+        embed = await build_leaderboard_embed(guild, entries, page, per_page, period)
+        # Storage errors come back as empty pages; those aren't worth pinning.
+        if entries:
+            render_cache.set(key, version, (embed, entries))
+    embed = embed.copy()
+    embed.set_footer(text=f"Page {page} • Updated {datetime.datetime.now().strftime('%Y-%m-%d %H:%M')}")
+    return embed, entries
+
+async def render_profile(member: discord.Member) -> discord.Embed:
+    guild_id = str(member.guild.id)
+    key = ('profile', guild_id, str(member.id))
+    version = leaderboard_cache.version(guild_id)
+    cached = render_cache.get(key, version)
+    if cached is not None:
+        return cached
+    profile = await get_profile(guild_id, str(member.id))
+    rep_count = profile.get('count', 0)
+    rank = await get_rank(guild_id, rep_count)
+    
+    embed = discord.Embed(title=f"📚 Resource Profile: {member.display_name}", color=member.color or discord.Color.blue())
+    embed.set_thumbnail(url=member.display_avatar.url)
+    
+    embed.add_field(name="Total Contributions", value=f"**{rep_count}** acknowledgment{'s' if rep_count != 1 else ''}", inline=True)
+    if rank is not None:
+        embed.add_field(name="Rank", value=f"**#{rank}**", inline=True)
+    
+    # Storage returns only the top-N of each, already ordered.
+    channels = profile.get('top_channels', [])
+    if channels:
+        embed.add_field(name="Top Channels", value="\n".join(
+            f"<#{channel['channel_id']}> • {channel['count']}" for channel in channels), inline=False)
+    
+    givers = profile.get('top_givers', [])
+    if givers:
+        embed.add_field(name="Most Acknowledged By", value="\n".join(
+            f"<@{giver['user_id']}> • {giver['count']}" for giver in givers), inline=False)
+    if rep_count:
+        render_cache.set(key, version, embed)
+    return embed
+
 async def add_warning(guild_id: str, user_id: str, reason: str, mod_id: str) -> bool:
     try:
-        warning_id = f"{guild_id}_{user_id}_{datetime.datetime.now().timestamp()}"
-        warnings_collection.document(warning_id).set({
-            'guild_id': guild_id,
-            'user_id': user_id,
-            'reason': reason,
-            'mod_id': mod_id,
-            'timestamp': firestore.SERVER_TIMESTAMP
-        })
+        await storage.add_warning(guild_id, user_id, reason, mod_id)
         return True
     except Exception as e:
         logger.error(f"Error adding warning: {e}")
         return False
 
-async def get_warnings(guild_id: str, user_id: str) -> List[Dict]:
+async def add_warnings(guild_id: str, user_ids: List[str], reason: str, mod_id: str) -> bool:
+    try:
+        await storage.add_warnings(guild_id, user_ids, reason, mod_id)
+        return True
+    except Exception as e:
+        logger.error(f"Error adding {len(user_ids)} warnings: {e}")
+        return False
+
+async def get_warnings(guild_id: str, user_id: str, limit: Optional[int] = None, after: Optional[Dict] = None) -> List[Dict]:
     try:
-        query = (warnings_collection
-                .where('guild_id', '==', guild_id)
-                .where('user_id', '==', user_id))
-        docs = query.stream()
-        return [doc.to_dict() for doc in docs]
+        return await storage.get_warnings(guild_id, user_id, limit, after)
     except Exception as e:
         logger.error(f"Error getting warnings: {e}")
         return []
 
-async def clear_warnings(guild_id: str, user_id: str) -> bool:
+async def count_warnings(guild_id: str, user_id: str) -> int:
     try:
-        query = (warnings_collection
-                .where('guild_id', '==', guild_id)
-                .where('user_id', '==', user_id))
-        docs = query.stream()
-        batch = db.batch()
-        for doc in docs:
-            batch.delete(doc.reference)
-        batch.commit()
-        return True
+        return await storage.count_warnings(guild_id, user_id)
+    except Exception as e:
+        logger.error(f"Error counting warnings: {e}")
+        return 0
+
+async def clear_warnings(guild_id: str, user_id: str, progress: ProgressCallback = None) -> Optional[int]:
+    try:
+        return await storage.clear_warnings(guild_id, user_id, progress)
     except Exception as e:
         logger.error(f"Error clearing warnings: {e}")
-        return False
+        return None
 
 async def set_afk(guild_id: str, user_id: str, reason: str = None) -> bool:
     try:
-        doc_id = f"{guild_id}_{user_id}"
-        afk_collection.document(doc_id).set({
-            'guild_id': guild_id,
-            'user_id': user_id,
-            'reason': reason,
-            'timestamp': firestore.SERVER_TIMESTAMP
-        })
-        afk_users[user_id] = reason or "No reason provided"
+        await storage.set_afk(guild_id, user_id, reason)
+        afk_cache.set(guild_id, user_id, reason or "No reason provided")
         return True
     except Exception as e:
         logger.error(f"Error setting AFK: {e}")
@@ -218,24 +381,124 @@ async def set_afk(guild_id: str, user_id: str, reason: str = None) -> bool:
 
 async def remove_afk(guild_id: str, user_id: str) -> bool:
     try:
-        doc_id = f"{guild_id}_{user_id}"
-        afk_collection.document(doc_id).delete()
-        if user_id in afk_users:
-            del afk_users[user_id]
+        await storage.remove_afk(guild_id, user_id)
+        afk_cache.remove(guild_id, user_id)
         return True
     except Exception as e:
         logger.error(f"Error removing AFK: {e}")
         return False
 
-def is_on_cooldown(user_id: int) -> bool:
-    if user_id not in rep_cooldowns:
-        return False
-    last_time = rep_cooldowns[user_id]
-    now = datetime.datetime.now().timestamp()
-    return (now - last_time) < COOLDOWN_SECONDS
+async def gather_limited(coros: List[Awaitable], limit: int) -> List:
+    semaphore = asyncio.Semaphore(limit)
+    
+    async def _run(coro):
+        async with semaphore:
+            return await coro
+    
+    return await asyncio.gather(*(_run(coro) for coro in coros))
 
-def update_cooldown(user_id: int):
-    rep_cooldowns[user_id] = datetime.datetime.now().timestamp()
+def is_bot_admin(interaction: discord.Interaction) -> bool:
+    if interaction.user.guild_permissions.administrator:
+        return True
+    return str(interaction.user.id) in guild_configs.get(str(interaction.guild_id)).admins
+
+def progress_reporter(interaction: discord.Interaction, describe: Callable[[int], str]) -> Callable[[int], Awaitable[None]]:
+    # Edits the deferred response at most once per PROGRESS_UPDATE_SECONDS,
+    # however often progress is reported.
+    last_update = time.monotonic()
+    
+    async def report(done: int):
+        nonlocal last_update
+        if time.monotonic() - last_update >= PROGRESS_UPDATE_SECONDS:
+            last_update = time.monotonic()
+            try:
+                await interaction.edit_original_response(content=describe(done))
+            except discord.HTTPException:
+                pass
+    
+    return report
+
+def parse_user_ids(text: str) -> List[int]:
+    # Raw ids or mentions, separated by anything; duplicates dropped.
+    return list(dict.fromkeys(int(user_id) for user_id in re.findall(r'\d{15,20}', text)))
+
+def collect_bulk_targets(interaction: discord.Interaction, user_ids: Optional[str], joined_within: Optional[int],
+                         members_only: bool) -> Tuple[List[discord.abc.Snowflake], int]:
+    # Listed ids plus recent joiners, minus anyone the single-user commands
+    # would refuse. Ids of users who already left can still be banned, so
+    # they come back as bare Objects unless members_only.
+    guild = interaction.guild
+    moderator = interaction.user
+    candidates: Dict[int, Optional[discord.Member]] = {user_id: guild.get_member(user_id) for user_id in parse_user_ids(user_ids or '')}
+    if joined_within:
+        since = discord.utils.utcnow() - datetime.timedelta(minutes=joined_within)
+        for member in guild.members:
+            if not member.bot and member.joined_at and member.joined_at >= since:
+                candidates[member.id] = member
+    
+    targets = []
+    skipped = 0
+    for user_id, member in candidates.items():
+        if user_id in (moderator.id, guild.owner_id, bot.user.id):
+            skipped += 1
+        elif member is None:
+            if members_only:
+                skipped += 1
+            else:
+                targets.append(discord.Object(id=user_id))
+        elif member.top_role >= moderator.top_role or member.top_role >= guild.me.top_role:
+            skipped += 1
+        else:
+            targets.append(member)
+    return targets, skipped
+
+async def run_bulk(targets: List[Any], action: Callable[[Any], Awaitable], progress: Callable[[int], Awaitable[None]]) -> List[Any]:
+    # Returns the targets the action succeeded on, in their original order.
+    done = 0
+    
+    async def _run(target):
+        nonlocal done
+        try:
+            await action(target)
+            return target
+        except Exception as e:
+            logger.warning(f"Bulk action failed for {target.id}: {e}")
+            return None
+        finally:
+            done += 1
+            await progress(done)
+    
+    results = await gather_limited([_run(target) for target in targets], BULK_MOD_CONCURRENCY)
+    return [target for target in results if target is not None]
+
+def bulk_summary_embed(title: str, color: discord.Color, verb: str, done: int, total: int, skipped: int,
+                       moderator: discord.abc.User, reason: Optional[str], recorded: bool) -> discord.Embed:
+    embed = discord.Embed(title=title, color=color)
+    embed.add_field(name=verb, value=f"{done}/{total}", inline=True)
+    if total - done:
+        embed.add_field(name="Failed", value=str(total - done), inline=True)
+    if skipped:
+        embed.add_field(name="Skipped", value=f"{skipped} (you, the owner, me, or a role at or above yours or mine)", inline=False)
+    embed.add_field(name="Moderator", value=moderator.mention, inline=True)
+    if reason:
+        embed.add_field(name="Reason", value=reason, inline=False)
+    if done and not recorded:
+        embed.set_footer(text="The actions went through, but their warning records could not be saved.")
+    return embed
+
+async def load_afk_users(page_size: int = 1000) -> int:
+    afk_cache.begin_load()
+    try:
+        records = await storage.load_afk(page_size)
+    except Exception as e:
+        afk_cache.cancel_load()
+        logger.error(f"Error loading AFK users: {e}")
+        return 0
+    # Other processes own the remaining shards' guilds and load them themselves.
+    return afk_cache.finish_load(
+        (guild_id, user_id, reason or "No reason provided")
+        for guild_id, user_id, reason in records if shard_plan.owns(guild_id)
+    )
 
 def format_cooldown(seconds: int) -> str:
     minutes, seconds = divmod(seconds, 60)
@@ -250,113 +513,202 @@ def format_cooldown(seconds: int) -> str:
     return " ".join(parts)
 
 class LeaderboardView(View):
-    def __init__(self, bot, guild_id: str, channel_id: Optional[str] = None):
+    def __init__(self, bot, guild_id: str, channel_id: Optional[str] = None, period: str = 'all'):
         super().__init__(timeout=60)
         self.bot = bot
         self.guild_id = guild_id
         self.channel_id = channel_id
+        self.period = period
         self.page = 1
         self.entries_per_page = 10
+        self.page_ends = {}
+    
+    async def render_page(self, guild: discord.Guild, page: int) -> Tuple[discord.Embed, List[Dict]]:
+        embed, entries = await render_leaderboard_page(
+            guild,
+            page,
+            per_page=self.entries_per_page,
+            channel_id=self.channel_id,
+            after=self.page_ends.get(page - 1),
+            period=self.period
+        )
+        if entries:
+            self.page_ends[page] = entries[-1]
+        return embed, entries
         
     @discord.ui.button(label="Previous", style=discord.ButtonStyle.secondary)
     async def previous_button(self, interaction: discord.Interaction, button: Button):
         if self.page > 1:
             self.page -= 1
             await interaction.response.defer()
-            await self.update_leaderboard(interaction)
+            embed, _ = await self.render_page(interaction.guild, self.page)
+            await interaction.edit_original_response(embed=embed, view=self)
         else:
             await interaction.response.send_message("Already on first page", ephemeral=True)
     
     @discord.ui.button(label="Next", style=discord.ButtonStyle.secondary)
     async def next_button(self, interaction: discord.Interaction, button: Button):
-        self.page += 1
         await interaction.response.defer()
-        leaderboard = await get_leaderboard(self.guild_id, limit=self.entries_per_page * self.page, channel_id=self.channel_id)
-        if len(leaderboard) < self.entries_per_page * (self.page - 1) + 1:
-            self.page -= 1
+        embed, page_entries = await self.render_page(interaction.guild, self.page + 1)
+        if not page_entries:
             await interaction.followup.send("End of leaderboard reached", ephemeral=True)
         else:
-            await self.update_leaderboard(interaction)
+            self.page += 1
+            await interaction.edit_original_response(embed=embed, view=self)
+
+class WarningsView(View):
+    def __init__(self, guild_id: str, user: discord.Member):
+        super().__init__(timeout=60)
+        self.guild_id = guild_id
+        self.user = user
+        self.page = 1
+        self.entries_per_page = 5
+        self.total = 0
+        self.page_ends = {}
     
-    async def update_leaderboard(self, interaction: discord.Interaction):
-        embed = discord.Embed(title="📚 Resource Repository Leaderboard", color=discord.Color.gold())
-        leaderboard = await get_leaderboard(self.guild_id, limit=self.entries_per_page * self.page, channel_id=self.channel_id)
-        offset = (self.page - 1) * self.entries_per_page
-        page_entries = leaderboard[offset:offset + self.entries_per_page] if offset < len(leaderboard) else []
-        
-        if not page_entries:
-            embed.add_field(name="No entries found", value="Be the first to contribute!", inline=False)
+    async def fetch_page(self, page: int) -> List[Dict]:
+        warnings = await get_warnings(self.guild_id, str(self.user.id), limit=self.entries_per_page, after=self.page_ends.get(page - 1))
+        if warnings:
+            self.page_ends[page] = warnings[-1]
+        return warnings
+    
+    @discord.ui.button(label="Previous", style=discord.ButtonStyle.secondary)
+    async def previous_button(self, interaction: discord.Interaction, button: Button):
+        if self.page > 1:
+            self.page -= 1
+            await interaction.response.defer()
+            await interaction.edit_original_response(embed=self.build_embed(interaction, await self.fetch_page(self.page)), view=self)
+        else:
+            await interaction.response.send_message("Already on first page", ephemeral=True)
+    
+    @discord.ui.button(label="Next", style=discord.ButtonStyle.secondary)
+    async def next_button(self, interaction: discord.Interaction, button: Button):
+        await interaction.response.defer()
+        warnings = await self.fetch_page(self.page + 1)
+        if not warnings:
+            await interaction.followup.send("No more warnings", ephemeral=True)
         else:
-            for i, entry in enumerate(page_entries, offset + 1):
-                user_id = entry.get('user_id')
-                count = entry.get('count', 0)
-                member = interaction.guild.get_member(int(user_id)) if user_id else None
-                name = member.display_name if member else f"User {user_id}"
-                medal = "🥇" if i == 1 else "🥈" if i == 2 else "🥉" if i == 3 else f"{i}."
-                embed.add_field(name=f"{medal} {name}", value=f"**{count}** contribution{'s' if count != 1 else ''}", inline=False)
+            self.page += 1
+            await interaction.edit_original_response(embed=self.build_embed(interaction, warnings), view=self)
+    
+    def build_embed(self, interaction: discord.Interaction, warnings: List[Dict]) -> discord.Embed:
+        embed = discord.Embed(title=f"Warnings for {self.user.display_name}", color=discord.Color.orange())
+        
+        if not warnings:
+            embed.description = "This user has no warnings! 🎉"
+            return embed
         
-        embed.set_footer(text=f"Page {self.page} • Updated {datetime.datetime.now().strftime('%Y-%m-%d %H:%M')}")
-        await interaction.edit_original_response(embed=embed, view=self)
+        offset = (self.page - 1) * self.entries_per_page
+        for i, warning in enumerate(warnings):
+            mod_id = warning.get('mod_id')
+            mod = interaction.guild.get_member(int(mod_id)) if mod_id else None
+            mod_name = mod.display_name if mod else "Unknown Moderator"
+            
+            timestamp = warning.get('timestamp')
+            time_str = timestamp.strftime('%Y-%m-%d %H:%M') if isinstance(timestamp, datetime.datetime) else "Unknown"
+            
+            embed.add_field(
+                name=f"Warning #{max(self.total - offset - i, 1)}",
+                value=f"**Reason:** {warning.get('reason')}\n**By:** {mod_name}\n**When:** {time_str}",
+                inline=False
+            )
+        
+        pages = max(1, -(-self.total // self.entries_per_page))
+        embed.set_footer(text=f"Page {self.page}/{pages} • {self.total} warning{'s' if self.total != 1 else ''} total")
+        return embed
 
 @bot.event
 async def on_ready():
-    logger.info(f"Bot is online as {bot.user.name}")
+    logger.info(f"Bot is online as {bot.user.name} running {shard_plan} ({time.perf_counter() - STARTED_AT:.2f}s after start)")
+    if not afk_cache.loaded:
+        logger.info(f"Loaded {await load_afk_users()} AFK user(s)")
     await bot.change_presence(activity=discord.Activity(type=discord.ActivityType.watching, name="resource sharing"))
+    # Commands are global; one process syncing them is enough.
+    if not shard_plan.owns_shard(0):
+        return
     try:
         synced = await bot.tree.sync()
         logger.info(f"Synced {len(synced)} command(s)")
     except Exception as e:
         logger.error(f"Failed to sync commands: {e}")
 
+@bot.event
+async def on_app_command_completion(interaction: discord.Interaction, command):
+    global first_command_logged
+    if not first_command_logged:
+        first_command_logged = True
+        logger.info(f"First command /{command.qualified_name} handled {time.perf_counter() - STARTED_AT:.2f}s after start")
+    if metrics.enabled:
+        # Measured from the interaction's snowflake, so this includes the
+        # gateway hop as well as the handler itself.
+        metrics.observe(f"command.{command.qualified_name}", (discord.utils.utcnow() - interaction.created_at).total_seconds())
+
 @bot.event
 async def on_message(message):
+    if metrics.enabled and message.guild is not None:
+        metrics.incr(f"shard.{message.guild.shard_id}.messages")
+    with metrics.timer('handler.on_message'):
+        await handle_message(message)
+
+async def handle_message(message):
+    # Checks run cheapest first. Most messages mention nobody, aren't
+    # commands and don't involve AFK users, so they return before anything
+    # is awaited or the content is lowercased for trigger matching.
     if message.author.bot or not message.guild:
         return
     
     user_id = str(message.author.id)
     guild_id = str(message.guild.id)
+    mentions = message.mentions
     
-    if user_id in afk_users:
-        await remove_afk(guild_id, user_id)
-        await message.channel.send(f"Welcome back, {message.author.mention}! I've removed your AFK status.", delete_after=10)
-    
-    for user in message.mentions:
-        mention_id = str(user.id)
-        if mention_id in afk_users:
-            reason = afk_users[mention_id]
-            await message.channel.send(f"{user.display_name} is currently AFK: {reason}")
+    guild_afk = afk_cache.guild(guild_id)
+    if guild_afk:
+        if user_id in guild_afk:
+            await remove_afk(guild_id, user_id)
+            outbox.send(message.channel, f"Welcome back, {message.author.mention}! I've removed your AFK status.", delete_after=10)
+        
+        for user in mentions:
+            reason = guild_afk.get(str(user.id))
+            if reason is not None:
+                # A busy channel pinging an AFK user gets one notice per window.
+                outbox.send(message.channel, f"{user.display_name} is currently AFK: {reason}", coalesce_key=('afk', user.id))
     
-    await bot.process_commands(message)
+    if message.content[:1] == COMMAND_PREFIX:
+        await bot.process_commands(message)
     
-    if not message.mentions:
+    if not mentions:
         return
-        
-    if not contains_trigger_word(message.content):
+    
+    config = guild_configs.get(guild_id)
+    if not config.rep_allowed(str(message.channel.id)):
         return
     
-    if is_on_cooldown(message.author.id):
+    if cooldown_store.remaining(guild_id, user_id):
         return
-        
-    valid_mentions = [user for user in message.mentions if user.id != message.author.id and not user.bot]
+    
+    valid_mentions = [user for user in mentions if user.id != message.author.id and not user.bot]
     if not valid_mentions:
         return
+    
+    if not config.matcher.matches(message.content):
+        return
+    
+    if await cooldown_store.acquire(guild_id, user_id, config.cooldown_seconds):
+        return
         
-    successful_mentions = []
-    for user in valid_mentions:
-        result = await add_resource(
-            str(message.guild.id),
-            str(user.id),
-            str(message.channel.id),
-            message.channel.name,
-            str(message.author.id)
-        )
-        if result:
-            successful_mentions.append(user)
+    results = await gather_limited([
+        add_resource(guild_id, str(user.id), str(message.channel.id), message.channel.name, user_id, user.display_name)
+        for user in valid_mentions
+    ], REP_FANOUT_LIMIT)
+    successful_mentions = [user for user, result in zip(valid_mentions, results) if result]
     
     if successful_mentions:
+        if not config.announce:
+            return
         mentions_text = ", ".join(user.mention for user in successful_mentions)
-        await message.channel.send(f"📚 {message.author.mention} acknowledged {mentions_text} for their helpful contribution!")
-        update_cooldown(message.author.id)
+        outbox.send(message.channel, f"📚 {message.author.mention} acknowledged {mentions_text} for their helpful contribution!")
+    else:
+        await cooldown_store.release(guild_id, user_id)
 
 @bot.tree.command(name="sync", description="Sync commands to this server")
 async def sync_command(interaction: discord.Interaction):
@@ -370,6 +722,62 @@ async def sync_command(interaction: discord.Interaction):
     except Exception as e:
         await interaction.followup.send(f"Failed to sync commands: {str(e)}")
 
+def format_latencies(latency: Dict[str, Dict], prefix: str, limit: int = 8) -> str:
+    rows = sorted(((name, stats) for name, stats in latency.items() if name.startswith(prefix)), key=lambda row: -row[1]['count'])
+    lines = [f"`{name[len(prefix):]}` {stats['count']} • p50 {stats['p50_ms']:.0f}ms • p99 {stats['p99_ms']:.0f}ms" for name, stats in rows[:limit]]
+    return "\n".join(lines)[:1024] or "No samples yet"
+
+@bot.tree.command(name="botstats", description="Show bot performance statistics (Admin only)")
+async def botstats_command(interaction: discord.Interaction):
+    if not is_bot_admin(interaction):
+        await interaction.response.send_message("You need administrator permission to use this command", ephemeral=True)
+        return
+    
+    await interaction.response.defer(ephemeral=True)
+    
+    snapshot = metrics.snapshot()
+    embed = discord.Embed(title="📈 Bot Statistics", color=discord.Color.blurple())
+    
+    shards = collect_shard_stats()
+    if shard_plan.multi_process:
+        try:
+            for stats in await storage.load_shard_stats():
+                shards.setdefault(stats['shard_id'], stats)
+        except Exception as e:
+            logger.error(f"Error loading shard stats: {e}")
+    now = time.time()
+    shard_lines = [
+        f"Shard {shard_id}: {stats['guilds']} guilds • {stats['latency_ms'] if stats['latency_ms'] is not None else '?'}ms"
+        + (f" • {stats['messages']} msgs" if metrics.enabled else "")
+        + ("" if stats.get('online') else " • offline")
+        + (" • stale" if now - stats.get('updated_at', now) > SHARD_STATS_INTERVAL * 3 else "")
+        for shard_id, stats in sorted(shards.items())
+    ]
+    embed.add_field(name=f"Shards ({shard_plan})", value="\n".join(shard_lines)[:1024] or "Not connected", inline=False)
+    
+    caches = "\n".join(
+        f"{name.replace('_', ' ').title()}: {stats['hit_ratio']:.0%} of {stats['hits'] + stats['misses']}"
+        for name, stats in snapshot['gauges'].items() if 'hit_ratio' in stats
+    )
+    embed.add_field(name="Cache Hit Ratios", value=caches or "No lookups yet", inline=False)
+    executor = snapshot['gauges'].get('storage_executor', {})
+    embed.add_field(name="Storage Executor", value=f"{executor.get('in_flight', 0)} in flight • {executor.get('queue_depth', 0)} queued • "
+                    f"peak {executor.get('peak_in_flight', 0)} • {executor.get('failed', 0)} failed", inline=False)
+    
+    if metrics.enabled:
+        lag = snapshot['loop_lag']
+        counters = snapshot['counters']
+        embed.add_field(name="Event Loop Lag", value=f"p50 {lag['p50_ms']:.1f}ms • p99 {lag['p99_ms']:.1f}ms • max {lag['max_ms']:.1f}ms", inline=False)
+        embed.add_field(name="Firestore Ops", value=f"{counters.get('firestore.reads', 0)} reads • {counters.get('firestore.writes', 0)} writes", inline=False)
+        embed.add_field(name="Handlers", value=format_latencies(snapshot['latency'], 'handler.'), inline=False)
+        embed.add_field(name="Commands", value=format_latencies(snapshot['latency'], 'command.'), inline=False)
+        embed.add_field(name="Storage Calls", value=format_latencies(snapshot['latency'], 'storage.'), inline=False)
+    else:
+        embed.add_field(name="Latency", value="Metrics are disabled; set METRICS_ENABLED=1 to record latencies.", inline=False)
+    
+    embed.set_footer(text=f"Up {datetime.timedelta(seconds=int(snapshot['uptime_s']))}")
+    await interaction.followup.send(embed=embed)
+
 @bot.tree.command(name="rep", description="Acknowledge someone's helpful contribution")
 @app_commands.describe(user="User to acknowledge", reason="Optional reason")
 async def rep_command(interaction: discord.Interaction, user: discord.Member, reason: Optional[str] = None):
@@ -379,24 +787,31 @@ async def rep_command(interaction: discord.Interaction, user: discord.Member, re
     if user.bot:
         await interaction.response.send_message("You cannot acknowledge bots", ephemeral=True)
         return
-    if is_on_cooldown(interaction.user.id):
-        await interaction.response.send_message(f"You're on cooldown. Try again later.", ephemeral=True)
+    config = guild_configs.get(str(interaction.guild_id))
+    if not config.rep_allowed(str(interaction.channel_id)):
+        await interaction.response.send_message("Reps aren't enabled in this channel", ephemeral=True)
+        return
+    remaining = await cooldown_store.acquire(str(interaction.guild_id), str(interaction.user.id), config.cooldown_seconds)
+    if remaining:
+        await interaction.response.send_message(f"You're on cooldown. Try again in {format_cooldown(int(remaining) + 1)}.", ephemeral=True)
         return
         
-    await interaction.response.defer(ephemeral=False)
+    # With announcements off only the giver sees the acknowledgement.
+    await interaction.response.defer(ephemeral=not config.announce)
     result = await add_resource(
         str(interaction.guild_id),
         str(user.id),
         str(interaction.channel_id),
         interaction.channel.name,
-        str(interaction.user.id)
+        str(interaction.user.id),
+        user.display_name
     )
     
     if result:
-        update_cooldown(interaction.user.id)
         reason_text = f" for: {reason}" if reason else ""
         await interaction.followup.send(f"📚 {interaction.user.mention} acknowledged {user.mention}'s contribution{reason_text}!")
     else:
+        await cooldown_store.release(str(interaction.guild_id), str(interaction.user.id))
         await interaction.followup.send("Failed to add resource. Please try again later.", ephemeral=True)
 
 @bot.tree.command(name="profile", description="View a user's contribution profile")
@@ -405,36 +820,19 @@ async def profile_command(interaction: discord.Interaction, user: Optional[disco
     target_user = user or interaction.user
     await interaction.response.defer(ephemeral=False)
     
-    profile = await get_profile(str(interaction.guild_id), str(target_user.id))
-    
-    embed = discord.Embed(title=f"📚 Resource Profile: {target_user.display_name}", color=target_user.color or discord.Color.blue())
-    embed.set_thumbnail(url=target_user.display_avatar.url)
-    
-    rep_count = profile.get('count', 0)
-    embed.add_field(name="Total Contributions", value=f"**{rep_count}** acknowledgment{'s' if rep_count != 1 else ''}", inline=False)
-    
-    await interaction.followup.send(embed=embed)
+    await interaction.followup.send(embed=await render_profile(target_user))
 
 @bot.tree.command(name="leaderboard", description="View contribution leaderboard")
-async def leaderboard_command(interaction: discord.Interaction):
+@app_commands.describe(period="Time window to rank (default: all time)")
+@app_commands.choices(period=[
+    app_commands.Choice(name="All time", value="all"),
+    app_commands.Choice(name="This week", value="week"),
+    app_commands.Choice(name="This month", value="month"),
+])
+async def leaderboard_command(interaction: discord.Interaction, period: Optional[app_commands.Choice[str]] = None):
     await interaction.response.defer(ephemeral=False)
-    view = LeaderboardView(bot, str(interaction.guild_id))
-    embed = discord.Embed(title="📚 Resource Repository Leaderboard", color=discord.Color.gold())
-    
-    leaderboard = await get_leaderboard(str(interaction.guild_id), limit=10)
-    
-    if not leaderboard:
-        embed.add_field(name="No entries found", value="Be the first to contribute!", inline=False)
-    else:
-        for i, entry in enumerate(leaderboard, 1):
-            user_id = entry.get('user_id')
-            count = entry.get('count', 0)
-            member = interaction.guild.get_member(int(user_id)) if user_id else None
-            name = member.display_name if member else f"User {user_id}"
-            medal = "🥇" if i == 1 else "🥈" if i == 2 else "🥉" if i == 3 else f"{i}."
-            embed.add_field(name=f"{medal} {name}", value=f"**{count}** contribution{'s' if count != 1 else ''}", inline=False)
-    
-    embed.set_footer(text=f"Page 1 • Updated {datetime.datetime.now().strftime('%Y-%m-%d %H:%M')}")
+    view = LeaderboardView(bot, str(interaction.guild_id), period=period.value if period else 'all')
+    embed, _ = await view.render_page(interaction.guild, 1)
     await interaction.followup.send(embed=embed, view=view)
 
 @bot.tree.command(name="afk", description="Set your AFK status")
@@ -479,10 +877,7 @@ async def warn_command(interaction: discord.Interaction, user: discord.Member, r
         
         await interaction.followup.send(embed=embed)
         
-        try:
-            await user.send(f"You were warned in {interaction.guild.name} for: {reason}")
-        except:
-            pass
+        outbox.send(user, f"You were warned in {interaction.guild.name} for: {reason}")
     else:
         await interaction.followup.send("Failed to warn user. Please try again.", ephemeral=True)
 
@@ -495,31 +890,10 @@ async def warnings_command(interaction: discord.Interaction, user: discord.Membe
     
     await interaction.response.defer(ephemeral=False)
     
-    warnings = await get_warnings(str(interaction.guild_id), str(user.id))
-    
-    embed = discord.Embed(title=f"Warnings for {user.display_name}", color=discord.Color.orange())
-    
-    if not warnings:
-        embed.description = "This user has no warnings! 🎉"
-    else:
-        for i, warning in enumerate(warnings, 1):
-            mod_id = warning.get('mod_id')
-            mod = interaction.guild.get_member(int(mod_id)) if mod_id else None
-            mod_name = mod.display_name if mod else "Unknown Moderator"
-            
-            timestamp = warning.get('timestamp')
-            if isinstance(timestamp, firestore.SERVER_TIMESTAMP):
-                time_str = "Recent"
-            else:
-                time_str = timestamp.strftime('%Y-%m-%d %H:%M') if timestamp else "Unknown"
-                
-            embed.add_field(
-                name=f"Warning #{i}",
-                value=f"**Reason:** {warning.get('reason')}\n**By:** {mod_name}\n**When:** {time_str}",
-                inline=False
-            )
-    
-    await interaction.followup.send(embed=embed)
+    view = WarningsView(str(interaction.guild_id), user)
+    view.total = await count_warnings(str(interaction.guild_id), str(user.id))
+    warnings = await view.fetch_page(1) if view.total else []
+    await interaction.followup.send(embed=view.build_embed(interaction, warnings), view=view if view.total > view.entries_per_page else None)
 
 @bot.tree.command(name="clearwarnings", description="Clear all warnings for a user (Mod only)")
 @app_commands.describe(user="User to clear warnings for")
@@ -530,10 +904,11 @@ async def clearwarnings_command(interaction: discord.Interaction, user: discord.
     
     await interaction.response.defer(ephemeral=False)
     
-    result = await clear_warnings(str(interaction.guild_id), str(user.id))
+    report_progress = progress_reporter(interaction, lambda deleted: f"Clearing warnings for {user.mention}... {deleted} removed so far")
+    cleared = await clear_warnings(str(interaction.guild_id), str(user.id), report_progress)
     
-    if result:
-        await interaction.followup.send(f"All warnings for {user.mention} have been cleared.")
+    if cleared is not None:
+        await interaction.edit_original_response(content=f"All warnings for {user.mention} have been cleared ({cleared} removed).")
     else:
         await interaction.followup.send("Failed to clear warnings. Please try again.", ephemeral=True)
 
@@ -603,6 +978,52 @@ async def ban_command(interaction: discord.Interaction, user: discord.Member, re
     except:
         await interaction.followup.send("Failed to ban user. Check my permissions and try again.", ephemeral=True)
 
+@bot.tree.command(name="massban", description="Ban a list of users or everyone who joined recently (Mod only)")
+@app_commands.describe(user_ids="User IDs or mentions, separated by spaces or commas", joined_within="Also ban members who joined in the last N minutes",
+                       reason="Reason for ban", delete_days="Number of days of messages to delete (0-7)")
+async def massban_command(interaction: discord.Interaction, user_ids: Optional[str] = None, joined_within: Optional[int] = None,
+                          reason: Optional[str] = None, delete_days: Optional[int] = 1):
+    if not interaction.user.guild_permissions.ban_members:
+        await interaction.response.send_message("You don't have permission to use this command", ephemeral=True)
+        return
+    
+    if not user_ids and not joined_within:
+        await interaction.response.send_message("Give some user IDs, a joined_within window, or both", ephemeral=True)
+        return
+    
+    if joined_within is not None and (joined_within < 1 or joined_within > BULK_JOIN_WINDOW_MINUTES):
+        await interaction.response.send_message(f"joined_within must be between 1 and {BULK_JOIN_WINDOW_MINUTES} minutes", ephemeral=True)
+        return
+    
+    if delete_days < 0 or delete_days > 7:
+        await interaction.response.send_message("Delete days must be between 0 and 7", ephemeral=True)
+        return
+    
+    targets, skipped = collect_bulk_targets(interaction, user_ids, joined_within, members_only=False)
+    if not targets:
+        await interaction.response.send_message(f"Nobody to ban ({skipped} skipped)", ephemeral=True)
+        return
+    
+    if len(targets) > BULK_MOD_MAX_TARGETS:
+        await interaction.response.send_message(f"That matches {len(targets)} users; the limit is {BULK_MOD_MAX_TARGETS} per command", ephemeral=True)
+        return
+    
+    await interaction.response.defer(ephemeral=False)
+    await interaction.edit_original_response(content=f"Banning {len(targets)} users...")
+    
+    # Raid accounts are not DMed: a ban ends the shared guild, so the DM
+    # would have to go first and would double the requests.
+    banned = await run_bulk(
+        targets,
+        lambda target: interaction.guild.ban(target, reason=reason, delete_message_seconds=delete_days * 24 * 60 * 60),
+        progress_reporter(interaction, lambda done: f"Banning {len(targets)} users... {done}/{len(targets)}"))
+    recorded = await add_warnings(str(interaction.guild_id), [str(target.id) for target in banned],
+                                  f"Mass ban: {reason}" if reason else "Mass ban", str(interaction.user.id)) if banned else True
+    
+    embed = bulk_summary_embed("🔨 Mass Ban", discord.Color.dark_red(), "Banned", len(banned), len(targets), skipped,
+                               interaction.user, reason, recorded)
+    await interaction.edit_original_response(content=None, embed=embed)
+
 @bot.tree.command(name="unban", description="Unban a user (Mod only)")
 @app_commands.describe(user_id="ID of the user to unban")
 async def unban_command(interaction: discord.Interaction, user_id: str):
@@ -660,33 +1081,249 @@ async def timeout_command(interaction: discord.Interaction, user: discord.Member
             
         await interaction.followup.send(embed=embed)
         
-        try:
-            await user.send(f"You have been timed out in {interaction.guild.name} for {duration} minute{'s' if duration != 1 else ''}" + (f": {reason}" if reason else "."))
-        except:
-            pass
+        outbox.send(user, f"You have been timed out in {interaction.guild.name} for {duration} minute{'s' if duration != 1 else ''}" + (f": {reason}" if reason else "."))
     except:
         await interaction.followup.send("Failed to timeout user. Check my permissions and try again.", ephemeral=True)
 
+@bot.tree.command(name="masstimeout", description="Timeout a list of users or everyone who joined recently (Mod only)")
+@app_commands.describe(duration="Duration in minutes", user_ids="User IDs or mentions, separated by spaces or commas",
+                       joined_within="Also timeout members who joined in the last N minutes", reason="Reason for timeout")
+async def masstimeout_command(interaction: discord.Interaction, duration: int, user_ids: Optional[str] = None,
+                              joined_within: Optional[int] = None, reason: Optional[str] = None):
+    if not interaction.user.guild_permissions.moderate_members:
+        await interaction.response.send_message("You don't have permission to use this command", ephemeral=True)
+        return
+    
+    if not user_ids and not joined_within:
+        await interaction.response.send_message("Give some user IDs, a joined_within window, or both", ephemeral=True)
+        return
+    
+    if joined_within is not None and (joined_within < 1 or joined_within > BULK_JOIN_WINDOW_MINUTES):
+        await interaction.response.send_message(f"joined_within must be between 1 and {BULK_JOIN_WINDOW_MINUTES} minutes", ephemeral=True)
+        return
+    
+    if duration < 1 or duration > MAX_TIMEOUT_MINUTES:
+        await interaction.response.send_message(f"Duration must be between 1 and {MAX_TIMEOUT_MINUTES} minutes", ephemeral=True)
+        return
+    
+    targets, skipped = collect_bulk_targets(interaction, user_ids, joined_within, members_only=True)
+    if not targets:
+        await interaction.response.send_message(f"Nobody to timeout ({skipped} skipped)", ephemeral=True)
+        return
+    
+    if len(targets) > BULK_MOD_MAX_TARGETS:
+        await interaction.response.send_message(f"That matches {len(targets)} users; the limit is {BULK_MOD_MAX_TARGETS} per command", ephemeral=True)
+        return
+    
+    await interaction.response.defer(ephemeral=False)
+    await interaction.edit_original_response(content=f"Timing out {len(targets)} users...")
+    
+    timeout_duration = datetime.timedelta(minutes=duration)
+    timed_out = await run_bulk(
+        targets,
+        lambda member: member.timeout(timeout_duration, reason=reason),
+        progress_reporter(interaction, lambda done: f"Timing out {len(targets)} users... {done}/{len(targets)}"))
+    recorded = await add_warnings(str(interaction.guild_id), [str(member.id) for member in timed_out],
+                                  f"Mass timeout ({duration}m): {reason}" if reason else f"Mass timeout ({duration}m)",
+                                  str(interaction.user.id)) if timed_out else True
+    
+    embed = bulk_summary_embed("⏰ Mass Timeout", discord.Color.orange(), "Timed out", len(timed_out), len(targets), skipped,
+                               interaction.user, reason, recorded)
+    embed.add_field(name="Duration", value=f"{duration} minute{'s' if duration != 1 else ''}", inline=True)
+    await interaction.edit_original_response(content=None, embed=embed)
+
 @bot.tree.command(name="clear", description="Clear messages in a channel (Mod only)")
-@app_commands.describe(amount="Number of messages to delete (1-100)")
+@app_commands.describe(amount=f"Number of messages to delete (1-{PURGE_MAX_MESSAGES})")
 async def clear_command(interaction: discord.Interaction, amount: int):
     if not interaction.user.guild_permissions.manage_messages:
         await interaction.response.send_message("You don't have permission to use this command", ephemeral=True)
         return
     
-    if amount < 1 or amount > 100:
-        await interaction.response.send_message("Amount must be between 1 and 100", ephemeral=True)
+    if amount < 1 or amount > PURGE_MAX_MESSAGES:
+        await interaction.response.send_message(f"Amount must be between 1 and {PURGE_MAX_MESSAGES}", ephemeral=True)
         return
     
     await interaction.response.defer(ephemeral=True)
     
+    report_progress = progress_reporter(interaction, lambda deleted: f"Deleting messages... {deleted}/{amount}")
+    deleted = 0
     try:
-        deleted = await interaction.channel.purge(limit=amount)
-        await interaction.followup.send(f"Deleted {len(deleted)} message{'s' if len(deleted) != 1 else ''}.", ephemeral=True)
+        # One bulk delete per chunk, each starting below the oldest message
+        # the last one removed, so messages posted meanwhile are left alone.
+        before = None
+        while deleted < amount:
+            limit = min(PURGE_CHUNK_SIZE, amount - deleted)
+            chunk = await interaction.channel.purge(limit=limit, before=before)
+            deleted += len(chunk)
+            if len(chunk) < limit:
+                break
+            before = chunk[-1]
+            await report_progress(deleted)
+        await interaction.edit_original_response(content=f"Deleted {deleted} message{'s' if deleted != 1 else ''}.")
     except discord.Forbidden:
-        await interaction.followup.send("I don't have permission to delete messages.", ephemeral=True)
+        await interaction.edit_original_response(content=f"I don't have permission to delete messages ({deleted} deleted before stopping).")
     except Exception as e:
-        await interaction.followup.send(f"An error occurred: {str(e)}", ephemeral=True)
+        await interaction.edit_original_response(content=f"An error occurred after deleting {deleted} message{'s' if deleted != 1 else ''}: {str(e)}")
+
+config_group = app_commands.Group(name="config", description="View or change this server's bot settings (Admin only)", guild_only=True)
+
+async def require_bot_admin(interaction: discord.Interaction) -> bool:
+    if is_bot_admin(interaction):
+        return True
+    await interaction.response.send_message("You need administrator permission to use this command", ephemeral=True)
+    return False
+
+async def update_guild_config(guild_id: str, **changes) -> Optional[GuildConfig]:
+    # Only the changed settings are stored, so everything else keeps
+    # following the defaults.
+    try:
+        await storage.save_guild_config(guild_id, changes, merge=True)
+    except Exception as e:
+        logger.error(f"Error saving config for guild {guild_id}: {e}")
+        return None
+    # Applied here straight away; other processes pick it up from the
+    # listener or their next poll.
+    guild_configs.apply(guild_id, dict(guild_configs.settings(guild_id), **changes))
+    return guild_configs.get(guild_id)
+
+def build_config_embed(config: GuildConfig) -> discord.Embed:
+    embed = discord.Embed(title="⚙️ Server Settings", color=discord.Color.blurple())
+    embed.add_field(name="Cooldown", value=format_cooldown(config.cooldown_seconds) or "None", inline=True)
+    embed.add_field(name="Announcements", value="On" if config.announce else "Off", inline=True)
+    embed.add_field(name="Rep Channels", value=", ".join(f"<#{channel_id}>" for channel_id in config.rep_channels)[:1024] or "All channels", inline=False)
+    embed.add_field(name="Triggers", value=", ".join(f"`{trigger}`" for trigger in config.triggers)[:1024] or "None (only /rep counts)", inline=False)
+    embed.add_field(name="Extra Admins", value=", ".join(f"<@{user_id}>" for user_id in config.admins)[:1024] or "None", inline=False)
+    return embed
+
+async def send_config_update(interaction: discord.Interaction, **changes):
+    await interaction.response.defer(ephemeral=True)
+    config = await update_guild_config(str(interaction.guild_id), **changes)
+    if config is None:
+        await interaction.followup.send("Failed to save settings. Please try again.", ephemeral=True)
+        return
+    await interaction.followup.send(embed=build_config_embed(config), ephemeral=True)
+
+@config_group.command(name="show", description="Show this server's settings")
+async def config_show_command(interaction: discord.Interaction):
+    if not await require_bot_admin(interaction):
+        return
+    await interaction.response.send_message(embed=build_config_embed(guild_configs.get(str(interaction.guild_id))), ephemeral=True)
+
+@config_group.command(name="cooldown", description="Set how long members wait between reps")
+@app_commands.describe(minutes=f"Cooldown in minutes (0-{MAX_CONFIG_COOLDOWN_MINUTES})")
+async def config_cooldown_command(interaction: discord.Interaction, minutes: int):
+    if not await require_bot_admin(interaction):
+        return
+    if minutes < 0 or minutes > MAX_CONFIG_COOLDOWN_MINUTES:
+        await interaction.response.send_message(f"Cooldown must be between 0 and {MAX_CONFIG_COOLDOWN_MINUTES} minutes", ephemeral=True)
+        return
+    await send_config_update(interaction, cooldown_seconds=minutes * 60)
+
+@config_group.command(name="trigger", description="Add or remove a word that turns a mention into a rep")
+@app_commands.describe(action="What to do", word="Trigger word or phrase (not needed for reset)")
+@app_commands.choices(action=[
+    app_commands.Choice(name="Add", value="add"),
+    app_commands.Choice(name="Remove", value="remove"),
+    app_commands.Choice(name="Reset to defaults", value="reset"),
+])
+async def config_trigger_command(interaction: discord.Interaction, action: str, word: Optional[str] = None):
+    if not await require_bot_admin(interaction):
+        return
+    if action == 'reset':
+        await send_config_update(interaction, triggers=list(DEFAULT_TRIGGERS))
+        return
+    
+    normalized = normalize_triggers([word or ''])
+    if not normalized:
+        await interaction.response.send_message("Give a trigger word or phrase", ephemeral=True)
+        return
+    trigger = normalized[0]
+    triggers = guild_configs.get(str(interaction.guild_id)).triggers
+    
+    if action == 'add':
+        if len(trigger) > MAX_TRIGGER_LENGTH:
+            await interaction.response.send_message(f"Triggers can be at most {MAX_TRIGGER_LENGTH} characters", ephemeral=True)
+            return
+        if trigger not in triggers and len(triggers) >= MAX_TRIGGERS:
+            await interaction.response.send_message(f"This server already has {MAX_TRIGGERS} triggers; remove one first", ephemeral=True)
+            return
+        await send_config_update(interaction, triggers=list(triggers) + [trigger])
+    else:
+        if trigger not in triggers:
+            await interaction.response.send_message(f"`{trigger}` isn't a trigger here", ephemeral=True)
+            return
+        await send_config_update(interaction, triggers=[existing for existing in triggers if existing != trigger])
+
+@config_group.command(name="channel", description="Choose which channels reps count in")
+@app_commands.describe(action="What to do", channel="Channel to add or remove (not needed for clear)")
+@app_commands.choices(action=[
+    app_commands.Choice(name="Add", value="add"),
+    app_commands.Choice(name="Remove", value="remove"),
+    app_commands.Choice(name="Clear (reps count everywhere)", value="clear"),
+])
+async def config_channel_command(interaction: discord.Interaction, action: str, channel: Optional[discord.TextChannel] = None):
+    if not await require_bot_admin(interaction):
+        return
+    if action == 'clear':
+        await send_config_update(interaction, rep_channels=[])
+        return
+    if channel is None:
+        await interaction.response.send_message("Pick a channel", ephemeral=True)
+        return
+    
+    rep_channels = set(guild_configs.get(str(interaction.guild_id)).rep_channels)
+    if action == 'add':
+        rep_channels.add(str(channel.id))
+    else:
+        rep_channels.discard(str(channel.id))
+    await send_config_update(interaction, rep_channels=sorted(rep_channels))
+
+@config_group.command(name="announce", description="Turn rep announcements in channels on or off")
+@app_commands.describe(enabled="Whether acknowledgements are posted publicly")
+async def config_announce_command(interaction: discord.Interaction, enabled: bool):
+    if not await require_bot_admin(interaction):
+        return
+    await send_config_update(interaction, announce=enabled)
+
+@config_group.command(name="admin", description="Let a member use admin commands without administrator permission")
+@app_commands.describe(action="What to do", user="Member to add or remove")
+@app_commands.choices(action=[
+    app_commands.Choice(name="Add", value="add"),
+    app_commands.Choice(name="Remove", value="remove"),
+])
+async def config_admin_command(interaction: discord.Interaction, action: str, user: discord.Member):
+    # Only real administrators hand out admin access.
+    if not interaction.user.guild_permissions.administrator:
+        await interaction.response.send_message("You need administrator permission to use this command", ephemeral=True)
+        return
+    
+    admins = set(guild_configs.get(str(interaction.guild_id)).admins)
+    if action == 'add':
+        admins.add(str(user.id))
+    else:
+        admins.discard(str(user.id))
+    await send_config_update(interaction, admins=sorted(admins))
+
+@config_group.command(name="reset", description="Restore every setting to its default")
+async def config_reset_command(interaction: discord.Interaction):
+    if not interaction.user.guild_permissions.administrator:
+        await interaction.response.send_message("You need administrator permission to use this command", ephemeral=True)
+        return
+    await interaction.response.defer(ephemeral=True)
+    guild_id = str(interaction.guild_id)
+    try:
+        await storage.save_guild_config(guild_id, {})
+    except Exception as e:
+        logger.error(f"Error resetting config for guild {guild_id}: {e}")
+        await interaction.followup.send("Failed to reset settings. Please try again.", ephemeral=True)
+        return
+    guild_configs.apply(guild_id, {})
+    await interaction.followup.send(embed=build_config_embed(guild_configs.get(guild_id)), ephemeral=True)
+
+bot.tree.add_command(config_group)
 
 if __name__ == "__main__":
-    bot.run(os.getenv('DISCORD_TOKEN'))
\ No newline at end of file
+    try:
+        bot.run(os.getenv('DISCORD_TOKEN'))
+    finally:
+        storage.executor.shutdown()
\ No newline at end of file
@@ -0,0 +1,281 @@
+import bisect
+import os
+import time
+from collections import OrderedDict
+from types import MappingProxyType
+from typing import Any, Dict, Hashable, Iterable, List, Mapping, Optional, Tuple
+
+LEADERBOARD_CACHE_TTL = float(os.getenv('LEADERBOARD_CACHE_TTL', '300'))
+LEADERBOARD_CACHE_TOP_K = int(os.getenv('LEADERBOARD_CACHE_TOP_K', '100'))
+LEADERBOARD_CACHE_MAX_BOARDS = int(os.getenv('LEADERBOARD_CACHE_MAX_BOARDS', '1000'))
+RENDER_CACHE_TTL = float(os.getenv('RENDER_CACHE_TTL', '120'))
+RENDER_CACHE_MAX_SIZE = int(os.getenv('RENDER_CACHE_MAX_SIZE', '2000'))
+NAME_CACHE_TTL = float(os.getenv('NAME_CACHE_TTL', '900'))
+NAME_CACHE_FALLBACK_TTL = float(os.getenv('NAME_CACHE_FALLBACK_TTL', '60'))
+NAME_CACHE_MAX_SIZE = int(os.getenv('NAME_CACHE_MAX_SIZE', '10000'))
+
+BoardKey = Tuple[str, Optional[str]]
+
+_EMPTY: Mapping[str, str] = MappingProxyType({})
+
+
+class _Board:
+    # entries is kept ascending by (count, user_id), so the leaderboard is
+    # read from the end. That matches Firestore's count DESC, __name__ DESC
+    # ordering. Only entries with count above floor are known to be in
+    # the right place: a user outside the cached top-K may have climbed
+    # up to floor without us seeing their total.
+    def __init__(self, entries: List[Dict], complete: bool):
+        self.entries = sorted((entry.get('count', 0), entry['user_id']) for entry in entries)
+        self.counts = {user_id: count for count, user_id in self.entries}
+        self.names = {entry['user_id']: entry['display_name'] for entry in entries if entry.get('display_name')}
+        self.complete = complete
+        self.floor = self.entries[0][0] if self.entries and not complete else -1
+        self.loaded_at = time.monotonic()
+
+    def valid_length(self) -> int:
+        if self.complete:
+            return len(self.entries)
+        return len(self.entries) - bisect.bisect_right(self.entries, (self.floor, '\uffff'))
+
+    def slice(self, offset: int, limit: int) -> List[Dict]:
+        end = len(self.entries) - offset
+        start = max(0, end - limit)
+        return [{'user_id': user_id, 'count': count, 'display_name': self.names.get(user_id)}
+                for count, user_id in reversed(self.entries[start:max(0, end)])]
+
+    def add(self, user_id: str, delta: int, display_name: Optional[str] = None):
+        if display_name:
+            self.names[user_id] = display_name
+        count = self.counts.get(user_id)
+        if count is None:
+            if not self.complete:
+                self.floor += delta
+                return
+            count = 0
+        else:
+            del self.entries[bisect.bisect_left(self.entries, (count, user_id))]
+        self.counts[user_id] = count + delta
+        bisect.insort(self.entries, (count + delta, user_id))
+
+
+class LeaderboardCache:
+    def __init__(self, top_k: int = LEADERBOARD_CACHE_TOP_K, ttl: float = LEADERBOARD_CACHE_TTL,
+                 max_boards: int = LEADERBOARD_CACHE_MAX_BOARDS):
+        self.top_k = top_k
+        self.ttl = ttl
+        self.max_boards = max_boards
+        self._boards: 'OrderedDict[BoardKey, _Board]' = OrderedDict()
+        self._versions: Dict[str, int] = {}
+        self._clock = 0
+        self._epoch = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def version(self, guild_id: str) -> int:
+        # Changes whenever the guild's standings may have changed, so
+        # anything derived from them can be memoized against it.
+        return max(self._versions.get(guild_id, 0), self._epoch)
+
+    def _bump(self, guild_id: Optional[str]):
+        self._clock += 1
+        if guild_id is None:
+            self._epoch = self._clock
+            self._versions.clear()
+        else:
+            self._versions[guild_id] = self._clock
+
+    def _board(self, key: BoardKey) -> Optional[_Board]:
+        board = self._boards.get(key)
+        if board is None:
+            return None
+        if time.monotonic() - board.loaded_at > self.ttl:
+            del self._boards[key]
+            return None
+        self._boards.move_to_end(key)
+        return board
+
+    def page(self, guild_id: str, channel_id: Optional[str], offset: int, limit: int) -> Optional[List[Dict]]:
+        board = self._board((guild_id, channel_id))
+        if board is None or (offset + limit > board.valid_length() and not board.complete):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return board.slice(offset, limit)
+
+    def rank(self, guild_id: str, count: int) -> Optional[int]:
+        # Only answers when everyone above `count` is known to be cached.
+        board = self._board((guild_id, None))
+        if board is None or (not board.complete and count <= board.floor):
+            return None
+        return len(board.entries) - bisect.bisect_right(board.entries, (count, '\uffff')) + 1
+
+    def seed(self, guild_id: str, channel_id: Optional[str], entries: List[Dict], complete: bool):
+        key = (guild_id, channel_id)
+        self._boards[key] = _Board(entries[:self.top_k], complete and len(entries) <= self.top_k)
+        self._boards.move_to_end(key)
+        while len(self._boards) > self.max_boards:
+            self._boards.popitem(last=False)
+            self.evictions += 1
+
+    def record(self, guild_id: str, channel_id: str, user_id: str, delta: int = 1, display_name: Optional[str] = None):
+        self._bump(guild_id)
+        for key in ((guild_id, None), (guild_id, channel_id)):
+            board = self._boards.get(key)
+            if board is not None:
+                board.add(user_id, delta, display_name)
+
+    def invalidate(self, guild_id: Optional[str] = None):
+        self._bump(guild_id)
+        if guild_id is None:
+            self._boards.clear()
+            return
+        for key in [key for key in self._boards if key[0] == guild_id]:
+            del self._boards[key]
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.misses
+        return {
+            'boards': len(self._boards),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': self.hits / lookups if lookups else 0.0,
+            'evictions': self.evictions,
+        }
+
+
+class RenderCache:
+    # Finished payloads (embeds and the rows behind them) memoized under the
+    # version of the data they were rendered from. A lookup with any other
+    # version is a miss, so writes never need to find and evict entries.
+    def __init__(self, ttl: float = RENDER_CACHE_TTL, max_size: int = RENDER_CACHE_MAX_SIZE):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._payloads: 'OrderedDict[Hashable, Tuple[int, float, Any]]' = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._payloads)
+
+    def get(self, key: Hashable, version: int) -> Optional[Any]:
+        entry = self._payloads.get(key)
+        if entry is None or entry[0] != version or time.monotonic() - entry[1] > self.ttl:
+            self.misses += 1
+            return None
+        self._payloads.move_to_end(key)
+        self.hits += 1
+        return entry[2]
+
+    def set(self, key: Hashable, version: int, payload: Any):
+        self._payloads[key] = (version, time.monotonic(), payload)
+        self._payloads.move_to_end(key)
+        while len(self._payloads) > self.max_size:
+            self._payloads.popitem(last=False)
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.misses
+        return {
+            'payloads': len(self._payloads),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': self.hits / lookups if lookups else 0.0,
+        }
+
+
+class NameCache:
+    # Display names by (guild, user) for members the client doesn't have
+    # cached, so paging through a leaderboard doesn't re-query the gateway
+    # for the same users. Entries expire after ttl to pick up renames, and
+    # the least recently used are dropped past max_size. Fallback names for
+    # members the gateway didn't return get the shorter fallback_ttl.
+    def __init__(self, ttl: float = NAME_CACHE_TTL, max_size: int = NAME_CACHE_MAX_SIZE,
+                 fallback_ttl: float = NAME_CACHE_FALLBACK_TTL):
+        self.ttl = ttl
+        self.fallback_ttl = fallback_ttl
+        self.max_size = max_size
+        self._names: 'OrderedDict[Tuple[str, str], Tuple[str, float]]' = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._names)
+
+    def get(self, guild_id: str, user_id: str) -> Optional[str]:
+        key = (guild_id, user_id)
+        entry = self._names.get(key)
+        if entry is None or time.monotonic() > entry[1]:
+            if entry is not None:
+                del self._names[key]
+            self.misses += 1
+            return None
+        self._names.move_to_end(key)
+        self.hits += 1
+        return entry[0]
+
+    def set(self, guild_id: str, user_id: str, name: str, fallback: bool = False):
+        key = (guild_id, user_id)
+        self._names[key] = (name, time.monotonic() + (self.fallback_ttl if fallback else self.ttl))
+        self._names.move_to_end(key)
+        while len(self._names) > self.max_size:
+            self._names.popitem(last=False)
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.misses
+        return {
+            'names': len(self._names),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': self.hits / lookups if lookups else 0.0,
+        }
+
+
+class AfkCache:
+    # AFK reasons by guild, then user. guild() hands the hot path a single
+    # mapping per message, so checking every mention is a plain dict lookup.
+    # Writes that land while the startup scan is running are remembered, so
+    # the scan's older snapshot can't undo them.
+    def __init__(self):
+        self._guilds: Dict[str, Dict[str, str]] = {}
+        self._touched: Optional[set] = None
+        self.loaded = False
+
+    def __len__(self) -> int:
+        return sum(len(users) for users in self._guilds.values())
+
+    def guild(self, guild_id: str) -> Mapping[str, str]:
+        return self._guilds.get(guild_id, _EMPTY)
+
+    def get(self, guild_id: str, user_id: str) -> Optional[str]:
+        return self._guilds.get(guild_id, _EMPTY).get(user_id)
+
+    def set(self, guild_id: str, user_id: str, reason: str):
+        self._guilds.setdefault(guild_id, {})[user_id] = reason
+        if self._touched is not None:
+            self._touched.add((guild_id, user_id))
+
+    def remove(self, guild_id: str, user_id: str):
+        users = self._guilds.get(guild_id)
+        if users is not None:
+            users.pop(user_id, None)
+            if not users:
+                del self._guilds[guild_id]
+        if self._touched is not None:
+            self._touched.add((guild_id, user_id))
+
+    def begin_load(self):
+        self._touched = set()
+
+    def cancel_load(self):
+        self._touched = None
+
+    def finish_load(self, records: Iterable[Tuple[str, str, str]]) -> int:
+        touched, self._touched = self._touched or set(), None
+        loaded = 0
+        for guild_id, user_id, reason in records:
+            if (guild_id, user_id) not in touched:
+                self._guilds.setdefault(guild_id, {})[user_id] = reason
+                loaded += 1
+        self.loaded = True
+        return loaded
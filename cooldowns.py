@@ -0,0 +1,131 @@
+import datetime
+import heapq
+import logging
+import os
+import time
+from typing import Dict, List, Optional, Tuple
+
+from metrics import metrics
+from storage import StorageExecutor, storage_executor
+
+logger = logging.getLogger('resource_bot.cooldowns')
+
+COOLDOWN_BACKEND = os.getenv('COOLDOWN_BACKEND', 'local')
+
+CooldownKey = Tuple[str, str]
+
+
+class LocalCooldownStore:
+    # Cooldowns are scoped per (guild, user). Expiry times sit in a heap
+    # that gets swept lazily on every acquire, so stale entries are dropped
+    # without a background task. acquire() never awaits between its check
+    # and its update, so it is atomic on the event loop.
+    def __init__(self, duration: float):
+        self.duration = duration
+        self._expires: Dict[CooldownKey, float] = {}
+        self._heap: List[Tuple[float, CooldownKey]] = []
+
+    def __len__(self) -> int:
+        return len(self._expires)
+
+    def sweep(self, now: Optional[float] = None) -> int:
+        now = time.time() if now is None else now
+        swept = 0
+        while self._heap and self._heap[0][0] <= now:
+            expires_at, key = heapq.heappop(self._heap)
+            if self._expires.get(key) == expires_at:
+                del self._expires[key]
+                swept += 1
+        return swept
+
+    def remaining(self, guild_id: str, user_id: str, now: Optional[float] = None) -> float:
+        now = time.time() if now is None else now
+        return max(0.0, self._expires.get((guild_id, user_id), 0.0) - now)
+
+    def mark(self, guild_id: str, user_id: str, expires_at: float):
+        key = (guild_id, user_id)
+        self._expires[key] = expires_at
+        heapq.heappush(self._heap, (expires_at, key))
+
+    async def acquire(self, guild_id: str, user_id: str, duration: Optional[float] = None) -> float:
+        # duration overrides the store's default, for guilds that set their own.
+        now = time.time()
+        self.sweep(now)
+        remaining = self.remaining(guild_id, user_id, now)
+        if remaining:
+            return remaining
+        self.mark(guild_id, user_id, now + (self.duration if duration is None else duration))
+        return 0.0
+
+    async def release(self, guild_id: str, user_id: str):
+        self._expires.pop((guild_id, user_id), None)
+
+
+class FirestoreCooldownStore:
+    # Shared store so cooldowns survive restarts and hold across shards and
+    # instances. Each acquire is a single transaction. A local store is
+    # kept in front of it so users already known to be on cooldown don't
+    # cost a round-trip. expires_at is a timestamp, so a Firestore TTL
+    # policy on that field can purge old documents.
+    def __init__(self, backend, duration: float, executor: StorageExecutor = storage_executor):
+        self.backend = backend
+        self.duration = duration
+        self.executor = executor
+        self.local = LocalCooldownStore(duration)
+
+    def __len__(self) -> int:
+        return len(self.local)
+
+    def remaining(self, guild_id: str, user_id: str, now: Optional[float] = None) -> float:
+        # Local view only: a cooldown set by another instance shows up on
+        # the first acquire() that hits it.
+        return self.local.remaining(guild_id, user_id, now)
+
+    @property
+    def collection(self):
+        return self.backend.db.collection('cooldowns')
+
+    def _acquire(self, guild_id: str, user_id: str, now: float, duration: float) -> float:
+        from firebase_admin import firestore
+
+        ref = self.collection.document(f"{guild_id}_{user_id}")
+
+        @firestore.transactional
+        def _txn(transaction):
+            snapshot = ref.get(transaction=transaction)
+            metrics.incr('firestore.reads')
+            expires_at = (snapshot.to_dict() or {}).get('expires_at') if snapshot.exists else None
+            if expires_at and expires_at.timestamp() > now:
+                return expires_at.timestamp() - now
+            transaction.set(ref, {
+                'guild_id': guild_id,
+                'user_id': user_id,
+                'expires_at': datetime.datetime.fromtimestamp(now + duration, tz=datetime.timezone.utc)
+            })
+            metrics.incr('firestore.writes')
+            return 0.0
+
+        return _txn(self.backend.db.transaction())
+
+    async def acquire(self, guild_id: str, user_id: str, duration: Optional[float] = None) -> float:
+        duration = self.duration if duration is None else duration
+        remaining = await self.local.acquire(guild_id, user_id, duration)
+        if remaining:
+            return remaining
+        now = time.time()
+        try:
+            remaining = await self.executor.run(self._acquire, guild_id, user_id, now, duration)
+        except Exception as e:
+            logger.error(f"Error acquiring shared cooldown, falling back to local: {e}")
+            return 0.0
+        if remaining:
+            self.local.mark(guild_id, user_id, now + remaining)
+        return remaining
+
+    async def release(self, guild_id: str, user_id: str):
+        await self.local.release(guild_id, user_id)
+        try:
+            await self.executor.run(self.collection.document(f"{guild_id}_{user_id}").delete)
+            metrics.incr('firestore.writes')
+        except Exception as e:
+            logger.error(f"Error releasing shared cooldown: {e}")
@@ -0,0 +1,1057 @@
+import asyncio
+import contextlib
+import datetime
+import heapq
+import json
+import logging
+import math
+import os
+import threading
+import time
+import uuid
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple, TypeVar
+
+import firebase_admin
+from firebase_admin import credentials, firestore
+
+from metrics import metrics
+from storage import ProgressCallback, StorageBackend, StorageExecutor, rank_totals, rep_day, storage_executor
+
+logger = logging.getLogger('resource_bot.storage')
+
+T = TypeVar('T')
+
+REP_FLUSH_INTERVAL_MS = int(os.getenv('REP_FLUSH_INTERVAL_MS', '2000'))
+REP_FLUSH_MAX_OPS = int(os.getenv('REP_FLUSH_MAX_OPS', '200'))
+FIRESTORE_BATCH_LIMIT = 500
+BULK_DELETE_CONCURRENCY = int(os.getenv('BULK_DELETE_CONCURRENCY', '4'))
+REP_FLUSH_MAX_RETRIES = int(os.getenv('REP_FLUSH_MAX_RETRIES', '5'))
+REP_FLUSH_RETRY_MAX_DELAY = float(os.getenv('REP_FLUSH_RETRY_MAX_DELAY', '60'))
+REP_DEAD_LETTER_PATH = os.getenv('REP_DEAD_LETTER_PATH', '')
+# Each event is ~100 bytes packed, well inside the 1 MiB document limit.
+REP_EVENTS_PER_DOC = int(os.getenv('REP_EVENTS_PER_DOC', '2000'))
+REP_EVENT_DOCS_PER_PAGE = 20
+
+
+def _config_settings(data: Dict[str, Any]) -> Dict[str, Any]:
+    updated_at = data.get('updated_at')
+    return dict(data, updated_at=updated_at.timestamp() if updated_at else 0.0)
+
+
+class _Chunk:
+    __slots__ = ('items', 'attempts', 'retry_at')
+
+    def __init__(self, items: List[tuple]):
+        self.items = items
+        self.attempts = 0
+        self.retry_at = 0.0
+
+
+class RepBatcher:
+    # Write-behind aggregator for rep increments. Reps are coalesced per
+    # (guild, user) and (guild, channel) document and flushed as one
+    # WriteBatch of server-side increments.
+    def __init__(self, backend: 'FirestoreBackend', executor: StorageExecutor = storage_executor,
+                 flush_interval_ms: int = REP_FLUSH_INTERVAL_MS, max_ops: int = REP_FLUSH_MAX_OPS):
+        self.backend = backend
+        self.executor = executor
+        self.flush_interval = flush_interval_ms / 1000
+        self.max_ops = max_ops
+        self._users: Dict[tuple, Dict[str, Any]] = {}
+        self._channels: Dict[tuple, Dict[str, Any]] = {}
+        self._channel_users: Dict[tuple, Dict[str, Any]] = {}
+        self._days: Dict[tuple, Dict[str, int]] = {}
+        self._events: List[Dict[str, str]] = []
+        self._ops = 0
+        self._retries: List[_Chunk] = []
+        self._inflight: List[_Chunk] = []
+        self._wake = None
+        self._flush_lock = None
+        self._gate = None
+        self._readers = 0
+        self._writing = False
+        self._writers_waiting = 0
+        self._task = None
+        self._closed = False
+        self.flushes = 0
+        self.flushed_ops = 0
+        self.dead_lettered = 0
+
+    @property
+    def pending_ops(self) -> int:
+        return self._ops
+
+    @property
+    def retry_writes(self) -> int:
+        return sum(len(chunk.items) for chunk in self._retries)
+
+    @property
+    def write_behind(self) -> bool:
+        return self.flush_interval > 0
+
+    def start(self):
+        if self._task is None and self.write_behind:
+            self._wake = asyncio.Event()
+            self._flush_lock = asyncio.Lock()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def add(self, guild_id: str, user_id: str, channel_id: str, channel_name: str, given_by: str,
+            display_name: Optional[str] = None):
+        if self._closed:
+            raise RuntimeError("Rep batcher is closed")
+        user = self._users.setdefault((guild_id, user_id), {'count': 0, 'channels': {}, 'given_by': {}})
+        user['count'] += 1
+        if display_name:
+            user['display_name'] = display_name
+        channel = user['channels'].setdefault(channel_id, {'name': channel_name, 'count': 0})
+        channel['name'] = channel_name
+        channel['count'] += 1
+        user['given_by'][given_by] = user['given_by'].get(given_by, 0) + 1
+
+        channel = self._channels.setdefault((guild_id, channel_id), {'name': channel_name, 'total': 0, 'users': {}})
+        channel['name'] = channel_name
+        channel['total'] += 1
+        channel['users'][user_id] = channel['users'].get(user_id, 0) + 1
+        channel_user = self._channel_users.setdefault((guild_id, channel_id, user_id), {'count': 0})
+        channel_user['count'] += 1
+        if display_name:
+            channel_user['display_name'] = display_name
+        day = self._days.setdefault((guild_id, rep_day()), {})
+        day[user_id] = day.get(user_id, 0) + 1
+        self._events.append(self._event(guild_id, user_id, channel_id, given_by))
+
+        self._ops += 1
+        if self._ops >= self.max_ops and self._wake is not None:
+            self._wake.set()
+
+    async def record(self, guild_id: str, user_id: str, channel_id: str, channel_name: str, given_by: str,
+                     display_name: Optional[str] = None):
+        if self.write_behind:
+            self.add(guild_id, user_id, channel_id, channel_name, given_by, display_name)
+            return
+        # Unbatched mode still never reads: both documents get merge-set
+        # increments committed atomically in a single two-write batch.
+        await self.executor.run(self._commit, [
+            ('user', (guild_id, user_id), {
+                'count': 1,
+                'channels': {channel_id: {'name': channel_name, 'count': 1}},
+                'given_by': {given_by: 1},
+                'display_name': display_name,
+            }),
+            ('channel', (guild_id, channel_id), {'name': channel_name, 'total': 1, 'users': {user_id: 1}}),
+            ('channel_user', (guild_id, channel_id, user_id), {'count': 1, 'display_name': display_name}),
+            ('day', (guild_id, rep_day()), {user_id: 1}),
+            ('events',) + self._event_pack([self._event(guild_id, user_id, channel_id, given_by)]),
+            ('giver', (guild_id, user_id, given_by), 1),
+        ])
+
+    @staticmethod
+    def _event(guild_id: str, user_id: str, channel_id: str, given_by: str) -> Dict[str, str]:
+        # Short keys: events are stored packed, thousands to a document.
+        return {'g': guild_id, 'u': user_id, 'c': channel_id, 'b': given_by}
+
+    @staticmethod
+    def _event_pack(events: List[Dict[str, str]]) -> Tuple[str, Dict[str, Any]]:
+        # One ledger document per flush chunk, so the ledger costs a write
+        # per flush rather than per rep. Its id is picked client side, so
+        # retrying a failed chunk rewrites the same pack instead of
+        # appending a duplicate. ts is when the pack was taken, at most a
+        # flush interval after its reps.
+        return uuid.uuid4().hex, {
+            'ts': time.time(),
+            'guild_ids': sorted({event['g'] for event in events}),
+            'events': events,
+        }
+
+    def _user_write(self, guild_id: str, user_id: str, pending: Dict[str, Any]):
+        data = {
+            'guild_id': guild_id,
+            'user_id': user_id,
+            'count': firestore.Increment(pending['count']),
+            'channels': {
+                channel_id: {'name': channel['name'], 'count': firestore.Increment(channel['count'])}
+                for channel_id, channel in pending['channels'].items()
+            },
+            'given_by': {giver: firestore.Increment(count) for giver, count in pending['given_by'].items()},
+        }
+        # Snapshot of the member's name at rep time, used by the leaderboard
+        # when the member has left or isn't in the client's cache.
+        if pending.get('display_name'):
+            data['display_name'] = pending['display_name']
+        return self.backend.resources_collection.document(f"{guild_id}_{user_id}"), data
+
+    def _channel_write(self, guild_id: str, channel_id: str, pending: Dict[str, Any]):
+        return self.backend.channels_collection.document(f"{guild_id}_{channel_id}"), {
+            'guild_id': guild_id,
+            'channel_id': channel_id,
+            'channel_name': pending['name'],
+            'total_resources': firestore.Increment(pending['total']),
+            'users': {user_id: firestore.Increment(count) for user_id, count in pending['users'].items()},
+        }
+
+    def _channel_user_write(self, guild_id: str, channel_id: str, user_id: str, pending: Dict[str, Any]):
+        # One small doc per (channel, user) so channel leaderboards can be
+        # an ordered, paginated query instead of a read of the whole map.
+        users_collection = self.backend.channels_collection.document(f"{guild_id}_{channel_id}").collection('users')
+        data = {
+            'guild_id': guild_id,
+            'channel_id': channel_id,
+            'user_id': user_id,
+            'count': firestore.Increment(pending['count']),
+        }
+        if pending.get('display_name'):
+            data['display_name'] = pending['display_name']
+        return users_collection.document(user_id), data
+
+    def _giver_write(self, guild_id: str, user_id: str, given_by: str, count: int):
+        # Per-receiver giver counts, so a profile's top givers are an
+        # ordered query instead of a read of the whole given_by map.
+        givers_collection = self.backend.resources_collection.document(f"{guild_id}_{user_id}").collection('givers')
+        return givers_collection.document(given_by), {
+            'guild_id': guild_id,
+            'user_id': user_id,
+            'given_by': given_by,
+            'count': firestore.Increment(count),
+        }
+
+    def _day_write(self, guild_id: str, day: str, users: Dict[str, int]):
+        # One doc per guild per UTC day, so a rolling window is a fixed
+        # number of point reads however many reps it covers.
+        return self.backend.rep_days_collection.document(f"{guild_id}_{day}"), {
+            'guild_id': guild_id,
+            'day': day,
+            'users': {user_id: firestore.Increment(count) for user_id, count in users.items()},
+        }
+
+    def _write(self, kind: str, key: Any, pending: Any):
+        if kind == 'day':
+            return self._day_write(*key, pending)
+        if kind == 'events':
+            return self.backend.rep_events_collection.document(key), pending
+        if kind == 'user':
+            return self._user_write(*key, pending)
+        if kind == 'channel_user':
+            return self._channel_user_write(*key, pending)
+        if kind == 'giver':
+            return self._giver_write(*key, pending)
+        return self._channel_write(*key, pending)
+
+    def _commit(self, chunk: List[tuple]):
+        batch = self.backend.db.batch()
+        for kind, key, pending in chunk:
+            ref, data = self._write(kind, key, pending)
+            batch.set(ref, data, merge=True)
+        batch.commit()
+        metrics.incr('firestore.writes', len(chunk))
+
+    def _take_pending(self) -> List[tuple]:
+        users, channels, channel_users, days, events = self._users, self._channels, self._channel_users, self._days, self._events
+        self._users, self._channels, self._channel_users, self._days, self._events, self._ops = {}, {}, {}, {}, [], 0
+        items = [('user', key, pending) for key, pending in users.items()]
+        items += [('channel', key, pending) for key, pending in channels.items()]
+        items += [('channel_user', key, pending) for key, pending in channel_users.items()]
+        items += [('giver', key + (giver,), count) for key, pending in users.items() for giver, count in pending['given_by'].items()]
+        items += [('day', key, day_users) for key, day_users in days.items()]
+        items += [('events',) + self._event_pack(events[start:start + REP_EVENTS_PER_DOC])
+                  for start in range(0, len(events), REP_EVENTS_PER_DOC)]
+        return items
+
+    def _retry_delay(self, attempts: int) -> float:
+        return min(REP_FLUSH_RETRY_MAX_DELAY, max(self.flush_interval, 1.0) * 2 ** (attempts - 1))
+
+    def _dead_letter(self, items: List[tuple], reason: str):
+        # Dropped writes are kept as JSON so they can be inspected and
+        # applied by hand; counts are the increments, not totals.
+        records = [{'kind': kind, 'key': list(key) if isinstance(key, tuple) else key, 'data': pending}
+                   for kind, key, pending in items]
+        self.dead_lettered += len(records)
+        logger.error(f"Dropping {len(records)} rep write(s) {reason}")
+        if REP_DEAD_LETTER_PATH:
+            try:
+                with open(REP_DEAD_LETTER_PATH, 'a') as f:
+                    f.writelines(json.dumps(record) + '\n' for record in records)
+                return
+            except OSError as e:
+                logger.error(f"Error writing dead letters to {REP_DEAD_LETTER_PATH}: {e}")
+        logger.error(f"Dropped rep writes: {json.dumps(records)}")
+
+    def _gate_condition(self) -> asyncio.Condition:
+        if self._gate is None:
+            self._gate = asyncio.Condition()
+        return self._gate
+
+    @contextlib.asynccontextmanager
+    async def _reading(self):
+        # Reads share the gate with each other but never with a commit. A
+        # commit that is waiting holds back new reads, so a steady stream of
+        # cache misses can't starve the flusher.
+        gate = self._gate_condition()
+        async with gate:
+            await gate.wait_for(lambda: not self._writing and not self._writers_waiting)
+            self._readers += 1
+        try:
+            yield
+        finally:
+            async with gate:
+                self._readers -= 1
+                gate.notify_all()
+
+    @contextlib.asynccontextmanager
+    async def _committing(self):
+        gate = self._gate_condition()
+        async with gate:
+            self._writers_waiting += 1
+            try:
+                await gate.wait_for(lambda: not self._writing and not self._readers)
+                self._writing = True
+            finally:
+                self._writers_waiting -= 1
+                gate.notify_all()
+        try:
+            yield
+        finally:
+            async with gate:
+                self._writing = False
+                gate.notify_all()
+
+    async def flush(self, retry_all: bool = False) -> int:
+        if self._flush_lock is None:
+            self._flush_lock = asyncio.Lock()
+        async with self._flush_lock:
+            return await self._flush(retry_all)
+
+    async def _flush(self, retry_all: bool = False) -> int:
+        # Chunks that failed earlier go first once their backoff is up;
+        # retry_all ignores the backoff, for shutdown. A chunk commits
+        # atomically, but a deadline or UNAVAILABLE error can arrive after
+        # the server already committed it, and retrying that chunk applies
+        # its increments twice. So a chunk gets REP_FLUSH_MAX_RETRIES
+        # attempts and is then dead-lettered; `ledger.py verify` finds any
+        # drift an ambiguous failure left behind.
+        now = time.monotonic()
+        due = [chunk for chunk in self._retries if retry_all or chunk.retry_at <= now]
+        self._retries = [chunk for chunk in self._retries if chunk not in due]
+        ops = self._ops
+        items = self._take_pending() if ops else []
+        chunks = due + [_Chunk(items[start:start + FIRESTORE_BATCH_LIMIT]) for start in range(0, len(items), FIRESTORE_BATCH_LIMIT)]
+        # Taken chunks stay visible to pending_counts until they commit or
+        # go back to the retry list, both inside the commit gate.
+        self._inflight = chunks
+        for index, chunk in enumerate(chunks):
+            async with self._committing():
+                try:
+                    await self.executor.run(self._commit, chunk.items)
+                except Exception as e:
+                    chunk.attempts += 1
+                    if chunk.attempts >= REP_FLUSH_MAX_RETRIES:
+                        self._dead_letter(chunk.items, f"after {chunk.attempts} failed attempt(s): {e}")
+                        retry_at = time.monotonic()
+                    else:
+                        retry_at = chunk.retry_at = time.monotonic() + self._retry_delay(chunk.attempts)
+                        self._retries.append(chunk)
+                        logger.error(f"Error flushing rep increments, retrying {len(chunk.items)} write(s) "
+                                     f"in {self._retry_delay(chunk.attempts):.0f}s: {e}")
+                    # The chunks after it weren't attempted; they wait with it.
+                    for rest in chunks[index + 1:]:
+                        rest.retry_at = retry_at
+                        self._retries.append(rest)
+                    self._inflight = []
+                    return 0
+                self._inflight = chunks[index + 1:]
+        self.flushes += 1
+        self.flushed_ops += ops
+        return ops
+
+    def pending_counts(self, guild_id: str, channel_id: Optional[str] = None,
+                       since_day: Optional[str] = None) -> Dict[str, int]:
+        # Per-user reps recorded but not committed, overall, in one channel,
+        # or in the daily buckets from since_day on: still pending, waiting
+        # for a retry, or taken by a flush that hasn't committed them yet.
+        counts: Dict[str, int] = {}
+        queued = [item for chunk in self._retries + self._inflight for item in chunk.items]
+        if since_day is not None:
+            items = [('day', key, users) for key, users in self._days.items()]
+            items += [item for item in queued if item[0] == 'day']
+            for _, (day_guild, day), users in items:
+                if day_guild == guild_id and day >= since_day:
+                    for user_id, count in users.items():
+                        counts[user_id] = counts.get(user_id, 0) + count
+            return counts
+        kind, pending = ('channel_user', self._channel_users) if channel_id else ('user', self._users)
+        items = [(kind, key, value) for key, value in pending.items()]
+        items += [item for item in queued if item[0] == kind]
+        for _, key, value in items:
+            if key[0] == guild_id and (channel_id is None or key[1] == channel_id):
+                counts[key[-1]] = counts.get(key[-1], 0) + value['count']
+        return counts
+
+    async def settled(self, read: Callable[[], Awaitable[T]], guild_id: str, channel_id: Optional[str] = None,
+                      since_day: Optional[str] = None) -> Tuple[T, Dict[str, int]]:
+        # Runs `read` with no commit in flight and returns it with the reps
+        # not yet committed at its end. Commits wait for running reads and
+        # reads wait for a commit in flight, so those are exactly the reps
+        # the read can't have seen. Nothing is flushed for it: a cache miss
+        # costs the read, not a commit. A guild is only written by the
+        # process that owns its shard, so this holds across processes too.
+        if not self.write_behind:
+            return await read(), {}
+        async with self._reading():
+            return await read(), self.pending_counts(guild_id, channel_id, since_day)
+
+    async def _run(self):
+        while not self._closed:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            await self.flush()
+
+    async def close(self):
+        self._closed = True
+        if self._task is not None:
+            self._wake.set()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush(retry_all=True)
+        retries, self._retries = self._retries, []
+        for chunk in retries:
+            self._dead_letter(chunk.items, "that could not be flushed on shutdown")
+
+
+def init_firebase():
+    cred = credentials.Certificate({
+        "type": "service_account",
+        "project_id": os.getenv('FIREBASE_PROJECT_ID'),
+        "private_key_id": os.getenv('FIREBASE_PRIVATE_KEY_ID'),
+        "private_key": os.getenv('FIREBASE_PRIVATE_KEY').replace("\\n", "\n"),
+        "client_email": os.getenv('FIREBASE_CLIENT_EMAIL'),
+        "client_id": os.getenv('FIREBASE_CLIENT_ID'),
+        "auth_uri": "https://accounts.google.com/o/oauth2/auth",
+        "token_uri": "https://oauth2.googleapis.com/token",
+        "auth_provider_x509_cert_url": "https://www.googleapis.com/oauth2/v1/certs",
+        "client_x509_cert_url": os.getenv('FIREBASE_CLIENT_CERT_URL')
+    })
+    firebase_admin.initialize_app(cred)
+    return firestore.client()
+
+
+class FirestoreBackend(StorageBackend):
+    # The Firebase app and client are created on first use rather than at
+    # import time, so the module can be imported without credentials and
+    # warm_up() can open the connection while the gateway is logging in.
+    def __init__(self, db=None, executor: StorageExecutor = storage_executor, client_factory: Callable = None):
+        self.executor = executor
+        self._db = db
+        self._client_factory = client_factory or init_firebase
+        self._connect_lock = threading.Lock()
+        # (guild filter, [(pack id, pack)], no more packs) left over from
+        # the last rep_events page.
+        self._held_packs: Optional[Tuple[Optional[str], List[Tuple[str, Dict]], bool]] = None
+        self.rep_batcher = RepBatcher(self, executor)
+
+    @property
+    def db(self):
+        if self._db is None:
+            with self._connect_lock:
+                if self._db is None:
+                    self._db = self._client_factory()
+                    logger.info("Firebase initialized successfully")
+        return self._db
+
+    @property
+    def resources_collection(self):
+        return self.db.collection('resources')
+
+    @property
+    def channels_collection(self):
+        return self.db.collection('channels')
+
+    @property
+    def warnings_collection(self):
+        return self.db.collection('warnings')
+
+    @property
+    def afk_collection(self):
+        return self.db.collection('afk')
+
+    @property
+    def rep_days_collection(self):
+        return self.db.collection('rep_days')
+
+    @property
+    def rep_events_collection(self):
+        return self.db.collection('rep_events')
+
+    async def start(self):
+        self.rep_batcher.start()
+
+    async def warm_up(self):
+        # One tiny query so credentials, DNS and the gRPC channel are ready
+        # before the first real command needs them.
+        await self.executor.run(lambda: self._stream(self.resources_collection.select([]).limit(1)))
+
+    def _stream(self, query) -> List:
+        docs = list(query.stream())
+        # A query that matches nothing is still billed as one read.
+        metrics.incr('firestore.reads', max(1, len(docs)))
+        return docs
+
+    def shared_cooldown_store(self, duration: float):
+        from cooldowns import FirestoreCooldownStore
+        return FirestoreCooldownStore(self, duration, self.executor)
+
+    async def close(self):
+        await self.rep_batcher.close()
+
+    def stats(self) -> Dict[str, Any]:
+        stats = super().stats()
+        stats['rep_batcher'] = {
+            'pending_ops': self.rep_batcher.pending_ops,
+            'flushes': self.rep_batcher.flushes,
+            'flushed_ops': self.rep_batcher.flushed_ops,
+            'retry_writes': self.rep_batcher.retry_writes,
+            'dead_lettered': self.rep_batcher.dead_lettered,
+        }
+        return stats
+
+    async def record_rep(self, guild_id: str, user_id: str, channel_id: str, channel_name: str, given_by: str,
+                         display_name: Optional[str] = None):
+        await self.rep_batcher.record(guild_id, user_id, channel_id, channel_name, given_by, display_name)
+
+    def _indexed_profile(self, guild_id: str, user_id: str) -> Optional[Dict]:
+        # The profile doc is read without its channels and given_by maps.
+        # Users whose reps predate the channel user and giver docs are
+        # backfilled from those maps once, the first time their profile is
+        # shown. Like _migrate_channel_users this runs inside settled(), so
+        # the copied totals are exact and merge keeps the other fields.
+        ref = self.resources_collection.document(f"{guild_id}_{user_id}")
+        doc = ref.get(field_paths=['count', 'display_name', 'profile_indexed'])
+        metrics.incr('firestore.reads')
+        if not doc.exists:
+            return None
+        profile = doc.to_dict() or {}
+        if profile.pop('profile_indexed', False):
+            return profile
+        data = ref.get().to_dict() or {}
+        metrics.incr('firestore.reads')
+        writes = [(self.channels_collection.document(f"{guild_id}_{channel_id}").collection('users').document(user_id), {
+            'guild_id': guild_id,
+            'channel_id': channel_id,
+            'user_id': user_id,
+            'count': channel.get('count', 0),
+        }) for channel_id, channel in data.get('channels', {}).items()]
+        writes += [(ref.collection('givers').document(given_by), {
+            'guild_id': guild_id,
+            'user_id': user_id,
+            'given_by': given_by,
+            'count': count,
+        }) for given_by, count in data.get('given_by', {}).items()]
+        for start in range(0, len(writes), FIRESTORE_BATCH_LIMIT):
+            batch = self.db.batch()
+            for doc_ref, doc_data in writes[start:start + FIRESTORE_BATCH_LIMIT]:
+                batch.set(doc_ref, doc_data, merge=True)
+            batch.commit()
+            metrics.incr('firestore.writes', len(writes[start:start + FIRESTORE_BATCH_LIMIT]))
+        ref.update({'profile_indexed': True})
+        logger.info(f"Backfilled {len(writes)} profile count(s) for {guild_id}_{user_id}")
+        return profile
+
+    async def get_profile(self, guild_id: str, user_id: str, top_n: int = 5) -> Optional[Dict]:
+        # Settled like the leaderboard seed, so the count agrees with the
+        # cached board rank() compares it against. Top channels come from a
+        # collection group query over the channel user docs, which needs a
+        # composite index on users (guild_id, user_id, count desc).
+        channels_query = (self.db.collection_group('users')
+                          .where('guild_id', '==', guild_id)
+                          .where('user_id', '==', user_id)
+                          .order_by('count', direction=firestore.Query.DESCENDING)
+                          .limit(top_n)
+                          .select(['channel_id', 'count']))
+        givers_query = (self.resources_collection.document(f"{guild_id}_{user_id}").collection('givers')
+                        .order_by('count', direction=firestore.Query.DESCENDING)
+                        .limit(top_n)
+                        .select(['given_by', 'count']))
+
+        async def _read():
+            profile = await self.executor.run(self._indexed_profile, guild_id, user_id)
+            if profile is None:
+                return None
+            channels, givers = await asyncio.gather(
+                self.executor.run(lambda: self._stream(channels_query)),
+                self.executor.run(lambda: self._stream(givers_query)))
+            profile.update({
+                'guild_id': guild_id,
+                'user_id': user_id,
+                'top_channels': [{'channel_id': doc.get('channel_id'), 'count': doc.get('count')} for doc in channels],
+                'top_givers': [{'user_id': doc.get('given_by'), 'count': doc.get('count')} for doc in givers],
+            })
+            return profile
+
+        profile, pending = await self.rep_batcher.settled(_read, guild_id)
+        if profile is not None and pending.get(user_id):
+            profile['count'] = profile.get('count', 0) + pending[user_id]
+        return profile
+
+    async def rank_of(self, guild_id: str, count: int) -> int:
+        # An aggregation query: billed per 1000 index entries counted, not
+        # per user ahead of this one.
+        query = self.resources_collection.where('guild_id', '==', guild_id).where('count', '>', count)
+        rank = await self.executor.run(lambda: int(query.count().get()[0][0].value) + 1)
+        metrics.incr('firestore.reads')
+        return rank
+
+    def _ranked(self, guild_id: str, channel_id: Optional[str]):
+        if channel_id:
+            source = self.channels_collection.document(f"{guild_id}_{channel_id}").collection('users')
+        else:
+            source = self.resources_collection.where('guild_id', '==', guild_id)
+        return (source
+                .order_by('count', direction=firestore.Query.DESCENDING)
+                .order_by('__name__', direction=firestore.Query.DESCENDING)
+                .select(['user_id', 'count', 'display_name']))
+
+    def _migrate_channel_users(self, guild_id: str, channel_id: str) -> Optional[List[Tuple[str, int]]]:
+        # Runs inside RepBatcher.settled(), so every rep for the channel is
+        # either committed to both the users map and the subcollection or
+        # still pending for both. Copying the map's totals is then exact,
+        # and merge keeps the display names already on the user docs.
+        # Channels created since the subcollection existed go through this
+        # once too: a blind users_indexed on every channel write would also
+        # flag legacy channels on their next rep and skip their backfill.
+        channel_ref = self.channels_collection.document(f"{guild_id}_{channel_id}")
+        flag = channel_ref.get(field_paths=['users_indexed'])
+        metrics.incr('firestore.reads')
+        if not flag.exists:
+            return []
+        if (flag.to_dict() or {}).get('users_indexed'):
+            return None
+        users = list((channel_ref.get().to_dict() or {}).get('users', {}).items())
+        metrics.incr('firestore.reads')
+        users_collection = channel_ref.collection('users')
+        for start in range(0, len(users), FIRESTORE_BATCH_LIMIT):
+            batch = self.db.batch()
+            for user_id, count in users[start:start + FIRESTORE_BATCH_LIMIT]:
+                batch.set(users_collection.document(user_id), {
+                    'guild_id': guild_id,
+                    'channel_id': channel_id,
+                    'user_id': user_id,
+                    'count': count
+                }, merge=True)
+            batch.commit()
+            metrics.incr('firestore.writes', len(users[start:start + FIRESTORE_BATCH_LIMIT]))
+        channel_ref.update({'users_indexed': True})
+        logger.info(f"Backfilled {len(users)} channel user count(s) for {guild_id}_{channel_id}")
+        return users
+
+    async def _top_users(self, guild_id: str, channel_id: Optional[str], limit: int) -> List[Dict]:
+        if channel_id:
+            # Channels that predate the users subcollection are backfilled
+            # from their users map the first time they are ranked.
+            users = await self.executor.run(self._migrate_channel_users, guild_id, channel_id)
+            if users is not None:
+                top = heapq.nlargest(limit, users, key=lambda item: (item[1], item[0]))
+                return [{'user_id': user_id, 'count': count} for user_id, count in top]
+        query = self._ranked(guild_id, channel_id).limit(limit)
+        return [doc.to_dict() for doc in await self.executor.run(lambda: self._stream(query))]
+
+    def _stored_counts(self, guild_id: str, channel_id: Optional[str], user_ids: List[str]) -> Dict[str, Dict]:
+        if channel_id:
+            users_collection = self.channels_collection.document(f"{guild_id}_{channel_id}").collection('users')
+            refs = {user_id: users_collection.document(user_id) for user_id in user_ids}
+        else:
+            refs = {user_id: self.resources_collection.document(f"{guild_id}_{user_id}") for user_id in user_ids}
+        user_by_doc = {ref.id: user_id for user_id, ref in refs.items()}
+        stored = {user_id: {'count': 0} for user_id in user_ids}
+        for doc in self.db.get_all(list(refs.values()), field_paths=['count', 'display_name']):
+            if doc.exists:
+                stored[user_by_doc[doc.id]] = doc.to_dict()
+        metrics.incr('firestore.reads', len(refs))
+        return stored
+
+    async def top_users(self, guild_id: str, channel_id: Optional[str], limit: int) -> List[Dict]:
+        # This seeds the leaderboard cache, which has already counted every
+        # rep recorded in this process, so write-behind reps that haven't
+        # landed yet are added back. When the page is full, a pending user
+        # outside it may still belong on it, so their stored totals are read
+        # in the same settled read: point reads, one per pending user.
+        async def _read():
+            rows = await self._top_users(guild_id, channel_id, limit)
+            stored: Dict[str, Dict] = {}
+            if len(rows) < limit:
+                return rows, stored
+            listed = {row['user_id'] for row in rows}
+            while True:
+                # Reps can be recorded while the lookup runs; the last pass
+                # has nothing left to read, so the settled counts match.
+                missing = [user_id for user_id in self.rep_batcher.pending_counts(guild_id, channel_id)
+                           if user_id not in listed and user_id not in stored]
+                if not missing:
+                    return rows, stored
+                stored.update(await self.executor.run(self._stored_counts, guild_id, channel_id, missing))
+
+        (rows, stored), pending = await self.rep_batcher.settled(_read, guild_id, channel_id)
+        if not pending:
+            return rows
+        for row in rows:
+            row['count'] = row.get('count', 0) + pending.pop(row['user_id'], 0)
+        for user_id, count in pending.items():
+            row = stored.get(user_id, {})
+            rows.append({'user_id': user_id, 'count': row.get('count', 0) + count, 'display_name': row.get('display_name')})
+        rows.sort(key=lambda row: (row['count'], row['user_id']), reverse=True)
+        return rows[:limit]
+
+    async def users_after(self, guild_id: str, channel_id: Optional[str], after: Dict, limit: int) -> List[Dict]:
+        doc_id = after['user_id'] if channel_id else f"{guild_id}_{after['user_id']}"
+        query = self._ranked(guild_id, channel_id).start_after({'count': after['count'], '__name__': doc_id}).limit(limit)
+        return [doc.to_dict() for doc in await self.executor.run(lambda: self._stream(query))]
+
+    async def window_totals(self, guild_id: str, since_day: str) -> List[Dict]:
+        # Settled like top_users, so a window agrees with the all-time board
+        # on reps still waiting in the write-behind queue.
+        start = datetime.date.fromisoformat(since_day)
+        days = [(start + datetime.timedelta(days=n)).isoformat()
+                for n in range((datetime.date.fromisoformat(rep_day()) - start).days + 1)]
+        refs = [self.rep_days_collection.document(f"{guild_id}_{day}") for day in days]
+
+        def _sum():
+            totals = {}
+            for doc in self.db.get_all(refs, field_paths=['users']):
+                if not doc.exists:
+                    continue
+                for user_id, count in (doc.to_dict().get('users') or {}).items():
+                    totals[user_id] = totals.get(user_id, 0) + count
+            metrics.incr('firestore.reads', len(refs))
+            return totals
+
+        totals, pending = await self.rep_batcher.settled(lambda: self.executor.run(_sum), guild_id, since_day=since_day)
+        for user_id, count in pending.items():
+            totals[user_id] = totals.get(user_id, 0) + count
+        return rank_totals(totals)
+
+    async def compact_rep_days(self, before_day: str) -> int:
+        return await self.bulk_delete(self.rep_days_collection.where('day', '<', before_day), order_by=('day',))
+
+    def _rep_events(self, after: Optional[Dict], limit: int, guild_id: Optional[str]) -> List[Dict]:
+        # Reads event packs in (ts, id) order until the page is full. An
+        # event's id is "<pack id>/<index>", so a page can end part way
+        # through a pack. The packs fetched but not finished are held, and
+        # the next page resumes from them rather than reading them again.
+        # Packs are fetched a few at a time, as many as the events still
+        # wanted should fill, so each is read about once per replay and a
+        # page holds at most one fetch beyond its own events.
+        # Filtering by guild needs the composite index (guild_ids array, ts, __name__).
+        query = self.rep_events_collection
+        if guild_id is not None:
+            query = query.where('guild_ids', 'array_contains', guild_id)
+        query = query.order_by('ts').order_by('__name__')
+        after_pack, after_index = after['id'].split('/') if after else (None, '-1')
+        held, self._held_packs = self._held_packs, None
+        if after is not None and held is not None and held[0] == guild_id and held[1][0][0] == after_pack:
+            packs, exhausted = held[1], held[2]
+            next_query = query.start_after({'ts': packs[-1][1]['ts'], '__name__': packs[-1][0]})
+        else:
+            packs, exhausted = [], False
+            next_query = query.start_at({'ts': after['ts'], '__name__': after_pack}) if after else query
+        events = []
+        packs_read = 0
+        while True:
+            for position, (pack_id, pack) in enumerate(packs):
+                start = int(after_index) + 1 if pack_id == after_pack else 0
+                for index in range(start, len(pack['events'])):
+                    event = pack['events'][index]
+                    if guild_id is not None and event['g'] != guild_id:
+                        continue
+                    events.append({
+                        'id': f"{pack_id}/{index}",
+                        'guild_id': event['g'],
+                        'user_id': event['u'],
+                        'channel_id': event['c'],
+                        'given_by': event['b'],
+                        'ts': pack['ts'],
+                    })
+                    if len(events) == limit:
+                        self._held_packs = (guild_id, packs[position:], exhausted)
+                        return events
+            if exhausted:
+                return events
+            per_pack = len(events) / packs_read if packs_read and events else 0
+            want = min(REP_EVENT_DOCS_PER_PAGE, max(1, math.ceil((limit - len(events)) / per_pack))) if per_pack else 1
+            docs = self._stream(next_query.limit(want))
+            packs = [(doc.id, doc.to_dict()) for doc in docs]
+            packs_read += len(packs)
+            exhausted = len(docs) < want
+            if packs:
+                next_query = query.start_after({'ts': packs[-1][1]['ts'], '__name__': packs[-1][0]})
+
+    async def rep_events(self, after: Optional[Dict], limit: int, guild_id: Optional[str] = None) -> List[Dict]:
+        return await self.executor.run(self._rep_events, after, limit, guild_id)
+
+    async def channel_totals(self, guild_id: str) -> Dict[str, int]:
+        query = self.channels_collection.where('guild_id', '==', guild_id).select(['channel_id', 'total_resources'])
+        docs = await self.executor.run(lambda: self._stream(query))
+        return {doc.get('channel_id'): doc.get('total_resources') or 0 for doc in docs}
+
+    async def _commit_increments(self, writes: List[Tuple[Any, Dict[str, Any]]]):
+        def _commit(chunk):
+            batch = self.db.batch()
+            for ref, data in chunk:
+                batch.set(ref, data, merge=True)
+            batch.commit()
+            metrics.incr('firestore.writes', len(chunk))
+
+        for start in range(0, len(writes), FIRESTORE_BATCH_LIMIT):
+            await self.executor.run(_commit, writes[start:start + FIRESTORE_BATCH_LIMIT])
+
+    async def adjust_rep_counts(self, guild_id: str, deltas: Dict[str, int], channel_id: Optional[str] = None):
+        # Increments rather than sets, so a rep landing meanwhile still counts.
+        # A channel count also lives in the users map of the channel doc and
+        # the channels map of the user doc; both are adjusted too, or a
+        # later backfill from those maps would undo the correction.
+        writes = []
+        for user_id, delta in deltas.items():
+            user_ref = self.resources_collection.document(f"{guild_id}_{user_id}")
+            if channel_id is None:
+                writes.append((user_ref, {'guild_id': guild_id, 'user_id': user_id, 'count': firestore.Increment(delta)}))
+                continue
+            channel_ref = self.channels_collection.document(f"{guild_id}_{channel_id}")
+            writes += [
+                (channel_ref.collection('users').document(user_id), {
+                    'guild_id': guild_id,
+                    'channel_id': channel_id,
+                    'user_id': user_id,
+                    'count': firestore.Increment(delta),
+                }),
+                (channel_ref, {'guild_id': guild_id, 'channel_id': channel_id, 'users': {user_id: firestore.Increment(delta)}}),
+                (user_ref, {'guild_id': guild_id, 'user_id': user_id, 'channels': {channel_id: {'count': firestore.Increment(delta)}}}),
+            ]
+        await self._commit_increments(writes)
+
+    async def adjust_channel_totals(self, guild_id: str, deltas: Dict[str, int]):
+        await self._commit_increments([(self.channels_collection.document(f"{guild_id}_{channel_id}"), {
+            'guild_id': guild_id,
+            'channel_id': channel_id,
+            'total_resources': firestore.Increment(delta),
+        }) for channel_id, delta in deltas.items()])
+
+    @property
+    def warning_counts_collection(self):
+        return self.db.collection('warning_counts')
+
+    def _user_warnings(self, guild_id: str, user_id: str):
+        return (self.warnings_collection
+                .where('guild_id', '==', guild_id)
+                .where('user_id', '==', user_id))
+
+    def _stage_warning(self, batch, guild_id: str, user_id: str, reason: str, mod_id: str):
+        # Two writes: the warning itself and an increment of its user's
+        # running count, which count_warnings seeds on first read.
+        warning_id = f"{guild_id}_{user_id}_{datetime.datetime.now().timestamp()}"
+        batch.set(self.warnings_collection.document(warning_id), {
+            'guild_id': guild_id,
+            'user_id': user_id,
+            'reason': reason,
+            'mod_id': mod_id,
+            'timestamp': firestore.SERVER_TIMESTAMP
+        })
+        batch.set(self.warning_counts_collection.document(f"{guild_id}_{user_id}"), {
+            'guild_id': guild_id,
+            'user_id': user_id,
+            'count': firestore.Increment(1)
+        }, merge=True)
+
+    def _seed_warning_count(self, guild_id: str, user_id: str, before: Optional[int], count: int):
+        # `count` is a count() of the user's warnings and `before` the
+        # summary's count read just ahead of it. The summary is only marked
+        # seeded if no warning has incremented it since, so every warning
+        # committed by then is in `count`; otherwise a later read seeds it.
+        ref = self.warning_counts_collection.document(f"{guild_id}_{user_id}")
+
+        @firestore.transactional
+        def _seed(transaction):
+            snapshot = ref.get(transaction=transaction)
+            current = (snapshot.to_dict() or {}).get('count') if snapshot.exists else None
+            if current != before:
+                return
+            transaction.set(ref, {'guild_id': guild_id, 'user_id': user_id, 'count': count, 'seeded': True})
+
+        _seed(self.db.transaction())
+        metrics.incr('firestore.reads')
+        metrics.incr('firestore.writes')
+
+    async def add_warning(self, guild_id: str, user_id: str, reason: str, mod_id: str):
+        def _add():
+            batch = self.db.batch()
+            self._stage_warning(batch, guild_id, user_id, reason, mod_id)
+            batch.commit()
+            metrics.incr('firestore.writes', 2)
+
+        await self.executor.run(_add)
+
+    async def add_warnings(self, guild_id: str, user_ids: List[str], reason: str, mod_id: str):
+        # Bulk moderation lands hundreds of warnings at once; they go out as
+        # full WriteBatches instead of one commit per user.
+        per_batch = FIRESTORE_BATCH_LIMIT // 2
+
+        def _commit(chunk):
+            batch = self.db.batch()
+            for user_id in chunk:
+                self._stage_warning(batch, guild_id, user_id, reason, mod_id)
+            batch.commit()
+            metrics.incr('firestore.writes', 2 * len(chunk))
+
+        for start in range(0, len(user_ids), per_batch):
+            await self.executor.run(_commit, user_ids[start:start + per_batch])
+
+    async def count_warnings(self, guild_id: str, user_id: str) -> int:
+        # Summaries are written with blind increments, so one made for a user
+        # warned before summaries existed starts at 1. Until a read has
+        # seeded it from an aggregation query, it isn't trusted.
+        def _count():
+            summary = self.warning_counts_collection.document(f"{guild_id}_{user_id}").get()
+            metrics.incr('firestore.reads')
+            data = (summary.to_dict() or {}) if summary.exists else {}
+            if data.get('seeded'):
+                return data.get('count', 0)
+            count = int(self._user_warnings(guild_id, user_id).count().get()[0][0].value)
+            metrics.incr('firestore.reads')
+            if count or summary.exists:
+                self._seed_warning_count(guild_id, user_id, data.get('count') if summary.exists else None, count)
+            return count
+
+        return await self.executor.run(_count)
+
+    async def get_warnings(self, guild_id: str, user_id: str, limit: Optional[int] = None, after: Optional[Dict] = None) -> List[Dict]:
+        # Needs the composite index (guild_id, user_id, timestamp DESC).
+        query = (self._user_warnings(guild_id, user_id)
+                .order_by('timestamp', direction=firestore.Query.DESCENDING)
+                .order_by('__name__', direction=firestore.Query.DESCENDING))
+        if after is not None:
+            query = query.start_after({'timestamp': after['timestamp'], '__name__': after['id']})
+        if limit is not None:
+            query = query.limit(limit)
+        return [dict(doc.to_dict(), id=doc.id) for doc in await self.executor.run(lambda: self._stream(query))]
+
+    async def bulk_delete(self, query, page_size: int = FIRESTORE_BATCH_LIMIT, concurrency: int = BULK_DELETE_CONCURRENCY,
+                          progress: ProgressCallback = None, order_by: Tuple[str, ...] = ()) -> int:
+        # Pages through the query fetching document ids only, and deletes each
+        # page as its own batch with at most `concurrency` commits in flight.
+        # Neither memory use nor batch size grows with the result set. A
+        # query with an inequality filter is ordered by that field, and the
+        # next page's cursor is read off the last snapshot, so the field
+        # has to be passed in order_by to be kept in the projection.
+        for field in order_by:
+            query = query.order_by(field)
+        query = query.select(list(order_by)).limit(page_size)
+        slots = asyncio.Semaphore(concurrency)
+        commits = []
+        deleted = 0
+
+        def _commit(refs):
+            batch = self.db.batch()
+            for ref in refs:
+                batch.delete(ref)
+            batch.commit()
+            metrics.incr('firestore.writes', len(refs))
+            return len(refs)
+
+        async def _delete(refs):
+            nonlocal deleted
+            try:
+                deleted += await self.executor.run(_commit, refs)
+                if progress is not None:
+                    await progress(deleted)
+            finally:
+                slots.release()
+
+        last = None
+        while True:
+            page_query = query if last is None else query.start_after(last)
+            snapshots = await self.executor.run(lambda: self._stream(page_query))
+            if snapshots:
+                await slots.acquire()
+                commits.append(asyncio.create_task(_delete([snapshot.reference for snapshot in snapshots])))
+            if len(snapshots) < page_size:
+                break
+            last = snapshots[-1]
+        await asyncio.gather(*commits)
+        return deleted
+
+    async def clear_warnings(self, guild_id: str, user_id: str, progress: ProgressCallback = None) -> int:
+        deleted = await self.bulk_delete(self._user_warnings(guild_id, user_id), progress=progress)
+        await self.executor.run(self.warning_counts_collection.document(f"{guild_id}_{user_id}").delete)
+        metrics.incr('firestore.writes')
+        return deleted
+
+    async def set_afk(self, guild_id: str, user_id: str, reason: Optional[str]):
+        await self.executor.run(self.afk_collection.document(f"{guild_id}_{user_id}").set, {
+            'guild_id': guild_id,
+            'user_id': user_id,
+            'reason': reason,
+            'timestamp': firestore.SERVER_TIMESTAMP
+        })
+        metrics.incr('firestore.writes')
+
+    async def remove_afk(self, guild_id: str, user_id: str):
+        await self.executor.run(self.afk_collection.document(f"{guild_id}_{user_id}").delete)
+        metrics.incr('firestore.writes')
+
+    async def load_afk(self, page_size: int = 1000) -> List[Tuple[str, str, Optional[str]]]:
+        def _scan():
+            records = []
+            query = (self.afk_collection
+                    .order_by('__name__')
+                    .select(['guild_id', 'user_id', 'reason'])
+                    .limit(page_size))
+            last = None
+            while True:
+                page = self._stream(query.start_after(last) if last else query)
+                for doc in page:
+                    data = doc.to_dict()
+                    records.append((data.get('guild_id'), data.get('user_id'), data.get('reason')))
+                if len(page) < page_size:
+                    return records
+                last = page[-1]
+
+        return await self.executor.run(_scan)
+
+    @property
+    def config_collection(self):
+        return self.db.collection('config')
+
+    async def load_guild_configs(self, since: float = 0.0) -> List[Tuple[str, Dict[str, Any]]]:
+        # The query is built in the executor too: it can be the first use of
+        # the client, and creating that shouldn't block the event loop.
+        def _load():
+            query = self.config_collection
+            if since:
+                query = query.where('updated_at', '>', datetime.datetime.fromtimestamp(since, tz=datetime.timezone.utc))
+            return self._stream(query)
+
+        return [(doc.id, _config_settings(doc.to_dict())) for doc in await self.executor.run(_load)]
+
+    def watch_guild_configs(self, on_change: Callable[[str, Optional[Dict[str, Any]]], None]) -> Optional[Callable[[], None]]:
+        # The listener's first snapshot repeats the initial load; after that
+        # only changed documents are delivered, each billed as one read.
+        def _on_snapshot(docs, changes, read_time):
+            for change in changes:
+                metrics.incr('firestore.reads')
+                if change.type.name == 'REMOVED':
+                    on_change(change.document.id, None)
+                else:
+                    on_change(change.document.id, _config_settings(change.document.to_dict()))
+
+        return self.config_collection.on_snapshot(_on_snapshot).unsubscribe
+
+    async def save_guild_config(self, guild_id: str, settings: Dict[str, Any], merge: bool = False):
+        await self.executor.run(self.config_collection.document(guild_id).set,
+                                dict(settings, updated_at=firestore.SERVER_TIMESTAMP), merge=merge)
+        metrics.incr('firestore.writes')
+
+    async def publish_shard_stats(self, shard_id: int, stats: Dict[str, Any]):
+        await self.executor.run(self.db.collection('shard_stats').document(str(shard_id)).set, stats)
+        metrics.incr('firestore.writes')
+
+    async def load_shard_stats(self) -> List[Dict[str, Any]]:
+        docs = await self.executor.run(lambda: self._stream(self.db.collection('shard_stats')))
+        return sorted((doc.to_dict() for doc in docs), key=lambda stats: stats.get('shard_id', 0))
@@ -0,0 +1,137 @@
+import asyncio
+import logging
+import os
+from typing import Any, Callable, Dict, Iterable, Optional
+
+from triggers import DEFAULT_TRIGGERS, TriggerMatcher, get_matcher, normalize_triggers
+
+logger = logging.getLogger('resource_bot.config')
+
+DEFAULT_COOLDOWN_SECONDS = int(os.getenv('COOLDOWN_SECONDS', str(60 * 60)))
+CONFIG_POLL_SECONDS = float(os.getenv('CONFIG_POLL_SECONDS', '30'))
+
+
+class GuildConfig:
+    # One guild's settings, immutable once built. The trigger matcher is
+    # compiled up front so the hot path never touches the trigger list. An
+    # empty rep_channels means reps count in every channel; admins are
+    # extra user ids trusted with admin commands besides administrators.
+    __slots__ = ('cooldown_seconds', 'triggers', 'matcher', 'rep_channels', 'announce', 'admins')
+
+    def __init__(self, cooldown_seconds: int = DEFAULT_COOLDOWN_SECONDS, triggers: Iterable[str] = DEFAULT_TRIGGERS,
+                 rep_channels: Iterable[str] = (), announce: bool = True, admins: Iterable[str] = ()):
+        self.cooldown_seconds = cooldown_seconds
+        self.triggers = normalize_triggers(triggers)
+        self.matcher: TriggerMatcher = get_matcher(self.triggers)
+        self.rep_channels = frozenset(rep_channels)
+        self.announce = announce
+        self.admins = frozenset(admins)
+
+    def rep_allowed(self, channel_id: str) -> bool:
+        return not self.rep_channels or channel_id in self.rep_channels
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'GuildConfig':
+        # Stored documents only hold what an admin changed; anything
+        # missing falls back to the default.
+        return cls(
+            cooldown_seconds=data.get('cooldown_seconds', DEFAULT_COOLDOWN_SECONDS),
+            triggers=data.get('triggers', DEFAULT_TRIGGERS),
+            rep_channels=data.get('rep_channels', ()),
+            announce=data.get('announce', True),
+            admins=data.get('admins', ()),
+        )
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'cooldown_seconds': self.cooldown_seconds,
+            'triggers': list(self.triggers),
+            'rep_channels': sorted(self.rep_channels),
+            'announce': self.announce,
+            'admins': sorted(self.admins),
+        }
+
+
+DEFAULT_CONFIG = GuildConfig()
+
+
+class GuildConfigCache:
+    # Every guild's config in memory, so the message handler reads it with
+    # one dict lookup and guilds that never changed anything share
+    # DEFAULT_CONFIG. Backends that can push changes (Firestore's
+    # on_snapshot) keep it current; otherwise it polls for configs updated
+    # since the newest one seen. Either way a change costs reads once, not
+    # once per message.
+    def __init__(self, poll_interval: float = CONFIG_POLL_SECONDS):
+        self.poll_interval = poll_interval
+        self._configs: Dict[str, GuildConfig] = {}
+        self._settings: Dict[str, Dict[str, Any]] = {}
+        self._since = 0.0
+        self._owns: Callable[[str], bool] = lambda guild_id: True
+        self._unsubscribe: Optional[Callable[[], None]] = None
+        self._task: Optional[asyncio.Task] = None
+        self.updates = 0
+
+    def __len__(self) -> int:
+        return len(self._configs)
+
+    def get(self, guild_id: str) -> GuildConfig:
+        return self._configs.get(guild_id, DEFAULT_CONFIG)
+
+    def settings(self, guild_id: str) -> Dict[str, Any]:
+        # The guild's stored settings: only what an admin changed.
+        return self._settings.get(guild_id, {})
+
+    def apply(self, guild_id: str, settings: Optional[Dict[str, Any]]):
+        if not self._owns(guild_id):
+            return
+        if settings is None:
+            self._configs.pop(guild_id, None)
+            self._settings.pop(guild_id, None)
+        else:
+            self._since = max(self._since, settings.get('updated_at') or 0.0)
+            self._configs[guild_id] = GuildConfig.from_dict(settings)
+            self._settings[guild_id] = settings
+        self.updates += 1
+
+    async def start(self, storage, owns: Optional[Callable[[str], bool]] = None):
+        if owns is not None:
+            self._owns = owns
+        try:
+            for guild_id, settings in await storage.load_guild_configs():
+                self.apply(guild_id, settings)
+            logger.info(f"Loaded {len(self)} guild config(s)")
+        except Exception as e:
+            # Defaults apply until the listener or the next poll catches up.
+            logger.error(f"Error loading guild configs: {e}")
+        # Listener callbacks arrive on the client's own thread. Opening the
+        # listener can be the first use of the client, so like the load it
+        # runs in the storage executor rather than on the event loop.
+        loop = asyncio.get_running_loop()
+        try:
+            self._unsubscribe = await storage.executor.run(storage.watch_guild_configs,
+                lambda guild_id, settings: loop.call_soon_threadsafe(self.apply, guild_id, settings))
+        except Exception as e:
+            logger.error(f"Error watching guild configs, polling instead: {e}")
+        if self._unsubscribe is None:
+            self._task = asyncio.create_task(self._poll(storage))
+
+    async def _poll(self, storage):
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            try:
+                for guild_id, settings in await storage.load_guild_configs(self._since):
+                    self.apply(guild_id, settings)
+            except Exception as e:
+                logger.error(f"Error polling guild configs: {e}")
+
+    async def close(self):
+        if self._unsubscribe is not None:
+            self._unsubscribe()
+            self._unsubscribe = None
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def stats(self) -> Dict[str, int]:
+        return {'guilds': len(self), 'updates': self.updates}
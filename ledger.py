@@ -0,0 +1,336 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import time
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+from storage import StorageBackend, create_backend
+
+logger = logging.getLogger('resource_bot.ledger')
+
+LEDGER_PAGE_SIZE = int(os.getenv('LEDGER_PAGE_SIZE', '500'))
+LEDGER_CHECKPOINT_EVERY = int(os.getenv('LEDGER_CHECKPOINT_EVERY', '10000'))
+# Write-behind flushes and client clocks mean an event can be stored a
+# little after events stamped later than it. Replays stop this far short
+# of now, so a checkpoint never moves past an event still in flight.
+LEDGER_SETTLE_SECONDS = float(os.getenv('LEDGER_SETTLE_SECONDS', '300'))
+
+Cursor = Optional[Dict]
+# (guild, channel or None, user or None, stored, replayed)
+Mismatch = Tuple[str, Optional[str], Optional[str], int, int]
+
+
+async def stream_events(storage: StorageBackend, after: Cursor = None, guild_id: Optional[str] = None,
+                        until: Optional[float] = None, page_size: int = LEDGER_PAGE_SIZE) -> AsyncIterator[Dict]:
+    # One page in memory at a time, however long the ledger is.
+    while True:
+        page = await storage.rep_events(after, page_size, guild_id)
+        for event in page:
+            if until is not None and event['ts'] > until:
+                return
+            yield event
+        if len(page) < page_size:
+            return
+        after = page[-1]
+
+
+class RepAggregates:
+    # The totals record_rep maintains, rebuilt from events. Memory grows
+    # with the number of distinct users and channels, not with the number
+    # of events replayed.
+    TOTALS = ('users', 'channels', 'channel_users')
+
+    def __init__(self):
+        self.users: Dict[Tuple[str, str], int] = {}
+        self.channels: Dict[Tuple[str, str], int] = {}
+        self.channel_users: Dict[Tuple[str, str, str], int] = {}
+        self.events = 0
+        # Totals touched by events past the replay's cutoff. Their stored
+        # values include reps the replay stopped short of, so verify skips
+        # them. Never checkpointed: the next replay finds them again.
+        self.unsettled: Dict[str, set] = {name: set() for name in self.TOTALS}
+
+    @staticmethod
+    def _keys(event: Dict) -> Tuple[Tuple[str, tuple], ...]:
+        guild_id, user_id, channel_id = event['guild_id'], event['user_id'], event['channel_id']
+        return (('users', (guild_id, user_id)),
+                ('channels', (guild_id, channel_id)),
+                ('channel_users', (guild_id, channel_id, user_id)))
+
+    def apply(self, event: Dict):
+        for name, key in self._keys(event):
+            totals = getattr(self, name)
+            totals[key] = totals.get(key, 0) + 1
+        self.events += 1
+
+    def defer(self, event: Dict):
+        for name, key in self._keys(event):
+            self.unsettled[name].add(key)
+
+    def merge(self, other: 'RepAggregates'):
+        # Adds other's totals in; used for the opening balance.
+        for name in self.TOTALS:
+            totals = getattr(self, name)
+            for key, count in getattr(other, name).items():
+                totals[key] = totals.get(key, 0) + count
+
+    def only_guild(self, guild_id: str) -> 'RepAggregates':
+        aggregates = RepAggregates()
+        aggregates.events = self.events
+        for name in self.TOTALS:
+            setattr(aggregates, name, {key: count for key, count in getattr(self, name).items() if key[0] == guild_id})
+        return aggregates
+
+    def guilds(self) -> set:
+        return {key[0] for name in ('users', 'channels') for key in getattr(self, name)}
+
+    def to_dict(self) -> Dict:
+        data = {name: [[*key, count] for key, count in getattr(self, name).items()] for name in self.TOTALS}
+        data['events'] = self.events
+        return data
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> 'RepAggregates':
+        aggregates = cls()
+        aggregates.events = data['events']
+        for name in cls.TOTALS:
+            setattr(aggregates, name, {tuple(row[:-1]): row[-1] for row in data[name]})
+        return aggregates
+
+
+def load_checkpoint(path: str, guild_id: Optional[str]) -> Tuple[Cursor, RepAggregates]:
+    if not os.path.exists(path):
+        return None, RepAggregates()
+    with open(path) as f:
+        data = json.load(f)
+    if data.get('guild_id') != guild_id:
+        raise ValueError(f"Checkpoint {path} was taken for guild {data.get('guild_id')}, not {guild_id}")
+    return data['cursor'], RepAggregates.from_dict(data['aggregates'])
+
+
+def save_checkpoint(path: str, guild_id: Optional[str], cursor: Cursor, aggregates: RepAggregates):
+    # Written aside and renamed, so an interrupted save leaves the previous
+    # checkpoint intact.
+    with open(f"{path}.tmp", 'w') as f:
+        json.dump({'guild_id': guild_id, 'cursor': cursor, 'aggregates': aggregates.to_dict(), 'saved_at': time.time()}, f)
+    os.replace(f"{path}.tmp", path)
+
+
+def load_baseline(path: str, guild_id: Optional[str]) -> RepAggregates:
+    # The opening balance: every total as it stood before the ledger began.
+    # One taken for all guilds serves a single-guild run too.
+    with open(path) as f:
+        data = json.load(f)
+    if data.get('guild_id') not in (None, guild_id):
+        raise ValueError(f"Opening balance {path} was taken for guild {data.get('guild_id')}, not {guild_id}")
+    baseline = RepAggregates.from_dict(data['aggregates'])
+    return baseline.only_guild(guild_id) if guild_id else baseline
+
+
+def save_baseline(path: str, guild_id: Optional[str], baseline: RepAggregates):
+    with open(f"{path}.tmp", 'w') as f:
+        json.dump({'guild_id': guild_id, 'aggregates': baseline.to_dict(), 'taken_at': time.time()}, f)
+    os.replace(f"{path}.tmp", path)
+
+
+async def replay(storage: StorageBackend, guild_id: Optional[str] = None, checkpoint_path: Optional[str] = None,
+                 until: Optional[float] = None) -> RepAggregates:
+    # Replaying past the settle point (until later than that) is allowed,
+    # but the checkpoint is only ever saved inside it. Events after `until`
+    # aren't counted; the totals they touch are marked unsettled instead.
+    cursor, aggregates = load_checkpoint(checkpoint_path, guild_id) if checkpoint_path else (None, RepAggregates())
+    if cursor is not None:
+        logger.info(f"Resuming replay after {aggregates.events} event(s)")
+    settled_at = time.time() - LEDGER_SETTLE_SECONDS
+    until = settled_at if until is None else until
+    checkpointing = bool(checkpoint_path)
+    async for event in stream_events(storage, cursor, guild_id):
+        if checkpointing and event['ts'] > min(settled_at, until):
+            save_checkpoint(checkpoint_path, guild_id, cursor, aggregates)
+            checkpointing = False
+        if event['ts'] > until:
+            aggregates.defer(event)
+            continue
+        aggregates.apply(event)
+        cursor = {'id': event['id'], 'ts': event['ts']}
+        if checkpointing and aggregates.events % LEDGER_CHECKPOINT_EVERY == 0:
+            save_checkpoint(checkpoint_path, guild_id, cursor, aggregates)
+    if checkpointing:
+        save_checkpoint(checkpoint_path, guild_id, cursor, aggregates)
+    return aggregates
+
+
+async def _ranked_rows(storage: StorageBackend, guild_id: str, channel_id: Optional[str], page_size: int) -> AsyncIterator[Dict]:
+    page = await storage.top_users(guild_id, channel_id, page_size)
+    while page:
+        for row in page:
+            yield row
+        if len(page) < page_size:
+            return
+        page = await storage.users_after(guild_id, channel_id, page[-1], page_size)
+
+
+async def _verify_users(storage: StorageBackend, guild_id: str, channel_id: Optional[str], replayed: Dict[str, int],
+                        unsettled: set, page_size: int) -> AsyncIterator[Mismatch]:
+    seen = set()
+    async for row in _ranked_rows(storage, guild_id, channel_id, page_size):
+        user_id = row['user_id']
+        seen.add(user_id)
+        if user_id not in unsettled and row['count'] != replayed.get(user_id, 0):
+            yield guild_id, channel_id, user_id, row['count'], replayed.get(user_id, 0)
+    for user_id, count in replayed.items():
+        if user_id not in seen and user_id not in unsettled:
+            yield guild_id, channel_id, user_id, 0, count
+
+
+async def verify(storage: StorageBackend, aggregates: RepAggregates, guild_id: Optional[str] = None,
+                 page_size: int = LEDGER_PAGE_SIZE) -> AsyncIterator[Mismatch]:
+    # Yields (guild, channel, user, stored, replayed) for every total that
+    # disagrees with the ledger: a user's (channel None), a channel's (user
+    # None) or a user's count in a channel. Reps recorded before the ledger
+    # existed show up as stored > replayed unless an opening balance was
+    # merged into the aggregates.
+    for guild in sorted([guild_id] if guild_id else aggregates.guilds()):
+        users = {user_id: count for (event_guild, user_id), count in aggregates.users.items() if event_guild == guild}
+        unsettled = {user_id for event_guild, user_id in aggregates.unsettled['users'] if event_guild == guild}
+        async for mismatch in _verify_users(storage, guild, None, users, unsettled, page_size):
+            yield mismatch
+
+        channel_users: Dict[str, Dict[str, int]] = {}
+        for (event_guild, channel_id, user_id), count in aggregates.channel_users.items():
+            if event_guild == guild:
+                channel_users.setdefault(channel_id, {})[user_id] = count
+        channel_unsettled: Dict[str, set] = {}
+        for event_guild, channel_id, user_id in aggregates.unsettled['channel_users']:
+            if event_guild == guild:
+                channel_unsettled.setdefault(channel_id, set()).add(user_id)
+        stored_channels = await storage.channel_totals(guild)
+        replayed_channels = {channel_id: count for (event_guild, channel_id), count in aggregates.channels.items() if event_guild == guild}
+        for channel_id in sorted(set(stored_channels) | set(replayed_channels)):
+            stored, replayed = stored_channels.get(channel_id, 0), replayed_channels.get(channel_id, 0)
+            if stored != replayed and (guild, channel_id) not in aggregates.unsettled['channels']:
+                yield guild, channel_id, None, stored, replayed
+            async for mismatch in _verify_users(storage, guild, channel_id, channel_users.get(channel_id, {}),
+                                                channel_unsettled.get(channel_id, set()), page_size):
+                yield mismatch
+
+
+async def opening_balance(storage: StorageBackend, aggregates: RepAggregates, guild_id: Optional[str] = None) -> RepAggregates:
+    # Whatever the stored totals hold beyond the ledger is taken to be reps
+    # from before it existed. Totals below the ledger's are real drift and
+    # are left for rebuild.
+    baseline = RepAggregates()
+    async for guild, channel_id, user_id, stored, replayed in verify(storage, aggregates, guild_id):
+        if stored <= replayed:
+            continue
+        if user_id is None:
+            baseline.channels[(guild, channel_id)] = stored - replayed
+        elif channel_id is None:
+            baseline.users[(guild, user_id)] = stored - replayed
+        else:
+            baseline.channel_users[(guild, channel_id, user_id)] = stored - replayed
+    return baseline
+
+
+async def rebuild(storage: StorageBackend, aggregates: RepAggregates, guild_id: Optional[str] = None,
+                  dry_run: bool = False, lower: bool = False) -> Tuple[List[Mismatch], List[Mismatch]]:
+    # Moves every mismatched total onto the ledger's and returns the
+    # corrections made and those held back. The difference is applied as
+    # an increment, so a rep landing between the read and the write still
+    # counts. Run it with the bot stopped: a write-behind flush can commit
+    # a rep's total and its event in different chunks, which looks like
+    # drift while it is in flight. Without an opening balance a total
+    # above the ledger's is most likely reps from before it, so lowering
+    # totals is only done when `lower` says the aggregates include one.
+    fixes: List[Mismatch] = []
+    held: List[Mismatch] = []
+    async for mismatch in verify(storage, aggregates, guild_id):
+        (fixes if lower or mismatch[4] > mismatch[3] else held).append(mismatch)
+    if not dry_run:
+        deltas: Dict[Tuple[str, Optional[str], bool], Dict[str, int]] = {}
+        for guild, channel_id, user_id, stored, replayed in fixes:
+            if user_id is None:
+                deltas.setdefault((guild, None, True), {})[channel_id] = replayed - stored
+            else:
+                deltas.setdefault((guild, channel_id, False), {})[user_id] = replayed - stored
+        for (guild, channel_id, channel_totals), scope_deltas in deltas.items():
+            if channel_totals:
+                await storage.adjust_channel_totals(guild, scope_deltas)
+            else:
+                await storage.adjust_rep_counts(guild, scope_deltas, channel_id)
+    return fixes, held
+
+
+def describe(guild_id: str, channel_id: Optional[str], user_id: Optional[str]) -> str:
+    if user_id is None:
+        return f"guild {guild_id} channel {channel_id}"
+    if channel_id is None:
+        return f"guild {guild_id} user {user_id}"
+    return f"guild {guild_id} channel {channel_id} user {user_id}"
+
+
+async def run(args) -> int:
+    if args.command == 'baseline' and (not args.output or os.path.exists(args.output) or args.baseline):
+        # Retaking a balance would fold any drift since into it.
+        print("baseline needs --output naming a new file, and no --baseline")
+        return 2
+    storage = create_backend(os.getenv('STORAGE_BACKEND', 'firestore'))
+    try:
+        # rebuild and baseline replay right up to now, since they compare
+        # against totals that already include the newest reps.
+        until = time.time() if args.command in ('rebuild', 'baseline') else None
+        aggregates = await replay(storage, args.guild, args.checkpoint, until)
+        print(f"Replayed {aggregates.events} event(s) into {len(aggregates.users)} user total(s) "
+              f"across {len(aggregates.guilds())} guild(s)")
+        if args.command == 'baseline':
+            baseline = await opening_balance(storage, aggregates, args.guild)
+            save_baseline(args.output, args.guild, baseline)
+            print(f"Wrote an opening balance of {len(baseline.users)} user total(s) and "
+                  f"{len(baseline.channels)} channel total(s) to {args.output}")
+            return 0
+        if args.baseline:
+            aggregates.merge(load_baseline(args.baseline, args.guild))
+        if args.command == 'rebuild':
+            if args.output:
+                with open(args.output, 'w') as f:
+                    json.dump(aggregates.to_dict(), f)
+                print(f"Wrote aggregates to {args.output}")
+            fixes, held = await rebuild(storage, aggregates, args.guild, args.dry_run, lower=bool(args.baseline))
+            for guild, channel_id, user_id, stored, replayed in fixes[:args.show]:
+                print(f"  {describe(guild, channel_id, user_id)}: {stored} -> {replayed}")
+            print(f"{'Would correct' if args.dry_run else 'Corrected'} {len(fixes)} total(s)")
+            if held:
+                print(f"Left {len(held)} total(s) above the ledger's alone; they may hold reps from before it. "
+                      f"Take an opening balance with `ledger.py baseline` and pass it with --baseline to correct them.")
+            return 0
+        mismatches = 0
+        async for guild, channel_id, user_id, stored, replayed in verify(storage, aggregates, args.guild):
+            mismatches += 1
+            if mismatches <= args.show:
+                print(f"  {describe(guild, channel_id, user_id)}: stored {stored}, ledger {replayed}")
+        print(f"{mismatches} mismatched total(s)")
+        return 1 if mismatches else 0
+    finally:
+        await storage.close()
+
+
+def main():
+    from dotenv import load_dotenv
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Replay the rep ledger to rebuild or verify aggregates")
+    parser.add_argument('command', choices=['rebuild', 'verify', 'baseline'],
+                        help="baseline records what the stored totals hold beyond the ledger, as reps from before it; "
+                             "take it once, with the bot stopped")
+    parser.add_argument('--guild', help="Only replay this guild's events")
+    parser.add_argument('--checkpoint', help="Checkpoint file to resume from and save progress to")
+    parser.add_argument('--baseline', help="Opening balance to add to the replayed totals")
+    parser.add_argument('--output', help="Where rebuild writes the aggregates, or baseline the opening balance, as JSON")
+    parser.add_argument('--show', type=int, default=20, help="Mismatches or corrections to print")
+    parser.add_argument('--dry-run', action='store_true', help="Have rebuild print its corrections without writing them")
+    raise SystemExit(asyncio.run(run(parser.parse_args())))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,199 @@
+import asyncio
+import bisect
+import logging
+import os
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger('resource_bot.metrics')
+
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', '0').lower() in ('1', 'true', 'yes')
+METRICS_PORT = int(os.getenv('METRICS_PORT', '0'))
+# Loopback unless overridden; the endpoint has no auth.
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+LOOP_LAG_INTERVAL = float(os.getenv('LOOP_LAG_INTERVAL', '0.5'))
+
+# Upper bounds in seconds, Prometheus style; the last bucket is +Inf.
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    def __init__(self, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.total = 0.0
+        self.count = 0
+        self.max = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.total += value
+        self.count += 1
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, q: float) -> float:
+        # Upper bound of the bucket holding the q-th observation.
+        if not self.count:
+            return 0.0
+        target = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= target:
+                return bound
+        return self.max
+
+    def summary(self) -> Dict[str, float]:
+        return {
+            'count': self.count,
+            'mean_ms': self.total / self.count * 1000 if self.count else 0.0,
+            'p50_ms': self.quantile(0.5) * 1000,
+            'p99_ms': self.quantile(0.99) * 1000,
+            'max_ms': self.max * 1000,
+        }
+
+
+class _Timer:
+    __slots__ = ('registry', 'name', 'started')
+
+    def __init__(self, registry: 'Metrics', name: str):
+        self.registry = registry
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.registry.observe(self.name, time.perf_counter() - self.started)
+        return False
+
+
+class _NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class Metrics:
+    # Every recording call checks `enabled` first and returns, so with
+    # metrics off the hot path pays one attribute read per call site and
+    # timer() hands back a shared no-op context manager.
+    def __init__(self, enabled: bool = METRICS_ENABLED):
+        self.enabled = enabled
+        self.histograms: Dict[str, Histogram] = {}
+        self.counters: Dict[str, int] = {}
+        self._counter_lock = threading.Lock()
+        self.gauges: Dict[str, Callable[[], Dict[str, float]]] = {}
+        self.loop_lag = Histogram()
+        self.started_at = time.time()
+        self._lag_task: Optional[asyncio.Task] = None
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    def observe(self, name: str, seconds: float):
+        if not self.enabled:
+            return
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms[name] = Histogram()
+        histogram.observe(seconds)
+
+    def timer(self, name: str):
+        return _Timer(self, name) if self.enabled else _NULL_TIMER
+
+    def incr(self, name: str, value: int = 1):
+        # Storage calls count their reads and writes from executor threads.
+        if not self.enabled:
+            return
+        with self._counter_lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def register_gauges(self, name: str, collect: Callable[[], Dict[str, float]]):
+        # Gauges are pulled from their owners (cache stats and the like)
+        # only when a snapshot is taken.
+        self.gauges[name] = collect
+
+    async def _sample_loop_lag(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + LOOP_LAG_INTERVAL
+            await asyncio.sleep(LOOP_LAG_INTERVAL)
+            self.loop_lag.observe(max(0.0, loop.time() - expected))
+
+    async def start(self, port: int = METRICS_PORT, host: str = METRICS_HOST):
+        if not self.enabled:
+            return
+        if self._lag_task is None:
+            self._lag_task = asyncio.create_task(self._sample_loop_lag())
+        if port and self._server is None:
+            self._server = await asyncio.start_server(self._serve, host=host, port=port)
+            logger.info(f"Serving metrics on {host}:{port}")
+
+    async def close(self):
+        if self._lag_task is not None:
+            self._lag_task.cancel()
+            self._lag_task = None
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    def snapshot(self) -> Dict[str, Dict]:
+        gauges = {}
+        for name, collect in self.gauges.items():
+            try:
+                gauges[name] = collect()
+            except Exception as e:
+                logger.error(f"Error collecting {name} metrics: {e}")
+        return {
+            'uptime_s': time.time() - self.started_at,
+            'latency': {name: histogram.summary() for name, histogram in sorted(self.histograms.items())},
+            'counters': dict(sorted(self.counters.items())),
+            'loop_lag': self.loop_lag.summary(),
+            'gauges': gauges,
+        }
+
+    def render_prometheus(self) -> str:
+        lines: List[str] = []
+        histograms = [('resource_bot_latency_seconds', f'op="{name}"', histogram) for name, histogram in sorted(self.histograms.items())]
+        histograms.append(('resource_bot_event_loop_lag_seconds', '', self.loop_lag))
+        for metric, labels, histogram in histograms:
+            cumulative = 0
+            for bound, count in zip(histogram.buckets + (float('inf'),), histogram.counts):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(f'{metric}_bucket{{{labels + "," if labels else ""}le="{le}"}} {cumulative}')
+            suffix = f'{{{labels}}}' if labels else ''
+            lines.append(f'{metric}_sum{suffix} {histogram.total}')
+            lines.append(f'{metric}_count{suffix} {histogram.count}')
+        for name, value in sorted(self.counters.items()):
+            lines.append(f'resource_bot_total{{counter="{name}"}} {value}')
+        for group, values in self.snapshot()['gauges'].items():
+            for key, value in values.items():
+                if isinstance(value, (int, float)):
+                    lines.append(f'resource_bot_gauge{{group="{group}",name="{key}"}} {value}')
+        return '\n'.join(lines) + '\n'
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            await reader.readline()
+            body = self.render_prometheus().encode()
+            writer.write(b'HTTP/1.0 200 OK\r\nContent-Type: text/plain; version=0.0.4\r\n'
+                         + f'Content-Length: {len(body)}\r\n\r\n'.encode() + body)
+            await writer.drain()
+        except Exception as e:
+            logger.error(f"Error serving metrics: {e}")
+        finally:
+            writer.close()
+
+
+metrics = Metrics()
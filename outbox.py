@@ -0,0 +1,144 @@
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Hashable, Optional, Tuple
+
+logger = logging.getLogger('resource_bot.outbox')
+
+# Discord allows roughly five messages per five seconds per channel; staying
+# under that locally means a burst queues here instead of earning 429s.
+OUTBOX_RATE = float(os.getenv('OUTBOX_RATE', '1'))
+OUTBOX_BURST = int(os.getenv('OUTBOX_BURST', '5'))
+OUTBOX_MAX_QUEUE = int(os.getenv('OUTBOX_MAX_QUEUE', '50'))
+OUTBOX_COALESCE_SECONDS = float(os.getenv('OUTBOX_COALESCE_SECONDS', '60'))
+
+Outgoing = Tuple[Optional[str], Dict[str, Any]]
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self, now: Optional[float] = None) -> float:
+        # 0 when a token was taken, otherwise how long until one is free.
+        self._refill(time.monotonic() if now is None else now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def full(self, now: Optional[float] = None) -> bool:
+        self._refill(time.monotonic() if now is None else now)
+        return self.tokens >= self.burst
+
+
+class _Lane:
+    __slots__ = ('destination', 'bucket', 'queue', 'task')
+
+    def __init__(self, destination, bucket: TokenBucket):
+        self.destination = destination
+        self.bucket = bucket
+        self.queue: Deque[Outgoing] = deque()
+        self.task: Optional[asyncio.Task] = None
+
+
+class Outbox:
+    # Handlers enqueue and return; one worker per busy destination drains
+    # its queue as its token bucket allows. A message can carry a coalesce
+    # key, and a repeat of the same key for the same destination within
+    # the window is skipped. A full queue drops its oldest message.
+    def __init__(self, rate: float = OUTBOX_RATE, burst: int = OUTBOX_BURST, max_queue: int = OUTBOX_MAX_QUEUE,
+                 coalesce_window: float = OUTBOX_COALESCE_SECONDS):
+        self.rate = rate
+        self.burst = burst
+        self.max_queue = max_queue
+        self.coalesce_window = coalesce_window
+        self._lanes: Dict[int, _Lane] = {}
+        self._recent: Dict[Tuple[int, Hashable], float] = {}
+        self._next_sweep = 0.0
+        self.sent = 0
+        self.coalesced = 0
+        self.dropped = 0
+        self.failed = 0
+
+    def send(self, destination, content: Optional[str] = None, *,
+             coalesce_key: Optional[Hashable] = None, **kwargs) -> bool:
+        now = time.monotonic()
+        if now >= self._next_sweep:
+            self._sweep(now)
+        key = destination.id
+        if coalesce_key is not None:
+            if self._recent.get((key, coalesce_key), 0.0) > now:
+                self.coalesced += 1
+                return False
+            self._recent[(key, coalesce_key)] = now + self.coalesce_window
+
+        lane = self._lanes.get(key)
+        if lane is None:
+            lane = self._lanes[key] = _Lane(destination, TokenBucket(self.rate, self.burst))
+        if len(lane.queue) >= self.max_queue:
+            lane.queue.popleft()
+            self.dropped += 1
+        lane.queue.append((content, kwargs))
+        if lane.task is None:
+            lane.task = asyncio.create_task(self._drain(lane))
+        return True
+
+    async def _drain(self, lane: _Lane):
+        try:
+            while lane.queue:
+                wait = lane.bucket.take()
+                if wait:
+                    await asyncio.sleep(wait)
+                    continue
+                content, kwargs = lane.queue.popleft()
+                try:
+                    await lane.destination.send(content, **kwargs)
+                    self.sent += 1
+                except Exception as e:
+                    self.failed += 1
+                    logger.warning(f"Error sending queued message to {lane.destination.id}: {e}")
+        finally:
+            lane.task = None
+
+    def _sweep(self, now: float):
+        # Idle lanes are forgotten once their bucket has refilled, so
+        # dropping them can't hand a channel a fresh burst early.
+        self._recent = {key: until for key, until in self._recent.items() if until > now}
+        for key in [key for key, lane in self._lanes.items()
+                    if lane.task is None and not lane.queue and lane.bucket.full(now)]:
+            del self._lanes[key]
+        self._next_sweep = now + self.coalesce_window
+
+    @property
+    def queued(self) -> int:
+        return sum(len(lane.queue) for lane in self._lanes.values())
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'lanes': len(self._lanes),
+            'queued': self.queued,
+            'sent': self.sent,
+            'coalesced': self.coalesced,
+            'dropped': self.dropped,
+            'failed': self.failed,
+        }
+
+    async def close(self, timeout: float = 5.0):
+        tasks = [lane.task for lane in self._lanes.values() if lane.task is not None]
+        if not tasks:
+            return
+        _, pending = await asyncio.wait(tasks, timeout=timeout)
+        for task in pending:
+            task.cancel()
+        if pending:
+            logger.warning(f"Dropped {self.queued} queued message(s) on shutdown")
@@ -0,0 +1,56 @@
+import os
+from typing import List, Optional, Union
+
+SHARD_COUNT = int(os.getenv('SHARD_COUNT', '0')) or None
+SHARD_IDS = os.getenv('SHARD_IDS', '')
+SHARD_STATS_INTERVAL = float(os.getenv('SHARD_STATS_INTERVAL', '60'))
+
+
+def parse_shard_ids(spec: str) -> Optional[List[int]]:
+    # "0,1,2", "0-3" or a mix like "0-1,4".
+    if not spec.strip():
+        return None
+    shard_ids = set()
+    for part in spec.split(','):
+        start, _, end = part.strip().partition('-')
+        shard_ids.update(range(int(start), int(end or start) + 1))
+    return sorted(shard_ids)
+
+
+def shard_for(guild_id: Union[int, str], shard_count: int) -> int:
+    # Discord's own guild-to-shard mapping.
+    return (int(guild_id) >> 22) % shard_count
+
+
+class ShardPlan:
+    # Which shards this process runs. With no SHARD_IDS, one process runs
+    # every shard and Discord picks the count unless SHARD_COUNT is set.
+    # Guild-scoped state (AFK, cooldowns, leaderboard caches) only ever
+    # needs the guilds this process owns, so it is partitioned for free.
+    def __init__(self, shard_ids: Optional[List[int]] = None, shard_count: Optional[int] = None):
+        if shard_ids is not None:
+            if shard_count is None:
+                raise ValueError("SHARD_IDS needs SHARD_COUNT")
+            if any(shard_id < 0 or shard_id >= shard_count for shard_id in shard_ids):
+                raise ValueError(f"Shard ids {shard_ids} out of range for {shard_count} shard(s)")
+        self.shard_ids = shard_ids
+        self.shard_count = shard_count
+        self._owned = frozenset(shard_ids) if shard_ids is not None else None
+
+    @property
+    def multi_process(self) -> bool:
+        return self._owned is not None and len(self._owned) < self.shard_count
+
+    def owns(self, guild_id: Union[int, str]) -> bool:
+        return self._owned is None or shard_for(guild_id, self.shard_count) in self._owned
+
+    def owns_shard(self, shard_id: int) -> bool:
+        return self._owned is None or shard_id in self._owned
+
+    def __str__(self) -> str:
+        if self.shard_ids is None:
+            return f"all {self.shard_count} shard(s)" if self.shard_count else "all shards"
+        return f"shard(s) {','.join(map(str, self.shard_ids))} of {self.shard_count}"
+
+
+shard_plan = ShardPlan(parse_shard_ids(SHARD_IDS), SHARD_COUNT)
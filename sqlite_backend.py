@@ -0,0 +1,361 @@
+import datetime
+import json
+import sqlite3
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from storage import ProgressCallback, StorageBackend, StorageExecutor, rank_totals, rep_day
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS resources (
+    guild_id TEXT NOT NULL,
+    user_id TEXT NOT NULL,
+    count INTEGER NOT NULL DEFAULT 0,
+    display_name TEXT,
+    PRIMARY KEY (guild_id, user_id)
+);
+CREATE INDEX IF NOT EXISTS resources_rank ON resources (guild_id, count DESC, user_id DESC);
+
+CREATE TABLE IF NOT EXISTS resource_channels (
+    guild_id TEXT NOT NULL,
+    user_id TEXT NOT NULL,
+    channel_id TEXT NOT NULL,
+    name TEXT,
+    count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (guild_id, user_id, channel_id)
+);
+
+CREATE TABLE IF NOT EXISTS resource_givers (
+    guild_id TEXT NOT NULL,
+    user_id TEXT NOT NULL,
+    given_by TEXT NOT NULL,
+    count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (guild_id, user_id, given_by)
+);
+
+CREATE TABLE IF NOT EXISTS channels (
+    guild_id TEXT NOT NULL,
+    channel_id TEXT NOT NULL,
+    channel_name TEXT,
+    total_resources INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (guild_id, channel_id)
+);
+
+CREATE TABLE IF NOT EXISTS channel_users (
+    guild_id TEXT NOT NULL,
+    channel_id TEXT NOT NULL,
+    user_id TEXT NOT NULL,
+    count INTEGER NOT NULL DEFAULT 0,
+    display_name TEXT,
+    PRIMARY KEY (guild_id, channel_id, user_id)
+);
+CREATE INDEX IF NOT EXISTS channel_users_rank ON channel_users (guild_id, channel_id, count DESC, user_id DESC);
+
+CREATE TABLE IF NOT EXISTS warnings (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    guild_id TEXT NOT NULL,
+    user_id TEXT NOT NULL,
+    reason TEXT,
+    mod_id TEXT,
+    timestamp REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS warnings_by_user ON warnings (guild_id, user_id, id DESC);
+
+CREATE TABLE IF NOT EXISTS afk (
+    guild_id TEXT NOT NULL,
+    user_id TEXT NOT NULL,
+    reason TEXT,
+    timestamp REAL NOT NULL,
+    PRIMARY KEY (guild_id, user_id)
+);
+
+CREATE TABLE IF NOT EXISTS rep_days (
+    guild_id TEXT NOT NULL,
+    day TEXT NOT NULL,
+    user_id TEXT NOT NULL,
+    count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (guild_id, day, user_id)
+);
+CREATE INDEX IF NOT EXISTS rep_days_by_day ON rep_days (day);
+
+CREATE TABLE IF NOT EXISTS rep_events (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    guild_id TEXT NOT NULL,
+    user_id TEXT NOT NULL,
+    given_by TEXT NOT NULL,
+    channel_id TEXT NOT NULL,
+    ts REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS rep_events_by_guild ON rep_events (guild_id, id);
+
+CREATE TABLE IF NOT EXISTS guild_config (
+    guild_id TEXT PRIMARY KEY,
+    settings TEXT NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS guild_config_by_update ON guild_config (updated_at);
+
+CREATE TABLE IF NOT EXISTS shard_stats (
+    shard_id INTEGER PRIMARY KEY,
+    stats TEXT NOT NULL
+);
+"""
+
+
+# Columns added after the first release; files created before them get an
+# ALTER TABLE on open.
+MIGRATIONS = (
+    ('resources', 'display_name', 'TEXT'),
+    ('channel_users', 'display_name', 'TEXT'),
+)
+
+
+def _timestamp(value: float) -> datetime.datetime:
+    return datetime.datetime.fromtimestamp(value, tz=datetime.timezone.utc)
+
+
+class SQLiteBackend(StorageBackend):
+    # Local engine for development, load tests and profiling without a
+    # Firebase project. A single-worker executor owns the connection, so
+    # statements are serialized off the event loop without extra locking.
+    def __init__(self, path: str = ':memory:'):
+        self.path = path
+        self.executor = StorageExecutor(max_workers=1)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.executescript(SCHEMA)
+        self._migrate()
+        if path != ':memory:':
+            self.conn.execute('PRAGMA journal_mode=WAL')
+
+    def _migrate(self):
+        for table, column, column_type in MIGRATIONS:
+            columns = {row['name'] for row in self.conn.execute(f"PRAGMA table_info({table})")}
+            if column not in columns:
+                self.conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {column_type}")
+
+    async def close(self):
+        await self.executor.run(self.conn.close)
+        self.executor.shutdown()
+
+    def _record_rep(self, guild_id: str, user_id: str, channel_id: str, channel_name: str, given_by: str,
+                    display_name: Optional[str]):
+        with self.conn:
+            self.conn.execute(
+                "INSERT INTO resources (guild_id, user_id, count, display_name) VALUES (?, ?, 1, ?) "
+                "ON CONFLICT (guild_id, user_id) DO UPDATE SET count = count + 1, "
+                "display_name = COALESCE(excluded.display_name, display_name)",
+                (guild_id, user_id, display_name))
+            self.conn.execute(
+                "INSERT INTO resource_channels (guild_id, user_id, channel_id, name, count) VALUES (?, ?, ?, ?, 1) "
+                "ON CONFLICT (guild_id, user_id, channel_id) DO UPDATE SET count = count + 1, name = excluded.name",
+                (guild_id, user_id, channel_id, channel_name))
+            self.conn.execute(
+                "INSERT INTO resource_givers (guild_id, user_id, given_by, count) VALUES (?, ?, ?, 1) "
+                "ON CONFLICT (guild_id, user_id, given_by) DO UPDATE SET count = count + 1",
+                (guild_id, user_id, given_by))
+            self.conn.execute(
+                "INSERT INTO channels (guild_id, channel_id, channel_name, total_resources) VALUES (?, ?, ?, 1) "
+                "ON CONFLICT (guild_id, channel_id) DO UPDATE SET total_resources = total_resources + 1, "
+                "channel_name = excluded.channel_name",
+                (guild_id, channel_id, channel_name))
+            self.conn.execute(
+                "INSERT INTO channel_users (guild_id, channel_id, user_id, count, display_name) VALUES (?, ?, ?, 1, ?) "
+                "ON CONFLICT (guild_id, channel_id, user_id) DO UPDATE SET count = count + 1, "
+                "display_name = COALESCE(excluded.display_name, display_name)",
+                (guild_id, channel_id, user_id, display_name))
+            now = time.time()
+            self.conn.execute(
+                "INSERT INTO rep_days (guild_id, day, user_id, count) VALUES (?, ?, ?, 1) "
+                "ON CONFLICT (guild_id, day, user_id) DO UPDATE SET count = count + 1",
+                (guild_id, rep_day(now), user_id))
+            self.conn.execute(
+                "INSERT INTO rep_events (guild_id, user_id, given_by, channel_id, ts) VALUES (?, ?, ?, ?, ?)",
+                (guild_id, user_id, given_by, channel_id, now))
+
+    async def record_rep(self, guild_id: str, user_id: str, channel_id: str, channel_name: str, given_by: str,
+                         display_name: Optional[str] = None):
+        await self.executor.run(self._record_rep, guild_id, user_id, channel_id, channel_name, given_by, display_name)
+
+    def _get_profile(self, guild_id: str, user_id: str, top_n: int) -> Optional[Dict]:
+        row = self.conn.execute(
+            "SELECT count, display_name FROM resources WHERE guild_id = ? AND user_id = ?", (guild_id, user_id)).fetchone()
+        if row is None:
+            return None
+        channels = self.conn.execute(
+            "SELECT channel_id, count FROM resource_channels WHERE guild_id = ? AND user_id = ? "
+            "ORDER BY count DESC, channel_id LIMIT ?", (guild_id, user_id, top_n)).fetchall()
+        givers = self.conn.execute(
+            "SELECT given_by, count FROM resource_givers WHERE guild_id = ? AND user_id = ? "
+            "ORDER BY count DESC, given_by LIMIT ?", (guild_id, user_id, top_n)).fetchall()
+        return {
+            'guild_id': guild_id,
+            'user_id': user_id,
+            'count': row['count'],
+            'display_name': row['display_name'],
+            'top_channels': [{'channel_id': channel['channel_id'], 'count': channel['count']} for channel in channels],
+            'top_givers': [{'user_id': giver['given_by'], 'count': giver['count']} for giver in givers],
+        }
+
+    async def get_profile(self, guild_id: str, user_id: str, top_n: int = 5) -> Optional[Dict]:
+        return await self.executor.run(self._get_profile, guild_id, user_id, top_n)
+
+    async def rank_of(self, guild_id: str, count: int) -> int:
+        return await self.executor.run(lambda: self.conn.execute(
+            "SELECT COUNT(*) FROM resources WHERE guild_id = ? AND count > ?", (guild_id, count)).fetchone()[0] + 1)
+
+    def _ranked(self, guild_id: str, channel_id: Optional[str], after: Optional[Dict], limit: int) -> List[Dict]:
+        if channel_id:
+            sql, params = "SELECT user_id, count, display_name FROM channel_users WHERE guild_id = ? AND channel_id = ?", [guild_id, channel_id]
+        else:
+            sql, params = "SELECT user_id, count, display_name FROM resources WHERE guild_id = ?", [guild_id]
+        if after is not None:
+            sql += " AND (count < ? OR (count = ? AND user_id < ?))"
+            params += [after['count'], after['count'], after['user_id']]
+        sql += " ORDER BY count DESC, user_id DESC LIMIT ?"
+        params.append(limit)
+        return [dict(row) for row in self.conn.execute(sql, params)]
+
+    async def top_users(self, guild_id: str, channel_id: Optional[str], limit: int) -> List[Dict]:
+        return await self.executor.run(self._ranked, guild_id, channel_id, None, limit)
+
+    async def users_after(self, guild_id: str, channel_id: Optional[str], after: Dict, limit: int) -> List[Dict]:
+        return await self.executor.run(self._ranked, guild_id, channel_id, after, limit)
+
+    async def window_totals(self, guild_id: str, since_day: str) -> List[Dict]:
+        rows = await self.executor.run(lambda: self.conn.execute(
+            "SELECT user_id, SUM(count) AS count FROM rep_days WHERE guild_id = ? AND day >= ? GROUP BY user_id",
+            (guild_id, since_day)).fetchall())
+        return rank_totals({row['user_id']: row['count'] for row in rows})
+
+    async def compact_rep_days(self, before_day: str) -> int:
+        return await self.executor.run(self._execute, "DELETE FROM rep_days WHERE day < ?", (before_day,))
+
+    def _rep_events(self, after: Optional[Dict], limit: int, guild_id: Optional[str]) -> List[Dict]:
+        sql, params = "SELECT id, guild_id, user_id, given_by, channel_id, ts FROM rep_events WHERE id > ?", [after['id'] if after else 0]
+        if guild_id is not None:
+            sql += " AND guild_id = ?"
+            params.append(guild_id)
+        sql += " ORDER BY id LIMIT ?"
+        params.append(limit)
+        return [dict(row) for row in self.conn.execute(sql, params)]
+
+    async def rep_events(self, after: Optional[Dict], limit: int, guild_id: Optional[str] = None) -> List[Dict]:
+        return await self.executor.run(self._rep_events, after, limit, guild_id)
+
+    async def channel_totals(self, guild_id: str) -> Dict[str, int]:
+        rows = await self.executor.run(lambda: self.conn.execute(
+            "SELECT channel_id, total_resources FROM channels WHERE guild_id = ?", (guild_id,)).fetchall())
+        return {row['channel_id']: row['total_resources'] for row in rows}
+
+    def _adjust_rep_counts(self, guild_id: str, deltas: Dict[str, int], channel_id: Optional[str]):
+        with self.conn:
+            if channel_id is None:
+                self.conn.executemany(
+                    "INSERT INTO resources (guild_id, user_id, count) VALUES (?, ?, ?) "
+                    "ON CONFLICT (guild_id, user_id) DO UPDATE SET count = count + excluded.count",
+                    [(guild_id, user_id, delta) for user_id, delta in deltas.items()])
+                return
+            # A channel count is kept for the leaderboard and the profile alike.
+            self.conn.executemany(
+                "INSERT INTO channel_users (guild_id, channel_id, user_id, count) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (guild_id, channel_id, user_id) DO UPDATE SET count = count + excluded.count",
+                [(guild_id, channel_id, user_id, delta) for user_id, delta in deltas.items()])
+            self.conn.executemany(
+                "INSERT INTO resource_channels (guild_id, user_id, channel_id, count) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (guild_id, user_id, channel_id) DO UPDATE SET count = count + excluded.count",
+                [(guild_id, user_id, channel_id, delta) for user_id, delta in deltas.items()])
+
+    async def adjust_rep_counts(self, guild_id: str, deltas: Dict[str, int], channel_id: Optional[str] = None):
+        await self.executor.run(self._adjust_rep_counts, guild_id, deltas, channel_id)
+
+    def _adjust_channel_totals(self, guild_id: str, deltas: Dict[str, int]):
+        with self.conn:
+            self.conn.executemany(
+                "INSERT INTO channels (guild_id, channel_id, total_resources) VALUES (?, ?, ?) "
+                "ON CONFLICT (guild_id, channel_id) DO UPDATE SET total_resources = total_resources + excluded.total_resources",
+                [(guild_id, channel_id, delta) for channel_id, delta in deltas.items()])
+
+    async def adjust_channel_totals(self, guild_id: str, deltas: Dict[str, int]):
+        await self.executor.run(self._adjust_channel_totals, guild_id, deltas)
+
+    def _execute(self, sql: str, params: Tuple) -> int:
+        with self.conn:
+            return self.conn.execute(sql, params).rowcount
+
+    async def add_warning(self, guild_id: str, user_id: str, reason: str, mod_id: str):
+        await self.executor.run(self._execute,
+            "INSERT INTO warnings (guild_id, user_id, reason, mod_id, timestamp) VALUES (?, ?, ?, ?, ?)",
+            (guild_id, user_id, reason, mod_id, time.time()))
+
+    def _add_warnings(self, guild_id: str, user_ids: List[str], reason: str, mod_id: str):
+        now = time.time()
+        with self.conn:
+            self.conn.executemany(
+                "INSERT INTO warnings (guild_id, user_id, reason, mod_id, timestamp) VALUES (?, ?, ?, ?, ?)",
+                [(guild_id, user_id, reason, mod_id, now) for user_id in user_ids])
+
+    async def add_warnings(self, guild_id: str, user_ids: List[str], reason: str, mod_id: str):
+        await self.executor.run(self._add_warnings, guild_id, user_ids, reason, mod_id)
+
+    async def count_warnings(self, guild_id: str, user_id: str) -> int:
+        return await self.executor.run(lambda: self.conn.execute(
+            "SELECT COUNT(*) FROM warnings WHERE guild_id = ? AND user_id = ?", (guild_id, user_id)).fetchone()[0])
+
+    def _get_warnings(self, guild_id: str, user_id: str, limit: Optional[int], after: Optional[Dict]) -> List[Dict]:
+        sql = "SELECT id, guild_id, user_id, reason, mod_id, timestamp FROM warnings WHERE guild_id = ? AND user_id = ?"
+        params = [guild_id, user_id]
+        if after is not None:
+            sql += " AND id < ?"
+            params.append(after['id'])
+        sql += " ORDER BY id DESC LIMIT ?"
+        params.append(-1 if limit is None else limit)
+        return [dict(row, timestamp=_timestamp(row['timestamp'])) for row in self.conn.execute(sql, params)]
+
+    async def get_warnings(self, guild_id: str, user_id: str, limit: Optional[int] = None, after: Optional[Dict] = None) -> List[Dict]:
+        return await self.executor.run(self._get_warnings, guild_id, user_id, limit, after)
+
+    async def clear_warnings(self, guild_id: str, user_id: str, progress: ProgressCallback = None) -> int:
+        deleted = await self.executor.run(self._execute,
+            "DELETE FROM warnings WHERE guild_id = ? AND user_id = ?", (guild_id, user_id))
+        if progress is not None:
+            await progress(deleted)
+        return deleted
+
+    async def set_afk(self, guild_id: str, user_id: str, reason: Optional[str]):
+        await self.executor.run(self._execute,
+            "INSERT OR REPLACE INTO afk (guild_id, user_id, reason, timestamp) VALUES (?, ?, ?, ?)",
+            (guild_id, user_id, reason, time.time()))
+
+    async def remove_afk(self, guild_id: str, user_id: str):
+        await self.executor.run(self._execute,
+            "DELETE FROM afk WHERE guild_id = ? AND user_id = ?", (guild_id, user_id))
+
+    async def load_afk(self, page_size: int = 1000) -> List[Tuple[str, str, Optional[str]]]:
+        return await self.executor.run(
+            lambda: [tuple(row) for row in self.conn.execute("SELECT guild_id, user_id, reason FROM afk")])
+
+    async def load_guild_configs(self, since: float = 0.0) -> List[Tuple[str, Dict[str, Any]]]:
+        rows = await self.executor.run(lambda: self.conn.execute(
+            "SELECT guild_id, settings, updated_at FROM guild_config WHERE updated_at > ?", (since,)).fetchall())
+        return [(row['guild_id'], dict(json.loads(row['settings']), updated_at=row['updated_at'])) for row in rows]
+
+    def _save_guild_config(self, guild_id: str, settings: Dict[str, Any], merge: bool):
+        with self.conn:
+            if merge:
+                row = self.conn.execute("SELECT settings FROM guild_config WHERE guild_id = ?", (guild_id,)).fetchone()
+                settings = dict(json.loads(row['settings']) if row else {}, **settings)
+            self.conn.execute(
+                "INSERT OR REPLACE INTO guild_config (guild_id, settings, updated_at) VALUES (?, ?, ?)",
+                (guild_id, json.dumps(settings), time.time()))
+
+    async def save_guild_config(self, guild_id: str, settings: Dict[str, Any], merge: bool = False):
+        await self.executor.run(self._save_guild_config, guild_id, settings, merge)
+
+    async def publish_shard_stats(self, shard_id: int, stats: Dict[str, Any]):
+        await self.executor.run(self._execute,
+            "INSERT OR REPLACE INTO shard_stats (shard_id, stats) VALUES (?, ?)", (shard_id, json.dumps(stats)))
+
+    async def load_shard_stats(self) -> List[Dict[str, Any]]:
+        return await self.executor.run(
+            lambda: [json.loads(row['stats']) for row in self.conn.execute("SELECT stats FROM shard_stats ORDER BY shard_id")])
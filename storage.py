@@ -0,0 +1,256 @@
+import abc
+import asyncio
+import datetime
+import functools
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple, TypeVar
+
+from metrics import metrics
+
+logger = logging.getLogger('resource_bot.storage')
+
+T = TypeVar('T')
+
+FIRESTORE_WORKERS = int(os.getenv('FIRESTORE_WORKERS', '8'))
+FIRESTORE_MAX_PENDING = int(os.getenv('FIRESTORE_MAX_PENDING', '256'))
+
+
+class StorageExecutor:
+    # The firebase_admin client is synchronous; every call goes through this
+    # pool so network round-trips never run on the gateway event loop.
+    def __init__(self, max_workers: int = FIRESTORE_WORKERS, max_pending: int = FIRESTORE_MAX_PENDING):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='firestore')
+        self._slots = None
+        self._in_flight = 0
+        self._peak_in_flight = 0
+        self._completed = 0
+        self._failed = 0
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    @property
+    def queue_depth(self) -> int:
+        return max(0, self._in_flight - self.max_workers)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'workers': self.max_workers,
+            'in_flight': self._in_flight,
+            'queue_depth': self.queue_depth,
+            'peak_in_flight': self._peak_in_flight,
+            'completed': self._completed,
+            'failed': self._failed,
+        }
+
+    async def run(self, func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_pending)
+        started = time.perf_counter() if metrics.enabled else None
+        async with self._slots:
+            self._in_flight += 1
+            self._peak_in_flight = max(self._peak_in_flight, self._in_flight)
+            try:
+                loop = asyncio.get_running_loop()
+                result = await loop.run_in_executor(self._pool, functools.partial(func, *args, **kwargs))
+                self._completed += 1
+                return result
+            except Exception:
+                self._failed += 1
+                raise
+            finally:
+                self._in_flight -= 1
+                if started is not None:
+                    # Includes time queued for a slot, which is what callers wait on.
+                    metrics.observe(f"storage.{_op_name(func)}", time.perf_counter() - started)
+
+    def shutdown(self, wait: bool = True):
+        self._pool.shutdown(wait=wait)
+        logger.info(f"Storage executor shut down ({self._completed} calls completed, {self._failed} failed)")
+
+
+def _op_name(func: Callable) -> str:
+    # Closures report as e.g. FirestoreBackend.get_warnings.<locals>._count;
+    # the enclosing method is the useful label.
+    return getattr(func, '__qualname__', type(func).__name__).split('.<locals>')[0]
+
+
+storage_executor = StorageExecutor()
+
+
+STORAGE_BACKEND = os.getenv('STORAGE_BACKEND', 'firestore')
+
+ProgressCallback = Optional[Callable[[int], Awaitable[None]]]
+
+
+def rep_day(ts: Optional[float] = None, days_ago: int = 0) -> str:
+    # Reps are bucketed by UTC day; keys sort in date order as strings.
+    moment = datetime.datetime.fromtimestamp(time.time() if ts is None else ts, tz=datetime.timezone.utc)
+    return (moment - datetime.timedelta(days=days_ago)).strftime('%Y-%m-%d')
+
+
+def rank_totals(totals: Dict[str, int]) -> List[Dict]:
+    # Same order as the all-time leaderboard: count, then user id, descending.
+    ranked = sorted(totals.items(), key=lambda item: (item[1], item[0]), reverse=True)
+    return [{'user_id': user_id, 'count': count} for user_id, count in ranked]
+
+
+class StorageBackend(abc.ABC):
+    # Everything the bot persists goes through this interface. Leaderboard
+    # rows are {'user_id', 'count', 'display_name'} dicts ordered by count,
+    # then user id, both descending; `after` is the last row of the
+    # previous page.
+    executor: StorageExecutor
+
+    async def start(self):
+        pass
+
+    async def close(self):
+        pass
+
+    async def warm_up(self):
+        pass
+
+    def shared_cooldown_store(self, duration: float):
+        return None
+
+    def watch_guild_configs(self, on_change: Callable[[str, Optional[Dict[str, Any]]], None]) -> Optional[Callable[[], None]]:
+        # Backends that can push config changes call on_change(guild_id,
+        # settings or None) from any thread and return an unsubscribe
+        # function. None means the caller has to poll load_guild_configs.
+        return None
+
+    def stats(self) -> Dict[str, Any]:
+        return {'executor': self.executor.stats()}
+
+    @abc.abstractmethod
+    async def record_rep(self, guild_id: str, user_id: str, channel_id: str, channel_name: str, given_by: str,
+                         display_name: Optional[str] = None):
+        # display_name is a snapshot of the receiver's name; leaderboard rows
+        # carry the latest one so names still render after a member leaves.
+        ...
+
+    @abc.abstractmethod
+    async def get_profile(self, guild_id: str, user_id: str, top_n: int = 5) -> Optional[Dict]:
+        # The user's count plus their top_n channels and givers, each as
+        # a list of {'channel_id'/'user_id', 'count'} ordered by count.
+        ...
+
+    @abc.abstractmethod
+    async def rank_of(self, guild_id: str, count: int) -> int:
+        # 1 + the number of users in the guild with more reps than `count`.
+        ...
+
+    @abc.abstractmethod
+    async def top_users(self, guild_id: str, channel_id: Optional[str], limit: int) -> List[Dict]:
+        ...
+
+    @abc.abstractmethod
+    async def users_after(self, guild_id: str, channel_id: Optional[str], after: Dict, limit: int) -> List[Dict]:
+        ...
+
+    @abc.abstractmethod
+    async def window_totals(self, guild_id: str, since_day: str) -> List[Dict]:
+        # Leaderboard rows summed over the daily buckets from since_day on.
+        ...
+
+    @abc.abstractmethod
+    async def compact_rep_days(self, before_day: str) -> int:
+        # Drops daily buckets older than before_day; returns how many went.
+        ...
+
+    @abc.abstractmethod
+    async def rep_events(self, after: Optional[Dict], limit: int, guild_id: Optional[str] = None) -> List[Dict]:
+        # The rep ledger in append order; `after` is the last event of the
+        # previous page.
+        ...
+
+    @abc.abstractmethod
+    async def channel_totals(self, guild_id: str) -> Dict[str, int]:
+        # Every channel's rep total in the guild, by channel id.
+        ...
+
+    @abc.abstractmethod
+    async def adjust_rep_counts(self, guild_id: str, deltas: Dict[str, int], channel_id: Optional[str] = None):
+        # Adds each delta to the user's total, or with channel_id to their
+        # count in that channel, creating it if missing. Used by
+        # `ledger.py rebuild` to correct drift.
+        ...
+
+    @abc.abstractmethod
+    async def adjust_channel_totals(self, guild_id: str, deltas: Dict[str, int]):
+        # Adds each delta to the channel's total, creating it if missing.
+        ...
+
+    @abc.abstractmethod
+    async def add_warning(self, guild_id: str, user_id: str, reason: str, mod_id: str):
+        ...
+
+    @abc.abstractmethod
+    async def add_warnings(self, guild_id: str, user_ids: List[str], reason: str, mod_id: str):
+        # The same warning for many users at once, written in as few
+        # round-trips as the backend allows.
+        ...
+
+    @abc.abstractmethod
+    async def count_warnings(self, guild_id: str, user_id: str) -> int:
+        ...
+
+    @abc.abstractmethod
+    async def get_warnings(self, guild_id: str, user_id: str, limit: Optional[int] = None, after: Optional[Dict] = None) -> List[Dict]:
+        # Newest first; `after` is the last warning of the previous page.
+        ...
+
+    @abc.abstractmethod
+    async def clear_warnings(self, guild_id: str, user_id: str, progress: ProgressCallback = None) -> int:
+        ...
+
+    @abc.abstractmethod
+    async def set_afk(self, guild_id: str, user_id: str, reason: Optional[str]):
+        ...
+
+    @abc.abstractmethod
+    async def remove_afk(self, guild_id: str, user_id: str):
+        ...
+
+    @abc.abstractmethod
+    async def load_afk(self, page_size: int = 1000) -> List[Tuple[str, str, Optional[str]]]:
+        ...
+
+    @abc.abstractmethod
+    async def load_guild_configs(self, since: float = 0.0) -> List[Tuple[str, Dict[str, Any]]]:
+        # (guild_id, settings) for each config saved after `since`; settings
+        # carry updated_at as a Unix timestamp.
+        ...
+
+    @abc.abstractmethod
+    async def save_guild_config(self, guild_id: str, settings: Dict[str, Any], merge: bool = False):
+        # Replaces the guild's settings, or with merge only the ones given;
+        # an empty dict without merge restores the defaults.
+        ...
+
+    @abc.abstractmethod
+    async def publish_shard_stats(self, shard_id: int, stats: Dict[str, Any]):
+        # Shared by every process in a multi-process deployment, so any
+        # of them can report on the whole fleet.
+        ...
+
+    @abc.abstractmethod
+    async def load_shard_stats(self) -> List[Dict[str, Any]]:
+        ...
+
+
+def create_backend(name: str = STORAGE_BACKEND) -> StorageBackend:
+    if name == 'firestore':
+        from firestore_backend import FirestoreBackend
+        return FirestoreBackend()
+    if name in ('sqlite', 'memory'):
+        from sqlite_backend import SQLiteBackend
+        return SQLiteBackend(os.getenv('SQLITE_PATH', ':memory:') if name == 'sqlite' else ':memory:')
+    raise ValueError(f"Unknown storage backend: {name}")
@@ -0,0 +1,59 @@
+from cache import LeaderboardCache
+
+
+def _entries(counts: dict) -> list:
+    return [{'user_id': user_id, 'count': count} for user_id, count in counts.items()]
+
+
+def _users(page: list) -> list:
+    return [(row['user_id'], row['count']) for row in page]
+
+
+def test_partial_board_serves_pages_above_its_floor():
+    cache = LeaderboardCache(top_k=4)
+    cache.seed('g1', None, _entries({'a': 40, 'b': 30, 'c': 20, 'd': 10, 'e': 5}), complete=False)
+    assert _users(cache.page('g1', None, 0, 3)) == [('a', 40), ('b', 30), ('c', 20)]
+    # d sits on the floor: someone outside the cache may be tied with it.
+    assert cache.page('g1', None, 0, 4) is None
+    assert cache.rank('g1', 25) == 3
+    assert cache.rank('g1', 10) is None
+
+
+def test_reps_outside_the_top_k_raise_the_floor():
+    cache = LeaderboardCache(top_k=3)
+    cache.seed('g1', None, _entries({'a': 40, 'b': 30, 'c': 20}), complete=False)
+    for _ in range(15):
+        cache.record('g1', 'c1', 'x')
+    # x may now be anywhere up to 35, so only a is known to be placed.
+    assert _users(cache.page('g1', None, 0, 1)) == [('a', 40)]
+    assert cache.page('g1', None, 0, 2) is None
+    assert cache.rank('g1', 35) is None
+    assert cache.rank('g1', 36) == 2
+
+
+def test_cached_users_move_within_the_board():
+    cache = LeaderboardCache(top_k=3)
+    cache.seed('g1', None, _entries({'a': 40, 'b': 30, 'c': 20, 'd': 1}), complete=False)
+    cache.record('g1', 'c1', 'c', delta=15, display_name='Cee')
+    page = cache.page('g1', None, 0, 2)
+    assert _users(page) == [('a', 40), ('c', 35)]
+    assert page[1]['display_name'] == 'Cee'
+
+
+def test_complete_board_places_new_users():
+    cache = LeaderboardCache(top_k=10)
+    cache.seed('g1', None, _entries({'a': 2, 'b': 1}), complete=True)
+    cache.record('g1', 'c1', 'z', delta=3)
+    assert _users(cache.page('g1', None, 0, 10)) == [('z', 3), ('a', 2), ('b', 1)]
+    assert cache.rank('g1', 0) == 4
+
+
+def test_channel_board_and_guild_board_both_count_a_rep():
+    cache = LeaderboardCache(top_k=10)
+    cache.seed('g1', None, _entries({'a': 2}), complete=True)
+    cache.seed('g1', 'c1', _entries({'a': 1}), complete=True)
+    version = cache.version('g1')
+    cache.record('g1', 'c1', 'a')
+    assert _users(cache.page('g1', None, 0, 1)) == [('a', 3)]
+    assert _users(cache.page('g1', 'c1', 0, 1)) == [('a', 2)]
+    assert cache.version('g1') != version
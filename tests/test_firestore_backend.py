@@ -0,0 +1,198 @@
+import asyncio
+import functools
+from typing import Optional
+
+from firestore_backend import FirestoreBackend, RepBatcher
+from storage import StorageExecutor
+
+from test_rep_batcher import FakeCollection, FakeDB, FakeDocument
+
+
+class FakeSnapshot:
+    def __init__(self, ref: FakeDocument, data: Optional[dict]):
+        self.reference = ref
+        self.id = ref.id
+        self.exists = data is not None
+        self._data = data or {}
+
+    def to_dict(self) -> dict:
+        return dict(self._data)
+
+    def get(self, field: str):
+        return self._data.get(field)
+
+
+class FakeQuery:
+    # Filters, ordering, cursors and limits over one collection of a
+    # FakeDB; every streamed document counts as a read.
+    def __init__(self, db: 'QueryDB', path: tuple, filters=(), orders=(), cursor=None, count=None):
+        self.db = db
+        self.path = path
+        self.filters = filters
+        self.orders = orders
+        self.cursor = cursor
+        self.count = count
+
+    def _with(self, **changes) -> 'FakeQuery':
+        state = dict(filters=self.filters, orders=self.orders, cursor=self.cursor, count=self.count)
+        state.update(changes)
+        return FakeQuery(self.db, self.path, **state)
+
+    def where(self, field: str, op: str, value) -> 'FakeQuery':
+        return self._with(filters=self.filters + ((field, op, value),))
+
+    def order_by(self, field: str, direction: str = 'ASCENDING') -> 'FakeQuery':
+        return self._with(orders=self.orders + ((field, direction),))
+
+    def select(self, fields) -> 'FakeQuery':
+        return self
+
+    def limit(self, count: int) -> 'FakeQuery':
+        return self._with(count=count)
+
+    def start_at(self, values: dict) -> 'FakeQuery':
+        return self._with(cursor=(values, True))
+
+    def start_after(self, values: dict) -> 'FakeQuery':
+        return self._with(cursor=(values, False))
+
+    def _matches(self, data: dict) -> bool:
+        for field, op, value in self.filters:
+            if op == '==' and data.get(field) != value:
+                return False
+            if op == 'array_contains' and value not in (data.get(field) or ()):
+                return False
+        return True
+
+    def _compare(self, left: dict, right: dict) -> int:
+        for field, direction in self.orders:
+            a, b = left[field], right[field]
+            if a != b:
+                result = -1 if a < b else 1
+                return -result if direction == 'DESCENDING' else result
+        return 0
+
+    def stream(self):
+        rows = [dict(data, __name__=path[-1]) for path, data in self.db.docs.items()
+                if path[:-1] == self.path and self._matches(data)]
+        rows.sort(key=functools.cmp_to_key(self._compare))
+        if self.cursor is not None:
+            values, inclusive = self.cursor
+            rows = [row for row in rows if self._compare(row, values) > (-1 if inclusive else 0)]
+        rows = rows[:self.count] if self.count is not None else rows
+        self.db.reads += len(rows)
+        return [FakeSnapshot(FakeDocument(self.db, self.path + (row.pop('__name__'),)), row) for row in rows]
+
+
+class QueryCollection(FakeCollection, FakeQuery):
+    def __init__(self, db: 'QueryDB', path: tuple):
+        FakeCollection.__init__(self, db, path)
+        FakeQuery.__init__(self, db, path)
+
+
+class QueryDB(FakeDB):
+    def __init__(self):
+        super().__init__()
+        self.reads = 0
+
+    def collection(self, name: str) -> QueryCollection:
+        return QueryCollection(self, (name,))
+
+    def get_all(self, refs, field_paths=None):
+        self.reads += len(refs)
+        return [FakeSnapshot(ref, self.docs.get(ref.path)) for ref in refs]
+
+
+def _backend(db: QueryDB) -> FirestoreBackend:
+    return FirestoreBackend(db=db, executor=StorageExecutor(max_workers=2))
+
+
+def _add_packs(db: QueryDB, packs: int, per_pack: int, guilds=('g1',)):
+    for n in range(packs):
+        events = [{'g': guilds[i % len(guilds)], 'u': f"u{i % 7}", 'c': 'c1', 'b': 'v1'} for i in range(per_pack)]
+        db.docs[('rep_events', f"pack{n:04d}")] = {'ts': float(n // 3), 'guild_ids': sorted(set(guilds)), 'events': events}
+
+
+async def _page_through(backend: FirestoreBackend, limit: int, guild_id=None):
+    events = []
+    after = None
+    while True:
+        page = await backend.rep_events(after, limit, guild_id)
+        assert len(page) <= limit
+        events += page
+        if len(page) < limit:
+            return events
+        after = page[-1]
+
+
+def test_rep_events_reads_each_pack_about_once():
+    # Pages much smaller than a pack resume from the held pack instead of
+    # reading it again for every page.
+    db = QueryDB()
+    _add_packs(db, packs=60, per_pack=2000)
+    backend = _backend(db)
+    events = asyncio.run(_page_through(backend, limit=500))
+    assert len(events) == 120000
+    assert len({event['id'] for event in events}) == 120000
+    assert db.reads <= 61
+
+
+def test_rep_events_fetches_small_packs_in_batches():
+    db = QueryDB()
+    _add_packs(db, packs=200, per_pack=7)
+    backend = _backend(db)
+    events = asyncio.run(_page_through(backend, limit=100))
+    assert [event['id'] for event in events] == [f"pack{n:04d}/{i}" for n in range(200) for i in range(7)]
+    assert db.reads <= 220
+
+
+def test_rep_events_filters_by_guild_across_pages():
+    db = QueryDB()
+    _add_packs(db, packs=10, per_pack=50, guilds=('g1', 'g2'))
+    backend = _backend(db)
+    events = asyncio.run(_page_through(backend, limit=30, guild_id='g2'))
+    assert len(events) == 250
+    assert all(event['guild_id'] == 'g2' for event in events)
+    assert len({event['id'] for event in events}) == 250
+
+
+def test_rep_events_restarts_from_a_cursor_without_held_packs():
+    # A fresh backend (or another guild's page in between) starts at the
+    # cursor's pack and skips what was already returned.
+    db = QueryDB()
+    _add_packs(db, packs=4, per_pack=10)
+    first = asyncio.run(_backend(db).rep_events(None, 15))
+    rest = asyncio.run(_backend(db).rep_events(first[-1], 1000))
+    assert [event['id'] for event in first + rest] == [f"pack{n:04d}/{i}" for n in range(4) for i in range(10)]
+
+
+def _ranked_backend(db: QueryDB, counts: dict) -> FirestoreBackend:
+    for user_id, count in counts.items():
+        db.docs[('resources', f"g1_{user_id}")] = {'guild_id': 'g1', 'user_id': user_id, 'count': count}
+    backend = _backend(db)
+    backend.rep_batcher = RepBatcher(backend, backend.executor, flush_interval_ms=60000)
+    return backend
+
+
+def test_top_users_places_pending_users_outside_a_full_page():
+    # u9 is below the page on its stored count, but its pending reps put
+    # it second; u10 has no stored doc and stays off the page.
+    db = QueryDB()
+    backend = _ranked_backend(db, {f"u{n}": 100 - n * 10 for n in range(10)})
+    for _ in range(85):
+        backend.rep_batcher.add('g1', 'u9', 'c1', '#c1', 'v1', 'Nine')
+    backend.rep_batcher.add('g1', 'u10', 'c1', '#c1', 'v1')
+    rows = asyncio.run(backend.top_users('g1', None, 5))
+    assert [(row['user_id'], row['count']) for row in rows] == [
+        ('u0', 100), ('u9', 95), ('u1', 90), ('u2', 80), ('u3', 70)]
+
+
+def test_top_users_adds_pending_reps_to_a_short_page():
+    db = QueryDB()
+    backend = _ranked_backend(db, {'u1': 3, 'u2': 2})
+    backend.rep_batcher.add('g1', 'u2', 'c1', '#c1', 'v1')
+    backend.rep_batcher.add('g1', 'u2', 'c1', '#c1', 'v1')
+    backend.rep_batcher.add('g1', 'u3', 'c1', '#c1', 'v1')
+    rows = asyncio.run(backend.top_users('g1', None, 5))
+    assert [(row['user_id'], row['count']) for row in rows] == [('u2', 4), ('u1', 3), ('u3', 1)]
+    assert db.reads == 2
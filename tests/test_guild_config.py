@@ -0,0 +1,93 @@
+import asyncio
+import threading
+
+from guild_config import DEFAULT_CONFIG, DEFAULT_COOLDOWN_SECONDS, GuildConfig, GuildConfigCache
+from sqlite_backend import SQLiteBackend
+from storage import StorageExecutor
+from triggers import DEFAULT_TRIGGERS
+
+
+def test_stored_settings_fall_back_to_defaults():
+    config = GuildConfig.from_dict({'triggers': ['Cheers '], 'rep_channels': ['c1']})
+    assert config.cooldown_seconds == DEFAULT_COOLDOWN_SECONDS
+    assert config.triggers == ('cheers',)
+    assert config.matcher.matches('cheers!') and not config.matcher.matches('thanks')
+    assert config.rep_allowed('c1') and not config.rep_allowed('c2')
+    assert DEFAULT_CONFIG.rep_allowed('c2')
+    assert GuildConfig.from_dict({}).to_dict() == DEFAULT_CONFIG.to_dict()
+    assert DEFAULT_CONFIG.to_dict()['triggers'] == sorted(DEFAULT_TRIGGERS)
+
+
+def test_apply_keeps_only_owned_guilds():
+    cache = GuildConfigCache()
+    cache._owns = lambda guild_id: guild_id != 'other'
+    cache.apply('g1', {'announce': False, 'updated_at': 5.0})
+    cache.apply('other', {'announce': False, 'updated_at': 9.0})
+    assert cache.get('g1').announce is False
+    assert cache.get('other') is DEFAULT_CONFIG
+    assert cache.settings('g1') == {'announce': False, 'updated_at': 5.0}
+    assert cache._since == 5.0
+    cache.apply('g1', None)
+    assert cache.get('g1') is DEFAULT_CONFIG and cache.settings('g1') == {}
+    assert cache.stats() == {'guilds': 0, 'updates': 2}
+
+
+def test_polls_storage_for_merged_changes():
+    async def _test():
+        storage = SQLiteBackend()
+        await storage.save_guild_config('g1', {'cooldown_seconds': 10})
+        cache = GuildConfigCache(poll_interval=0.01)
+        await cache.start(storage)
+        assert cache.get('g1').cooldown_seconds == 10
+
+        # A merged save keeps the settings it doesn't name.
+        await storage.save_guild_config('g1', {'announce': False}, merge=True)
+        await storage.save_guild_config('g2', {'admins': ['u1']})
+        for _ in range(100):
+            if len(cache) == 2 and not cache.get('g1').announce:
+                break
+            await asyncio.sleep(0.01)
+        g1, g2 = cache.get('g1'), cache.get('g2')
+        await cache.close()
+        await storage.close()
+        return g1, g2
+
+    g1, g2 = asyncio.run(_test())
+    assert (g1.cooldown_seconds, g1.announce) == (10, False)
+    assert g2.admins == frozenset({'u1'})
+
+
+class WatchedStorage:
+    # A backend that pushes changes from its own thread, like Firestore's
+    # on_snapshot listener.
+    def __init__(self):
+        self.executor = StorageExecutor(max_workers=1)
+        self.on_change = None
+        self.unsubscribed = False
+
+    async def load_guild_configs(self, since: float = 0.0):
+        return [('g1', {'announce': False, 'updated_at': 1.0})]
+
+    def watch_guild_configs(self, on_change):
+        self.on_change = on_change
+        return lambda: setattr(self, 'unsubscribed', True)
+
+
+def test_applies_pushed_changes_without_polling():
+    async def _test():
+        storage = WatchedStorage()
+        cache = GuildConfigCache(poll_interval=0.01)
+        await cache.start(storage)
+        assert cache.get('g1').announce is False and cache._task is None
+        pusher = threading.Thread(target=storage.on_change, args=('g1', None))
+        pusher.start()
+        pusher.join()
+        await asyncio.sleep(0)
+        config = cache.get('g1')
+        await cache.close()
+        storage.executor.shutdown()
+        return config, storage
+
+    config, storage = asyncio.run(_test())
+    assert config is DEFAULT_CONFIG
+    assert storage.unsubscribed
@@ -0,0 +1,92 @@
+import asyncio
+
+import pytest
+
+from outbox import Outbox, TokenBucket
+
+
+class FakeChannel:
+    def __init__(self, channel_id: int, fail: bool = False):
+        self.id = channel_id
+        self.fail = fail
+        self.sent = []
+
+    async def send(self, content=None, **kwargs):
+        if self.fail:
+            raise RuntimeError("Forbidden")
+        self.sent.append(content)
+
+
+def test_token_bucket_allows_a_burst_then_the_rate():
+    bucket = TokenBucket(rate=2, burst=3)
+    start = bucket.updated
+    assert [bucket.take(start) for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert bucket.take(start) == pytest.approx(0.5)
+    assert bucket.take(start + 0.25) == pytest.approx(0.25)
+    assert bucket.take(start + 0.51) == 0.0
+    assert not bucket.full(start + 1.0)
+    # Refills stop at the burst size.
+    assert bucket.full(start + 60)
+    assert [bucket.take(start + 60) for _ in range(4)] == pytest.approx([0.0, 0.0, 0.0, 0.5])
+
+
+def test_outbox_sends_in_order_and_coalesces_repeats():
+    async def _test():
+        outbox = Outbox(rate=1000, burst=2, coalesce_window=60)
+        channel, other = FakeChannel(1), FakeChannel(2)
+        assert outbox.send(channel, 'one', coalesce_key='afk')
+        assert not outbox.send(channel, 'again', coalesce_key='afk')
+        assert outbox.send(other, 'elsewhere', coalesce_key='afk')
+        for n in range(5):
+            outbox.send(channel, f"m{n}")
+        await outbox.close()
+        return outbox, channel, other
+
+    outbox, channel, other = asyncio.run(_test())
+    assert channel.sent == ['one', 'm0', 'm1', 'm2', 'm3', 'm4']
+    assert other.sent == ['elsewhere']
+    assert outbox.stats() == {'lanes': 2, 'queued': 0, 'sent': 7, 'coalesced': 1, 'dropped': 0, 'failed': 0}
+
+
+def test_outbox_drops_the_oldest_message_when_a_queue_is_full():
+    async def _test():
+        outbox = Outbox(rate=1000, burst=1, max_queue=3)
+        channel = FakeChannel(1)
+        for n in range(5):
+            outbox.send(channel, f"m{n}")
+        await outbox.close()
+        return outbox, channel
+
+    outbox, channel = asyncio.run(_test())
+    assert channel.sent == ['m2', 'm3', 'm4']
+    assert outbox.dropped == 2
+
+
+def test_outbox_counts_failed_sends_and_keeps_draining():
+    async def _test():
+        outbox = Outbox(rate=1000, burst=5)
+        broken, channel = FakeChannel(1, fail=True), FakeChannel(2)
+        outbox.send(broken, 'lost')
+        outbox.send(channel, 'kept')
+        await outbox.close()
+        return outbox, channel
+
+    outbox, channel = asyncio.run(_test())
+    assert channel.sent == ['kept']
+    assert (outbox.sent, outbox.failed) == (1, 1)
+
+
+def test_outbox_waits_for_tokens_instead_of_sending_early():
+    async def _test():
+        outbox = Outbox(rate=50, burst=1)
+        channel = FakeChannel(1)
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        for n in range(3):
+            outbox.send(channel, f"m{n}")
+        await outbox.close()
+        return loop.time() - start, channel
+
+    elapsed, channel = asyncio.run(_test())
+    assert channel.sent == ['m0', 'm1', 'm2']
+    assert elapsed >= 0.035
@@ -0,0 +1,197 @@
+import asyncio
+import threading
+import time
+from collections import Counter
+
+from google.cloud.firestore_v1.transforms import Increment
+
+from firestore_backend import FirestoreBackend, RepBatcher
+from storage import StorageExecutor, rep_day
+
+REPS = 2000
+GUILDS = ('g1', 'g2')
+USERS = tuple(f"u{n}" for n in range(25))
+CHANNELS = tuple(f"c{n}" for n in range(4))
+GIVERS = tuple(f"v{n}" for n in range(10))
+
+
+def _merge(current: dict, data: dict, merge: bool) -> dict:
+    merged = dict(current) if merge else {}
+    for key, value in data.items():
+        if isinstance(value, Increment):
+            merged[key] = (merged.get(key) or 0) + value.value
+        elif isinstance(value, dict):
+            merged[key] = _merge(merged.get(key) or {} if merge else {}, value, merge)
+        else:
+            merged[key] = value
+    return merged
+
+
+class FakeDocument:
+    def __init__(self, db: 'FakeDB', path: tuple):
+        self.db = db
+        self.path = path
+        self.id = path[-1]
+
+    def collection(self, name: str) -> 'FakeCollection':
+        return FakeCollection(self.db, self.path + (name,))
+
+
+class FakeCollection:
+    def __init__(self, db: 'FakeDB', path: tuple):
+        self.db = db
+        self.path = path
+
+    def document(self, doc_id: str) -> FakeDocument:
+        return FakeDocument(self.db, self.path + (doc_id,))
+
+
+class FakeBatch:
+    def __init__(self, db: 'FakeDB'):
+        self.db = db
+        self.writes = []
+
+    def set(self, ref: FakeDocument, data: dict, merge: bool = False):
+        self.writes.append((ref.path, data, merge))
+
+    def commit(self):
+        # Firestore applies a batch's transforms atomically server side;
+        # the lock stands in for that across executor threads.
+        with self.db.lock:
+            if self.db.failures:
+                self.db.failures -= 1
+                raise RuntimeError("UNAVAILABLE")
+            for path, data, merge in self.writes:
+                self.db.docs[path] = _merge(self.db.docs.get(path, {}), data, merge)
+
+
+class FakeDB:
+    # Just enough of the client for RepBatcher: documents, subcollections,
+    # batches, and merge-sets with Increment transforms.
+    def __init__(self, failures: int = 0):
+        self.docs = {}
+        self.failures = failures
+        self.lock = threading.Lock()
+
+    def collection(self, name: str) -> FakeCollection:
+        return FakeCollection(self, (name,))
+
+    def batch(self) -> FakeBatch:
+        return FakeBatch(self)
+
+    def collection_docs(self, name: str) -> dict:
+        return {path[1:]: data for path, data in self.docs.items() if path[0] == name and len(path) == 2}
+
+
+def _reps():
+    return [(GUILDS[n % 2], USERS[n % 25], CHANNELS[n % 4], GIVERS[n % 10]) for n in range(REPS)]
+
+
+def _expected():
+    reps = _reps()
+    return {
+        'users': Counter((guild, user) for guild, user, _, _ in reps),
+        'channels': Counter((guild, channel) for guild, _, channel, _ in reps),
+        'channel_users': Counter((guild, channel, user) for guild, user, channel, _ in reps),
+        'givers': Counter((guild, user, giver) for guild, user, _, giver in reps),
+    }
+
+
+async def _record_concurrently(flush_interval_ms: int, failures: int = 0) -> FakeDB:
+    db = FakeDB(failures)
+    executor = StorageExecutor(max_workers=8)
+    backend = FirestoreBackend(db=db, executor=executor)
+    backend.rep_batcher = RepBatcher(backend, executor, flush_interval_ms=flush_interval_ms, max_ops=200)
+    await backend.start()
+    await asyncio.gather(*(
+        backend.record_rep(guild, user, channel, f"#{channel}", giver, f"User {user}")
+        for guild, user, channel, giver in _reps()
+    ))
+    await backend.close()
+    executor.shutdown()
+    return db
+
+
+def _assert_exact(db: FakeDB):
+    expected = _expected()
+    resources = db.collection_docs('resources')
+    assert {tuple(key[0].split('_')): doc['count'] for key, doc in resources.items()} == dict(expected['users'])
+    givers = {(doc['guild_id'], doc['user_id'], path[3]): doc['count']
+              for path, doc in db.docs.items() if path[0] == 'resources' and len(path) == 4}
+    assert givers == dict(expected['givers'])
+    channels = db.collection_docs('channels')
+    assert {tuple(key[0].split('_')): doc['total_resources'] for key, doc in channels.items()} == dict(expected['channels'])
+    channel_users = {(path[1].split('_')[0], path[1].split('_')[1], path[3]): doc['count']
+                     for path, doc in db.docs.items() if path[0] == 'channels' and len(path) == 4}
+    assert channel_users == dict(expected['channel_users'])
+    days = db.collection_docs('rep_days')
+    assert sum(count for doc in days.values() for count in doc['users'].values()) == REPS
+    assert all(key[0].endswith(rep_day()) for key in days)
+    events = Counter((event['g'], event['u'], event['c'], event['b'])
+                     for doc in db.collection_docs('rep_events').values() for event in doc['events'])
+    assert events == Counter(_reps())
+
+
+def test_direct_mode_concurrent_reps_are_exact():
+    _assert_exact(asyncio.run(_record_concurrently(flush_interval_ms=0)))
+
+
+def test_write_behind_concurrent_reps_are_exact():
+    _assert_exact(asyncio.run(_record_concurrently(flush_interval_ms=50)))
+
+
+def test_write_behind_retries_failed_chunks_exactly_once():
+    # A commit that fails before applying anything is retried, at the
+    # latest by the final flush on close, and lands exactly once.
+    _assert_exact(asyncio.run(_record_concurrently(flush_interval_ms=50, failures=1)))
+
+
+def _settled_total(db: FakeDB, batcher: RepBatcher, guild: str, user: str, delay: float = 0):
+    async def _read():
+        def _get():
+            time.sleep(delay)
+            with db.lock:
+                return (db.docs.get(('resources', f"{guild}_{user}")) or {}).get('count', 0)
+        return await batcher.executor.run(_get)
+
+    return batcher.settled(_read, guild)
+
+
+def test_settled_reads_do_not_flush():
+    db = FakeDB()
+    executor = StorageExecutor(max_workers=2)
+    batcher = RepBatcher(FirestoreBackend(db=db, executor=executor), executor, flush_interval_ms=60000)
+    for _ in range(3):
+        batcher.add('g1', 'u1', 'c1', '#c1', 'v1')
+    stored, pending = asyncio.run(_settled_total(db, batcher, 'g1', 'u1'))
+    assert (stored, pending) == (0, {'u1': 3})
+    assert not db.docs
+    executor.shutdown()
+
+
+def test_settled_reads_count_each_rep_once_while_flushing():
+    # Reads racing flushes see every rep exactly once, either committed or
+    # in the pending counts, including chunks a flush has taken but not
+    # yet committed.
+    async def _run():
+        db = FakeDB()
+        executor = StorageExecutor(max_workers=8)
+        batcher = RepBatcher(FirestoreBackend(db=db, executor=executor), executor, flush_interval_ms=60000)
+        recorded = 0
+        totals = []
+        for _ in range(20):
+            for _ in range(30):
+                batcher.add('g1', 'u1', 'c1', '#c1', 'v1')
+                recorded += 1
+            # The slow read is running when the flush takes its chunks.
+            reads = [asyncio.ensure_future(_settled_total(db, batcher, 'g1', 'u1', delay=0.005))]
+            await asyncio.sleep(0.001)
+            flush = asyncio.ensure_future(batcher.flush())
+            await asyncio.sleep(0)
+            reads += [asyncio.ensure_future(_settled_total(db, batcher, 'g1', 'u1')) for _ in range(4)]
+            totals += [(recorded, stored + pending.get('u1', 0)) for stored, pending in await asyncio.gather(*reads)]
+            await flush
+        executor.shutdown()
+        return totals
+
+    assert all(expected == seen for expected, seen in asyncio.run(_run()))
@@ -0,0 +1,56 @@
+import random
+
+from triggers import DEFAULT_TRIGGERS, TriggerMatcher, get_matcher, normalize_triggers
+
+
+def _legacy_contains(content: str, triggers) -> bool:
+    # The find()-based scan TriggerMatcher replaced.
+    content_lower = content.lower()
+    for trigger in triggers:
+        start_pos = 0
+        while True:
+            pos = content_lower.find(trigger, start_pos)
+            if pos == -1:
+                break
+            before_pos = pos - 1
+            after_pos = pos + len(trigger)
+            before_ok = before_pos < 0 or content_lower[before_pos].isspace() or not content_lower[before_pos].isalnum()
+            after_ok = after_pos >= len(content_lower) or content_lower[after_pos].isspace() or not content_lower[after_pos].isalnum()
+            if before_ok and after_ok:
+                return True
+            start_pos = pos + 1
+    return False
+
+
+CASES = [
+    'thanks!', 'Thanks a lot', 'THX', 'ty', 'tysm :)', 'thank you so much', 'much appreciated.',
+    'very helpful', 'ty_for_this', '(thanks)', 'thanks2', 'xthanks', 'thanksgiving', 'party',
+    'tyty', 'thank  you', 'thankyou', 'éthanks', 'thanksé', '1ty', 'ty1', '', 'nothing here',
+    'thx-thx', 'ok ty\nbye', 'unhelpful', 'helpfulness', 'thank you!!', 'ty, thx',
+]
+
+
+def test_matches_the_legacy_scan_on_known_cases():
+    matcher = get_matcher(DEFAULT_TRIGGERS)
+    for content in CASES:
+        assert matcher.matches(content) == _legacy_contains(content, DEFAULT_TRIGGERS), content
+
+
+def test_matches_the_legacy_scan_on_random_text():
+    # Text built from trigger fragments and every kind of boundary, so the
+    # near misses the grouped pattern has to reject come up often.
+    rng = random.Random(4)
+    pieces = list(DEFAULT_TRIGGERS) + ['t', 'th', 'than', 'y', 'x', 'h', 'k', 'ys', 'ful', 'you', 'a.b', 'c++', 'b']
+    separators = [' ', '', '', '_', '-', '.', '!', '1', 'a', 'é', '\n', "'"]
+    triggers = normalize_triggers(DEFAULT_TRIGGERS + ('a.b', 'c++'))
+    matcher = TriggerMatcher(triggers)
+    for _ in range(5000):
+        parts = [rng.choice(pieces) + rng.choice(separators) for _ in range(rng.randint(1, 5))]
+        content = ''.join(part.upper() if rng.random() < 0.2 else part for part in parts)
+        assert matcher.matches(content) == _legacy_contains(content, triggers), content
+
+
+def test_normalizes_and_caches_trigger_lists():
+    assert normalize_triggers([' Thanks ', 'thanks', '', '  ', 'TY']) == ('thanks', 'ty')
+    assert get_matcher(('ty', 'thx')) is get_matcher(('ty', 'thx'))
+    assert not TriggerMatcher([]).matches('thanks')
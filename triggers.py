@@ -0,0 +1,48 @@
+import functools
+import re
+from typing import Dict, Iterable, List, Tuple
+
+DEFAULT_TRIGGERS = ('thanks', 'ty', 'tysm', 'thank you', 'appreciated', 'thx', 'helpful')
+
+
+class TriggerMatcher:
+    # A trigger counts when it isn't glued to a letter or digit on either
+    # side; punctuation and underscores are boundaries, same as the old
+    # find()-based scan. All triggers are folded into one pattern so each
+    # message is scanned once. Branches are grouped by first character and
+    # the left-boundary lookbehind runs only after that character matched,
+    # which keeps the engine from evaluating it at every offset.
+    def __init__(self, triggers: Iterable[str]):
+        self.triggers = normalize_triggers(triggers)
+        self.pattern = re.compile(_build_pattern(self.triggers)) if self.triggers else None
+
+    def matches(self, content: str) -> bool:
+        return self.pattern is not None and self.pattern.search(content.lower()) is not None
+
+    def __repr__(self) -> str:
+        return f"TriggerMatcher({list(self.triggers)!r})"
+
+
+def _build_pattern(triggers: Tuple[str, ...]) -> str:
+    by_first: Dict[str, List[str]] = {}
+    for trigger in triggers:
+        by_first.setdefault(trigger[0], []).append(trigger[1:])
+    branches = []
+    for first, rests in by_first.items():
+        head = re.escape(first)
+        tail = '|'.join(re.escape(rest) for rest in sorted(rests, key=len, reverse=True))
+        branches.append(rf'{head}(?<![^\W_]{head})(?:{tail})')
+    return '(?:' + '|'.join(branches) + r')(?![^\W_])'
+
+
+def normalize_triggers(triggers: Iterable[str]) -> Tuple[str, ...]:
+    return tuple(sorted({trigger.strip().lower() for trigger in triggers if trigger and trigger.strip()}))
+
+
+@functools.lru_cache(maxsize=1024)
+def _compiled(triggers: Tuple[str, ...]) -> TriggerMatcher:
+    return TriggerMatcher(triggers)
+
+
+def get_matcher(triggers: Iterable[str] = DEFAULT_TRIGGERS) -> TriggerMatcher:
+    return _compiled(tuple(triggers))